@@ -98,13 +98,20 @@ async def upload_document(file: UploadFile = File(...)):
         
         # Index in vector store
         result = await vector_store.add_document_async(processed_doc)
+        if result.get("status") == "error":
+            raise ValueError(result["message"])
+        
+        if result.get("unchanged"):
+            message = f"{file.filename} is already indexed"
+        else:
+            message = f"Successfully indexed {result['chunks_indexed']} chunks from {file.filename}"
         
         return UploadResponse(
             status="success",
             doc_id=result["doc_id"],
             filename=file.filename,
             chunks_indexed=result["chunks_indexed"],
-            message=f"Successfully indexed {result['chunks_indexed']} chunks from {file.filename}"
+            message=message
         )
         
     except ValueError as e:
@@ -181,7 +188,7 @@ async def search_document(
     top_k: int = Query(5, ge=1, le=20, description="Number of results")
 ):
     """Search within a specific document."""
-    results = vector_store.search(query=query, top_k=top_k, filter_doc_id=doc_id)
+    results = await vector_store.search_async(query=query, top_k=top_k, filter_doc_id=doc_id)
     
     return {
         "query": query,
@@ -0,0 +1,46 @@
+"""
+Factory for the VectorStore's optional ANN index.
+Selected with the vector_index setting; "flat" keeps exact search.
+"""
+
+from typing import Any, Optional
+from .ann_index import BaseANNIndex
+from .ivf_index import IVFIndex
+from .hnsw_index import HNSWIndex
+from .quantized_index import ScalarQuantizedIndex
+from .binary_index import BinaryIndex
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "int8", "binary")
+
+
+def create_ann_index(kind: str, config: Any) -> Optional[BaseANNIndex]:
+    """
+    Create an empty ANN index of the given kind.
+
+    Args:
+        kind: Index type (flat, ivf, hnsw, int8, binary)
+        config: Settings object; index parameters are read with defaults
+
+    Returns:
+        A new index, or None for exact (flat) search
+    """
+    if kind == "flat":
+        return None
+    elif kind == "ivf":
+        return IVFIndex(
+            nlist=getattr(config, "ivf_nlist", 0),
+            nprobe=getattr(config, "ivf_nprobe", 8),
+            iterations=getattr(config, "ivf_iterations", 10)
+        )
+    elif kind == "hnsw":
+        return HNSWIndex(
+            m=getattr(config, "hnsw_m", 16),
+            ef_construction=getattr(config, "hnsw_ef_construction", 100),
+            ef_search=getattr(config, "hnsw_ef_search", 64)
+        )
+    elif kind == "int8":
+        return ScalarQuantizedIndex(rerank=getattr(config, "quantized_rerank", 200))
+    elif kind == "binary":
+        return BinaryIndex(candidates=getattr(config, "binary_candidates", 300))
+    else:
+        raise ValueError(f"Unknown vector index: {kind}")
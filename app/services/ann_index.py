@@ -0,0 +1,135 @@
+"""
+Approximate nearest-neighbour (ANN) indexes for the VectorStore.
+
+An ANN index only proposes candidate rows; the VectorStore rescores those
+rows exactly against its normalized embedding matrix, so an index trades a
+little recall for not touching every row on each query.
+Kept free of app imports, like vector_math.
+"""
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Any, Optional, Iterable
+import numpy as np
+from .vector_math import matmul_rows, top_k_indices
+
+
+class BaseANNIndex(ABC):
+    """Abstract base class for ANN indexes over unit-length float32 rows."""
+
+    name = "base"
+    # Whether save()/load() are implemented
+    persistent = False
+
+    @property
+    @abstractmethod
+    def size(self) -> int:
+        """Number of rows covered by the index."""
+        pass
+
+    @abstractmethod
+    def build(self, vectors: np.ndarray):
+        """
+        (Re)build the index from scratch over rows 0..len(vectors)-1.
+
+        Args:
+            vectors: (n, dim) matrix of unit-length rows
+        """
+        pass
+
+    @abstractmethod
+    def add(self, start: int, vectors: np.ndarray):
+        """
+        Index rows start..start+len(vectors)-1 appended after the last build.
+
+        Args:
+            start: Row number of the first new vector (must equal size)
+            vectors: (m, dim) matrix of unit-length rows
+        """
+        pass
+
+    @abstractmethod
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        """
+        Propose candidate rows for a unit-length query.
+
+        Args:
+            query: (dim,) query vector
+            k: Number of results the caller will keep
+
+        Returns:
+            Array of row numbers, a superset the caller rescores exactly
+        """
+        pass
+
+    def search_within(self, query: np.ndarray, k: int, vectors: np.ndarray, size: int) -> np.ndarray:
+        """
+        search() for a reader's snapshot: rows :size of vectors.
+
+        Indexes that read rows at query time must not follow rows a writer
+        appends meanwhile; the others return search() and leave filtering
+        rows >= size to the caller.
+        """
+        return self.search(query, k)
+
+    def attach(self, vectors: np.ndarray):
+        """Point the index at the store's current matrix (indexes that read rows at query time)."""
+        pass
+
+    @abstractmethod
+    def remove(self, rows: Iterable[int]):
+        """Stop returning the given rows; row numbers of other rows are unchanged."""
+        pass
+
+    def save(self, path: Path, fingerprint: str):
+        """Write the index to path, tagged with a fingerprint of the rows it covers."""
+        raise NotImplementedError(f"{self.name} index cannot be persisted")
+
+    def load(self, path: Path) -> Optional[str]:
+        """Read an index written by save(); returns its fingerprint, or None if unusable."""
+        raise NotImplementedError(f"{self.name} index cannot be persisted")
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """True once incremental adds have degraded the index enough to retrain."""
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Index parameters and sizes for get_stats()."""
+        return {"type": self.name, "size": self.size}
+
+
+def measure_recall(
+    index: BaseANNIndex,
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10
+) -> Optional[float]:
+    """
+    Mean recall@k of index-assisted search against exact search.
+
+    Candidates proposed by the index are rescored exactly (as the
+    VectorStore does), so this measures what the index loses, not
+    scoring error.
+
+    Args:
+        index: Index built over vectors
+        vectors: (n, dim) matrix of unit-length rows
+        queries: (q, dim) matrix of unit-length query vectors
+        k: Results per query
+
+    Returns:
+        Recall in [0, 1], or None when there is nothing to measure
+    """
+    if len(vectors) == 0 or len(queries) == 0:
+        return None
+
+    k = min(k, len(vectors))
+    exact_scores = matmul_rows(queries, vectors)
+    found = 0
+    for query, scores in zip(queries, exact_scores):
+        exact = set(top_k_indices(scores, k).tolist())
+        rows = index.search(query, k)
+        approx = rows[top_k_indices(scores[rows], k)]
+        found += len(exact.intersection(approx.tolist()))
+    return found / (k * len(queries))
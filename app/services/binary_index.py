@@ -0,0 +1,91 @@
+"""
+Sign-bit binary index.
+
+Each row is reduced to one bit per dimension (its sign), packed eight to a
+byte with np.packbits: 1/32 of the float32 matrix. A query is compared to
+every code by Hamming distance (XOR plus a popcount lookup table), and only
+the few hundred closest rows are rescored with exact cosine by the
+VectorStore.
+"""
+
+from typing import Dict, Any
+import numpy as np
+from .ann_index import BaseANNIndex
+from .vector_math import RowBuffer, top_k_indices
+
+# Set bits in every byte value
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Codes compared per step, bounding the XOR/lookup temporaries
+_HAMMING_BLOCK = 65536
+
+
+def pack_signs(vectors: np.ndarray) -> np.ndarray:
+    """One bit per dimension (1 = positive), packed into uint8 rows."""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+class BinaryIndex(BaseANNIndex):
+    """Packed sign-bit codes searched by Hamming distance."""
+
+    name = "binary"
+
+    def __init__(self, candidates: int = 300):
+        """
+        Args:
+            candidates: Rows kept from the Hamming pass (at least 10*k) for exact rescoring
+        """
+        self.candidates = candidates
+        self._codes = np.empty((0, 0), dtype=np.uint8)
+        self._code_buffer = RowBuffer()
+        self._size = 0
+        self._deleted = set()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def build(self, vectors: np.ndarray):
+        n = len(vectors)
+        codes = [pack_signs(vectors[i:i + _HAMMING_BLOCK]) for i in range(0, n, _HAMMING_BLOCK)]
+        self._codes = np.concatenate(codes) if codes else np.empty((0, 0), dtype=np.uint8)
+        self._code_buffer = RowBuffer(self._codes if n else None)
+        self._size = n
+        self._deleted = set()
+
+    def add(self, start: int, vectors: np.ndarray):
+        if start != self._size:
+            raise ValueError(f"Rows must be added in order (expected {self._size}, got {start})")
+        # Sign bits need no training, so appended rows are coded exactly like built ones
+        self._codes = self._code_buffer.append(pack_signs(vectors))
+        self._size += len(vectors)
+
+    def remove(self, rows):
+        self._deleted.update(int(r) for r in rows)
+
+    def distances(self, query: np.ndarray) -> np.ndarray:
+        """Hamming distance from the query's sign bits to every row."""
+        query_code = pack_signs(query.reshape(1, -1))[0]
+        distances = np.empty(self._size, dtype=np.int32)
+        for i in range(0, self._size, _HAMMING_BLOCK):
+            block = np.bitwise_xor(self._codes[i:i + _HAMMING_BLOCK], query_code)
+            distances[i:i + len(block)] = POPCOUNT_TABLE[block].sum(axis=1, dtype=np.int32)
+        return distances
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # Negated so the closest codes score highest
+        scores = -self.distances(query)
+        if self._deleted:
+            scores[list(self._deleted)] = np.iinfo(np.int32).min
+        rows = top_k_indices(scores, max(self.candidates, 10 * k))
+        if self._deleted:
+            rows = rows[~np.isin(rows, list(self._deleted))]
+        return np.sort(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({"candidates": self.candidates, "code_bytes": int(self._codes.nbytes)})
+        return stats
@@ -0,0 +1,210 @@
+"""
+Embedding caches.
+
+EmbeddingCache persists chunk embeddings in a small SQLite file keyed by
+(embedding model, sha256 of the chunk text), so re-indexing an unchanged
+corpus or re-uploading the same rulebook skips the embedding service.
+
+QueryEmbeddingCache is an in-memory LRU/TTL cache for query vectors, so
+repeated questions skip the embedding round trip.
+"""
+
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Optional, Callable, Awaitable
+
+from langchain_core.embeddings import Embeddings
+
+CACHE_FILE = "embedding_cache.sqlite3"
+
+# SQLite's default limit on bound parameters is 999
+_QUERY_CHUNK = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed map of (model, sha256(text)) -> float32 vector."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL,"
+                " text_hash TEXT NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, text_hash))"
+            )
+            self._conn.commit()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors for texts, in order; None where there is no entry."""
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, bytes] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), _QUERY_CHUNK):
+                chunk = unique[i:i + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk]
+                ).fetchall()
+                found.update(rows)
+        return [
+            np.frombuffer(found[h], dtype=np.float32).tolist() if h in found else None
+            for h in hashes
+        ]
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """Store vectors for texts (one transaction)."""
+        rows = [
+            (model, text_hash(t), np.asarray(v, dtype=np.float32).tobytes())
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def _split(self, model: str, texts: List[str]):
+        cached = self.get_many(model, texts)
+        # Each distinct missing text is embedded once
+        missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        return cached, missing
+
+    def _fill(self, model: str, texts: List[str], cached, missing, computed):
+        if missing:
+            self.put_many(model, missing, computed)
+        by_text = dict(zip(missing, computed))
+        return [v if v is not None else by_text[t] for t, v in zip(texts, cached)]
+
+    def get_or_embed(
+        self,
+        model: str,
+        texts: List[str],
+        embed_fn: Callable[[List[str]], List[List[float]]]
+    ) -> List[List[float]]:
+        """Return embeddings for texts, calling embed_fn only for cache misses."""
+        cached, missing = self._split(model, texts)
+        computed = embed_fn(missing) if missing else []
+        return self._fill(model, texts, cached, missing, computed)
+
+    async def get_or_embed_async(
+        self,
+        model: str,
+        texts: List[str],
+        embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]]
+    ) -> List[List[float]]:
+        """Async variant of get_or_embed."""
+        cached, missing = self._split(model, texts)
+        computed = await embed_fn(missing) if missing else []
+        return self._fill(model, texts, cached, missing, computed)
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of normalized query text -> float32 vector, with a TTL.
+
+    Entries belong to one embedding model; asking for a different model
+    drops everything cached so far.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._model: Optional[str] = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def _check_model(self, model: str):
+        if model != self._model:
+            self._entries.clear()
+            self._model = model
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        key = self.normalize(text)
+        with self._lock:
+            self._check_model(model)
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, vector: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        key = self.normalize(text)
+        with self._lock:
+            self._check_model(model)
+            self._entries[key] = (vector, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(directory) -> EmbeddingCache:
+    """Shared EmbeddingCache for the cache file under directory."""
+    path = str(Path(directory) / CACHE_FILE)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path)
+        return _caches[path]
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain Embeddings wrapper that consults an EmbeddingCache first."""
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.get_or_embed(self.model, texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.cache.get_or_embed_async(self.model, texts, self.embeddings.aembed_documents)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
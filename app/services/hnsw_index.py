@@ -0,0 +1,293 @@
+"""
+Hierarchical Navigable Small World (HNSW) graph index in pure Python/NumPy.
+
+Every row is a node linked to its M nearest neighbours (2*M on the bottom
+layer); a random subset of nodes also appears on sparser upper layers. A
+query greedily descends the layers and runs a best-first search of width
+ef_search on the bottom layer, touching O(log n) nodes instead of every row.
+
+Rows are inserted one at a time, so documents added after the build are
+linked in place. Removed rows stay in the graph as routing nodes but are
+never returned. Readers may walk the graph while a writer links new rows:
+search_within() only follows links to rows below the caller's snapshot
+size and only reads that snapshot's matrix.
+"""
+
+import os
+import heapq
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Set, Tuple
+from .ann_index import BaseANNIndex
+
+
+class HNSWIndex(BaseANNIndex):
+    """HNSW graph over the rows of a (bound) unit-length float32 matrix."""
+
+    name = "hnsw"
+    persistent = True
+
+    def __init__(self, m: int = 16, ef_construction: int = 100, ef_search: int = 64, seed: int = 0):
+        """
+        Args:
+            m: Links per node on the upper layers (2*m on layer 0)
+            ef_construction: Search width used while linking a new node
+            ef_search: Search width used at query time (raised to k if smaller)
+            seed: Seed for the random layer assignment
+        """
+        self.m = max(2, m)
+        self.m0 = 2 * self.m
+        self.ef_construction = max(ef_construction, self.m)
+        self.ef_search = ef_search
+        self._level_mult = 1.0 / np.log(self.m)
+        self._rng = np.random.default_rng(seed)
+        self._vectors: Optional[np.ndarray] = None
+        self._reset(0)
+
+    def _reset(self, capacity: int):
+        self._size = 0
+        self._entry = -1
+        self._max_level = -1
+        # (row, level) of every entry point in turn, so a reader can start
+        # from the newest one that its snapshot already contains
+        self._entry_points: List[Tuple[int, int]] = []
+        self._levels: List[int] = []
+        # Bottom layer as a fixed-width matrix (-1 = empty slot) so a node's
+        # links are one slice; upper layers are small dicts of node -> links
+        self._layer0 = np.full((max(capacity, 16), self.m0), -1, dtype=np.int32)
+        self._layer0_count = np.zeros(len(self._layer0), dtype=np.int32)
+        self._upper: List[Dict[int, List[int]]] = []
+        self._deleted: Set[int] = set()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def needs_rebuild(self) -> bool:
+        # Mostly-dead graphs waste search effort on routing through removed rows
+        return self._size > 0 and len(self._deleted) > self._size // 2
+
+    def attach(self, vectors: np.ndarray):
+        self._vectors = vectors
+
+    def build(self, vectors: np.ndarray):
+        self._reset(len(vectors))
+        self._vectors = vectors
+        for row in range(len(vectors)):
+            self._insert(row)
+
+    def add(self, start: int, vectors: np.ndarray):
+        if start != self._size:
+            raise ValueError(f"Rows must be added in order (expected {self._size}, got {start})")
+        if self._vectors is None or len(self._vectors) < start + len(vectors):
+            raise ValueError("HNSW index must be attached to a matrix holding the new rows")
+        for row in range(start, start + len(vectors)):
+            self._insert(row)
+
+    def remove(self, rows):
+        self._deleted.update(int(r) for r in rows)
+
+    def _random_level(self) -> int:
+        return int(-np.log(1.0 - self._rng.random()) * self._level_mult)
+
+    def _neighbors(self, node: int, level: int) -> List[int]:
+        if level == 0:
+            return self._layer0[node, :self._layer0_count[node]].tolist()
+        return self._upper[level - 1].get(node, [])
+
+    def _set_neighbors(self, node: int, level: int, links: List[int]):
+        if level == 0:
+            self._layer0[node, :len(links)] = links
+            self._layer0[node, len(links):] = -1
+            self._layer0_count[node] = len(links)
+        else:
+            self._upper[level - 1][node] = list(links)
+
+    def _ensure_capacity(self, size: int):
+        if size <= len(self._layer0):
+            return
+        capacity = max(size, 2 * len(self._layer0))
+        layer0 = np.full((capacity, self.m0), -1, dtype=np.int32)
+        layer0[:len(self._layer0)] = self._layer0
+        counts = np.zeros(capacity, dtype=np.int32)
+        counts[:len(self._layer0_count)] = self._layer0_count
+        self._layer0, self._layer0_count = layer0, counts
+
+    def _search_layer(self, query: np.ndarray, entries: List[int], ef: int, level: int,
+                      vectors: Optional[np.ndarray] = None, size: Optional[int] = None) -> List[Tuple[float, int]]:
+        """Best-first search on one layer; returns up to ef (similarity, node) pairs.
+
+        Only nodes below size (default: every row of vectors) are visited;
+        links to rows a writer is adding concurrently are skipped.
+        """
+        vectors = self._vectors if vectors is None else vectors
+        size = len(vectors) if size is None else size
+        visited = set(entries)
+        sims = (vectors[entries] @ query).tolist()
+        candidates = [(-s, e) for s, e in zip(sims, entries)]
+        heapq.heapify(candidates)
+        results = [(s, e) for s, e in zip(sims, entries)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+            fresh = [n for n in self._neighbors(node, level) if 0 <= n < size and n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            # One matrix-vector product per expanded node
+            for n, s in zip(fresh, (vectors[fresh] @ query).tolist()):
+                if len(results) < ef or s > results[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(results, (s, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return results
+
+    def _select(self, candidates: List[Tuple[float, int]], limit: int) -> List[int]:
+        """Neighbour-selection heuristic: keep a candidate only if it is closer to
+        the new node than to every neighbour already kept, which spreads links
+        across directions; remaining slots are filled by plain similarity."""
+        ranked = sorted(candidates, reverse=True)
+        if len(ranked) <= limit:
+            return [n for _, n in ranked]
+        nodes = [n for _, n in ranked]
+        pairwise = self._vectors[nodes] @ self._vectors[nodes].T
+        kept: List[int] = []
+        for i, (sim, _) in enumerate(ranked):
+            if not kept or pairwise[i, kept].max() < sim:
+                kept.append(i)
+                if len(kept) == limit:
+                    break
+        if len(kept) < limit:
+            chosen = set(kept)
+            kept.extend([i for i in range(len(nodes)) if i not in chosen][:limit - len(kept)])
+        return [nodes[i] for i in kept]
+
+    def _insert(self, row: int):
+        self._ensure_capacity(row + 1)
+        level = self._random_level()
+        self._levels.append(level)
+        self._size = row + 1
+        while len(self._upper) < level:
+            self._upper.append({})
+
+        if self._entry < 0:
+            self._entry_points.append((row, level))
+            self._entry, self._max_level = row, level
+            return
+
+        query = self._vectors[row]
+        entry = self._entry
+        for current in range(self._max_level, level, -1):
+            entry = max(self._search_layer(query, [entry], 1, current))[1]
+
+        for current in range(min(level, self._max_level), -1, -1):
+            found = self._search_layer(query, [entry], self.ef_construction, current)
+            limit = self.m0 if current == 0 else self.m
+            links = self._select(found, self.m)
+            self._set_neighbors(row, current, links)
+
+            # Link back, pruning any neighbour that now has too many links
+            for n in links:
+                n_links = self._neighbors(n, current)
+                if len(n_links) < limit:
+                    self._set_neighbors(n, current, n_links + [row])
+                else:
+                    pool = n_links + [row]
+                    sims = (self._vectors[pool] @ self._vectors[n]).tolist()
+                    self._set_neighbors(n, current, self._select(list(zip(sims, pool)), limit))
+            entry = max(found)[1]
+
+        if level > self._max_level:
+            self._entry_points.append((row, level))
+            self._entry, self._max_level = row, level
+
+    def search(self, query: np.ndarray, k: int, ef_search: Optional[int] = None) -> np.ndarray:
+        if self._vectors is None:
+            return np.empty(0, dtype=np.int64)
+        return self.search_within(query, k, self._vectors, min(self._size, len(self._vectors)), ef_search)
+
+    def search_within(self, query: np.ndarray, k: int, vectors: np.ndarray, size: int,
+                      ef_search: Optional[int] = None) -> np.ndarray:
+        # The newest entry point the snapshot holds is the top node among its rows
+        point = next(((row, level) for row, level in reversed(self._entry_points) if row < size), None)
+        if point is None or vectors is None:
+            return np.empty(0, dtype=np.int64)
+
+        ef = max(ef_search or self.ef_search, k)
+        entry, top = point
+        for level in range(top, 0, -1):
+            entry = max(self._search_layer(query, [entry], 1, level, vectors, size))[1]
+
+        # Widen the bottom-layer search by the removed rows it is likely to meet
+        deleted = len(self._deleted)
+        if deleted:
+            ef = min(size, int(ef * size / max(1, size - deleted)) + 1)
+        found = self._search_layer(query, [entry], ef, 0, vectors, size)
+        rows = [n for _, n in found if n not in self._deleted]
+        return np.sort(np.asarray(rows, dtype=np.int64))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({
+            "m": self.m,
+            "ef_search": self.ef_search,
+            "levels": self._max_level + 1,
+            "deleted": len(self._deleted)
+        })
+        return stats
+
+    def save(self, path: Path, fingerprint: str):
+        arrays = {
+            "params": np.array([self.m, self.ef_construction, self._size, self._entry, self._max_level]),
+            "fingerprint": np.array(fingerprint),
+            "levels": np.asarray(self._levels, dtype=np.int8),
+            "layer0": self._layer0[:self._size],
+            "layer0_count": self._layer0_count[:self._size],
+            "deleted": np.asarray(sorted(self._deleted), dtype=np.int64),
+        }
+        for i, layer in enumerate(self._upper):
+            nodes = sorted(layer)
+            links = np.full((len(nodes), self.m), -1, dtype=np.int32)
+            for j, node in enumerate(nodes):
+                links[j, :len(layer[node])] = layer[node]
+            arrays[f"upper{i + 1}_nodes"] = np.asarray(nodes, dtype=np.int64)
+            arrays[f"upper{i + 1}_links"] = links
+
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, path: Path) -> Optional[str]:
+        with np.load(path, allow_pickle=False) as data:
+            m, ef_construction, size, entry, max_level = (int(v) for v in data["params"])
+            if m != self.m:
+                return None  # Built with a different M; caller rebuilds
+            self.ef_construction = ef_construction
+            self._reset(size)
+            self._size, self._entry, self._max_level = size, entry, max_level
+            if entry >= 0:
+                self._entry_points = [(entry, max_level)]
+            self._levels = data["levels"].astype(int).tolist()
+            self._layer0[:size] = data["layer0"]
+            self._layer0_count[:size] = data["layer0_count"]
+            self._deleted = set(data["deleted"].tolist())
+            level = 1
+            while f"upper{level}_nodes" in data:
+                links = data[f"upper{level}_links"]
+                self._upper.append({
+                    int(node): [int(n) for n in row if n >= 0]
+                    for node, row in zip(data[f"upper{level}_nodes"], links)
+                })
+                level += 1
+            return str(data["fingerprint"])
@@ -0,0 +1,151 @@
+"""
+Inverted-file (IVF) index.
+
+Rows are clustered around nlist coarse centroids trained with spherical
+k-means; a query scans only the rows of its nprobe closest centroids
+instead of the whole matrix.
+"""
+
+from typing import List, Dict, Any, Optional
+import numpy as np
+from .ann_index import BaseANNIndex
+from .vector_math import RowBuffer, top_k_indices
+
+# Rows scored against the centroids per matmul when assigning lists
+_ASSIGN_BLOCK = 65536
+
+
+class IVFIndex(BaseANNIndex):
+    """Coarse-quantizer index: k-means centroids plus one row-id list per centroid."""
+
+    name = "ivf"
+
+    def __init__(
+        self,
+        nlist: int = 0,
+        nprobe: int = 8,
+        iterations: int = 10,
+        train_per_list: int = 64,
+        seed: int = 0
+    ):
+        """
+        Args:
+            nlist: Number of lists (centroids); 0 picks about sqrt(n) at build time
+            nprobe: Lists scanned per query
+            iterations: k-means iterations
+            train_per_list: Training sample size per centroid (caps k-means cost)
+            seed: Seed for centroid initialisation and sampling
+        """
+        self.nlist = nlist
+        self.nprobe = max(1, nprobe)
+        self.iterations = iterations
+        self.train_per_list = train_per_list
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[RowBuffer] = []
+        self._size = 0
+        self._trained_size = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def needs_rebuild(self) -> bool:
+        # Centroids trained on half the data no longer partition it well
+        return self._trained_size > 0 and self._size > 2 * self._trained_size
+
+    def build(self, vectors: np.ndarray):
+        n = len(vectors)
+        nlist = self.nlist or int(round(np.sqrt(n)))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(self.seed)
+
+        sample_size = nlist * self.train_per_list
+        if n > sample_size:
+            sample = np.asarray(vectors[np.sort(rng.choice(n, sample_size, replace=False))])
+        else:
+            sample = np.asarray(vectors)
+        self.centroids = self._kmeans(sample, nlist, rng)
+
+        # Group row ids by list with one sort instead of a Python loop per row
+        assignments = self._assign(vectors)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self._lists = [RowBuffer(order[bounds[c]:bounds[c + 1]]) for c in range(nlist)]
+        self._size = n
+        self._trained_size = n
+
+    def _kmeans(self, sample: np.ndarray, nlist: int, rng: np.random.Generator) -> np.ndarray:
+        """Spherical k-means: centroids are renormalized means of their rows."""
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].astype(np.float32)
+        for _ in range(self.iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(assignments, minlength=nlist)
+            order = np.argsort(assignments, kind="stable")
+            filled = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts[filled])[:-1]))
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(sample[order], starts, axis=0)
+
+            # Re-seed empty lists from random rows so nlist stays fixed
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(len(sample), len(empty))]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Index of the closest centroid for every row."""
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for i in range(0, len(vectors), _ASSIGN_BLOCK):
+            block = np.asarray(vectors[i:i + _ASSIGN_BLOCK])
+            assignments[i:i + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def add(self, start: int, vectors: np.ndarray):
+        if self.centroids is None:
+            raise ValueError("IVF index must be built before adding rows")
+        if start != self._size:
+            raise ValueError(f"Rows must be added in order (expected {self._size}, got {start})")
+        if len(vectors) == 0:
+            return
+
+        assignments = self._assign(vectors)
+        rows = np.arange(start, start + len(vectors))
+        for c in np.unique(assignments):
+            self._lists[c].append(rows[assignments == c])
+        self._size += len(vectors)
+
+    def remove(self, rows):
+        rows = np.fromiter(rows, dtype=np.int64)
+        self._lists = [RowBuffer(lst.view()[~np.isin(lst.view(), rows)]) for lst in self._lists]
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> np.ndarray:
+        if self.centroids is None:
+            return np.empty(0, dtype=np.int64)
+
+        nprobe = min(nprobe or self.nprobe, len(self._lists))
+        order = top_k_indices(self.centroids @ query, len(self._lists))
+
+        # Probe nprobe lists, continuing past that only if they hold fewer than k rows
+        selected = []
+        found = 0
+        for i, c in enumerate(order):
+            if i >= nprobe and found >= k:
+                break
+            selected.append(self._lists[c].view())
+            found += len(self._lists[c])
+        if not selected:
+            return np.empty(0, dtype=np.int64)
+        # Row order keeps ties ranked as in exact search and gathers rows sequentially
+        return np.sort(np.concatenate(selected))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({"nlist": len(self._lists), "nprobe": self.nprobe})
+        return stats
@@ -0,0 +1,113 @@
+"""
+BM25 keyword index for the VectorStore's hybrid search leg.
+
+Built at ingest time (token -> postings with term frequencies) so a keyword
+query only touches the rows that contain its terms, and results are ranked
+by BM25 rather than returned in scan order.
+"""
+
+import re
+from bisect import bisect_left
+import numpy as np
+from collections import Counter, defaultdict
+from typing import List, Dict, Tuple, Iterable, Optional
+from .vector_math import top_k_indices
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; rule numbers like 1102A become '1102a'."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring.
+
+    Postings are appended in row order; rows must be added in increasing order.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.clear()
+
+    def clear(self):
+        # token -> (rows, term frequencies, row lengths), one entry per row containing it
+        self._postings: Dict[str, Tuple[List[int], List[int], List[int]]] = defaultdict(lambda: ([], [], []))
+        self._size = 0
+        self._total_length = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def rebuild(self, texts: Iterable[str]):
+        """Re-index from scratch, numbering rows from 0."""
+        self.clear()
+        for row, text in enumerate(texts):
+            self.add(row, text)
+
+    def add(self, row: int, text: str):
+        """Index the text of one row."""
+        if row != self._size:
+            raise ValueError(f"Rows must be added in order (expected {self._size}, got {row})")
+        tokens = tokenize(text)
+        self._size += 1
+        self._total_length += len(tokens)
+        for token, tf in Counter(tokens).items():
+            rows, tfs, lengths = self._postings[token]
+            rows.append(row)
+            tfs.append(tf)
+            lengths.append(len(tokens))
+
+    def score(self, terms: Iterable[str], size: Optional[int] = None) -> np.ndarray:
+        """BM25 score of every row for the given query terms (0 for non-matching rows).
+
+        size limits scoring to rows 0..size-1 (a reader's snapshot), ignoring
+        rows a concurrent writer is still appending.
+        """
+        n = self._size if size is None else min(size, self._size)
+        scores = np.zeros(n, dtype=np.float32)
+        if n == 0:
+            return scores
+
+        avg_length = max(self._total_length / n, 1.0)
+        query_tokens = set()
+        for term in terms:
+            query_tokens.update(tokenize(term))
+
+        # Work is proportional to the postings of the query tokens, not the corpus
+        for token in query_tokens:
+            if token not in self._postings:
+                continue
+            rows, tfs, lengths = self._postings[token]
+            # Postings are in row order, so rows beyond n are a suffix
+            count = bisect_left(rows, n)
+            if count == 0:
+                continue
+            rows = np.asarray(rows[:count])
+            tfs = np.asarray(tfs[:count], dtype=np.float32)
+            length_norm = self.k1 * (1.0 - self.b + self.b * np.asarray(lengths[:count], dtype=np.float32) / avg_length)
+            df = len(rows)
+            idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1.0) / (tfs + length_norm)
+        return scores
+
+    def search(
+        self,
+        terms: Iterable[str],
+        top_k: int = 10,
+        exclude: Optional[np.ndarray] = None,
+        size: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """Return up to top_k (row, score) pairs, best first, for rows matching any term.
+
+        exclude is an optional boolean mask of rows (e.g. deleted ones) never to return;
+        size limits the search to rows 0..size-1, as in score().
+        """
+        scores = self.score(terms, size)
+        if exclude is not None:
+            scores[exclude[:len(scores)]] = 0.0
+        top = top_k_indices(scores, top_k, min_score=np.finfo(np.float32).tiny)
+        return [(int(row), float(scores[row])) for row in top]
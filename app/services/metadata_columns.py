@@ -0,0 +1,250 @@
+"""
+Columnar chunk metadata and filter expressions for the VectorStore.
+
+doc_id and subject_role are dictionary-encoded into integer columns,
+page and section_id are integer columns (-1 when missing) and topic_tags
+is a 64-bit mask per row. A filter expression evaluates to one boolean
+mask over all rows, which the vector search applies to its score vector
+instead of copying the matching rows of the embedding matrix.
+
+    where = In("subject_role", ["coach", "general"]) & Range("section_id", 7200, 7299)
+    vector_store.search(question, where=where)
+"""
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import reduce
+from typing import List, Dict, Any, Optional, Iterable
+import numpy as np
+from .vector_math import RowBuffer
+
+MISSING = -1
+CODED_FIELDS = ("doc_id", "subject_role")
+NUMERIC_FIELDS = ("page", "section_id")
+TAG_FIELD = "topic_tags"
+# Tags beyond the 64 that fit in the bitmask fall back to row lists
+MAX_TAG_BITS = 64
+
+
+class Filter(ABC):
+    """Abstract base class for filter expressions; combine with & and |."""
+
+    @abstractmethod
+    def mask(self, columns: "MetadataColumns", size: Optional[int] = None) -> np.ndarray:
+        """Boolean mask over the first size rows of columns (default: all of them)."""
+        pass
+
+    def __and__(self, other: "Filter") -> "Filter":
+        return And(self, other)
+
+    def __or__(self, other: "Filter") -> "Filter":
+        return Or(self, other)
+
+
+class Eq(Filter):
+    """field == value (for topic_tags: the row carries the tag)."""
+
+    def __init__(self, field: str, value: Any):
+        self.field = field
+        self.value = value
+
+    def mask(self, columns, size=None):
+        return columns.isin(self.field, [self.value], size)
+
+    def __repr__(self):
+        return f"Eq({self.field!r}, {self.value!r})"
+
+
+class In(Filter):
+    """field is one of values (for topic_tags: the row carries any of them)."""
+
+    def __init__(self, field: str, values: Iterable[Any]):
+        self.field = field
+        self.values = list(values)
+
+    def mask(self, columns, size=None):
+        return columns.isin(self.field, self.values, size)
+
+    def __repr__(self):
+        return f"In({self.field!r}, {self.values!r})"
+
+
+class Range(Filter):
+    """low <= field <= high on a numeric field; either bound may be None."""
+
+    def __init__(self, field: str, low: Optional[int] = None, high: Optional[int] = None):
+        self.field = field
+        self.low = low
+        self.high = high
+
+    def mask(self, columns, size=None):
+        return columns.between(self.field, self.low, self.high, size)
+
+    def __repr__(self):
+        return f"Range({self.field!r}, {self.low!r}, {self.high!r})"
+
+
+class HasTag(Filter):
+    """The row's topic_tags contain tag."""
+
+    def __init__(self, tag: Any):
+        self.tag = tag
+
+    def mask(self, columns, size=None):
+        return columns.isin(TAG_FIELD, [self.tag], size)
+
+    def __repr__(self):
+        return f"HasTag({self.tag!r})"
+
+
+class And(Filter):
+    def __init__(self, *filters: Filter):
+        self.filters = filters
+
+    def mask(self, columns, size=None):
+        size = len(columns) if size is None else size
+        return reduce(np.logical_and, (f.mask(columns, size) for f in self.filters))
+
+    def __repr__(self):
+        return f"And{self.filters!r}"
+
+
+class Or(Filter):
+    def __init__(self, *filters: Filter):
+        self.filters = filters
+
+    def mask(self, columns, size=None):
+        size = len(columns) if size is None else size
+        return reduce(np.logical_or, (f.mask(columns, size) for f in self.filters))
+
+    def __repr__(self):
+        return f"Or{self.filters!r}"
+
+
+def filter_from_dict(filters: Dict[str, Any]) -> Optional[Filter]:
+    """
+    Convert search_by_metadata-style filters into an expression.
+
+    A (low, high) tuple becomes a Range, a list becomes In and any other
+    value Eq; every key must match.
+    """
+    parts: List[Filter] = []
+    for field, value in filters.items():
+        if isinstance(value, tuple) and len(value) == 2:
+            parts.append(Range(field, value[0], value[1]))
+        elif isinstance(value, list):
+            parts.append(In(field, value))
+        else:
+            parts.append(Eq(field, value))
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else And(*parts)
+
+
+def _as_int(value: Any) -> int:
+    return value if isinstance(value, int) and not isinstance(value, bool) else MISSING
+
+
+class MetadataColumns:
+    """Per-row metadata held column-wise in growable NumPy arrays."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._codes: Dict[str, Dict[Any, int]] = {field: {} for field in CODED_FIELDS}
+        self._tag_bits: Dict[Any, int] = {}
+        self._overflow_tags: Dict[Any, List[int]] = {}
+        self._columns: Dict[str, RowBuffer] = {
+            field: RowBuffer(np.zeros(0, dtype=np.int32)) for field in CODED_FIELDS + NUMERIC_FIELDS
+        }
+        self._columns[TAG_FIELD] = RowBuffer(np.zeros(0, dtype=np.uint64))
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def rebuild(self, metadatas: Iterable[Dict[str, Any]]):
+        """Re-index from scratch, numbering rows from 0."""
+        self.clear()
+        self.append(0, list(metadatas))
+
+    def append(self, start: int, metadatas: List[Dict[str, Any]]):
+        """Add the metadata of rows start..start+len(metadatas)-1."""
+        if start != self._size:
+            raise ValueError(f"Rows must be added in order (expected {self._size}, got {start})")
+        if not metadatas:
+            return
+
+        values: Dict[str, list] = {field: [] for field in self._columns}
+        for offset, metadata in enumerate(metadatas):
+            for field in CODED_FIELDS:
+                codes = self._codes[field]
+                values[field].append(codes.setdefault(metadata.get(field), len(codes)))
+            for field in NUMERIC_FIELDS:
+                values[field].append(_as_int(metadata.get(field)))
+            values[TAG_FIELD].append(self._tag_mask(start + offset, metadata.get(TAG_FIELD) or []))
+
+        for field, column in values.items():
+            self._columns[field].append(np.asarray(column, dtype=self._columns[field].view().dtype))
+        self._size += len(metadatas)
+
+    def _tag_mask(self, row: int, tags: List[Any]) -> int:
+        bits = 0
+        for tag in tags:
+            if tag not in self._tag_bits and len(self._tag_bits) < MAX_TAG_BITS:
+                self._tag_bits[tag] = len(self._tag_bits)
+            if tag in self._tag_bits:
+                bits |= 1 << self._tag_bits[tag]
+            else:
+                self._overflow_tags.setdefault(tag, []).append(row)
+        return bits
+
+    def column(self, field: str, size: Optional[int] = None) -> np.ndarray:
+        """Zero-copy view of one column, cut to its first size rows.
+
+        A concurrent append grows the columns one after another and bumps
+        the row count last, so readers pass the size of the snapshot they
+        search and every column they combine has exactly that many rows.
+        """
+        view = self._columns[field].view()
+        return view if size is None else view[:size]
+
+    def isin(self, field: str, values: List[Any], size: Optional[int] = None) -> np.ndarray:
+        """Rows (of the first size) whose field equals any of values."""
+        size = self._size if size is None else size
+        if field == TAG_FIELD:
+            bits = 0
+            mask = np.zeros(size, dtype=bool)
+            for tag in values:
+                if tag in self._tag_bits:
+                    bits |= 1 << self._tag_bits[tag]
+                elif tag in self._overflow_tags:
+                    # Row lists are ascending; rows past size are not published yet
+                    rows = self._overflow_tags[tag]
+                    mask[rows[:bisect_left(rows, size)]] = True
+            if bits:
+                mask |= (self.column(TAG_FIELD, size) & np.uint64(bits)) != 0
+            return mask
+        if field in CODED_FIELDS:
+            codes = [self._codes[field][v] for v in values if v in self._codes[field]]
+        elif field in NUMERIC_FIELDS:
+            codes = [v for v in values if _as_int(v) != MISSING]
+        else:
+            raise ValueError(f"Unknown filter field: {field}")
+        if len(codes) == 1:
+            return self.column(field, size) == codes[0]
+        return np.isin(self.column(field, size), codes)
+
+    def between(self, field: str, low: Optional[int], high: Optional[int],
+                size: Optional[int] = None) -> np.ndarray:
+        """Rows (of the first size) whose numeric field lies in [low, high]; missing values never match."""
+        if field not in NUMERIC_FIELDS:
+            raise ValueError(f"Range filters need a numeric field, got {field}")
+        column = self.column(field, self._size if size is None else size)
+        mask = column != MISSING
+        if low is not None:
+            mask &= column >= low
+        if high is not None:
+            mask &= column <= high
+        return mask
@@ -0,0 +1,106 @@
+"""
+Inverted metadata index for the VectorStore.
+
+Maps metadata values to the row numbers of the chunks that carry them so
+metadata lookups (search_by_metadata, neighbor expansion) touch only the
+matching rows instead of scanning every stored chunk.
+"""
+
+import bisect
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Iterable
+from .rule_refs import rule_keys
+
+
+class MetadataIndex:
+    """Hash indexes on doc_id, (doc_id, page), topic_tags, subject_role and
+    normalized rule keys, plus a sorted index on section_id for range lookups.
+
+    Posting lists hold row numbers in ascending (insertion) order.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._by_doc: Dict[Any, List[int]] = defaultdict(list)
+        self._by_page: Dict[tuple, List[int]] = defaultdict(list)
+        self._by_tag: Dict[Any, List[int]] = defaultdict(list)
+        self._by_role: Dict[Any, List[int]] = defaultdict(list)
+        self._by_section: Dict[int, List[int]] = defaultdict(list)
+        self._by_rule: Dict[str, List[int]] = defaultdict(list)
+        self._section_keys: List[int] = []
+
+    def rebuild(self, metadatas: Iterable[Dict[str, Any]]):
+        """Re-index from scratch, numbering rows from 0."""
+        self.clear()
+        for row, metadata in enumerate(metadatas):
+            self.add(row, metadata)
+
+    def add(self, row: int, metadata: Dict[str, Any]):
+        """Index one row. Rows must be added in increasing order."""
+        doc_id = metadata.get("doc_id")
+        self._by_doc[doc_id].append(row)
+        if "page" in metadata:
+            self._by_page[(doc_id, metadata["page"])].append(row)
+        for tag in metadata.get("topic_tags") or []:
+            self._by_tag[tag].append(row)
+        if "subject_role" in metadata:
+            self._by_role[metadata["subject_role"]].append(row)
+
+        # Chunks ingested before rule_keys existed derive them from section_id/subrule
+        keys = metadata.get("rule_keys")
+        for key in (keys if keys is not None else rule_keys(metadata)):
+            self._by_rule[key].append(row)
+
+        section_id = metadata.get("section_id")
+        if isinstance(section_id, int):
+            if section_id not in self._by_section:
+                bisect.insort(self._section_keys, section_id)
+            self._by_section[section_id].append(row)
+
+    def _section_range(self, start: int, end: int) -> List[int]:
+        lo = bisect.bisect_left(self._section_keys, start)
+        hi = bisect.bisect_right(self._section_keys, end)
+        rows = []
+        for key in self._section_keys[lo:hi]:
+            rows.extend(self._by_section[key])
+        rows.sort()
+        return rows
+
+    def rule_rows(self, key: str) -> List[int]:
+        """Rows filed under a normalized rule key ("1102", "1102A"), ascending."""
+        return self._by_rule.get(key, [])
+
+    def candidates(self, filters: Dict[str, Any]) -> Optional[List[int]]:
+        """
+        Return a superset of the rows matching filters, in row order.
+
+        Uses the most selective indexed key; callers still verify every
+        filter on the returned rows. Returns None when no filter key is
+        indexed, meaning the caller must scan all rows.
+        """
+        postings = []
+
+        if "doc_id" in filters:
+            doc_id = filters["doc_id"]
+            if "page" in filters:
+                postings.append(self._by_page.get((doc_id, filters["page"]), []))
+            postings.append(self._by_doc.get(doc_id, []))
+
+        tag = filters.get("topic_tags")
+        if tag is not None and not isinstance(tag, list):
+            postings.append(self._by_tag.get(tag, []))
+
+        if "subject_role" in filters and not isinstance(filters["subject_role"], list):
+            postings.append(self._by_role.get(filters["subject_role"], []))
+
+        section = filters.get("section_id")
+        if isinstance(section, tuple) and len(section) == 2:
+            postings.append(self._section_range(section[0], section[1]))
+        elif isinstance(section, int):
+            postings.append(self._by_section.get(section, []))
+
+        if not postings:
+            return None
+        return min(postings, key=len)
@@ -0,0 +1,121 @@
+"""
+Chunk adjacency for the VectorStore's neighbor expansion.
+
+Built at ingest time: every row belongs to a page group (doc_id, page) and,
+when it has a section_id, a section group (doc_id, section_id // 10, i.e.
+7200..7209). Groups hold their rows in ascending order, the previous and
+next page of a group are one dict lookup away, and topic tags map straight
+to rows. Expanding a hit is then a few list walks over integer row
+ordinals instead of metadata queries keyed by f-strings.
+"""
+
+from typing import List, Dict, Any, Tuple, Iterable, Iterator
+import numpy as np
+from .vector_math import RowBuffer
+
+NO_GROUP = -1
+
+
+class NeighborIndex:
+    """Page, section-decade and topic-tag adjacency over row numbers."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # (doc_id, page) -> group id, group id -> (doc_id, page) and group id -> rows
+        self._page_groups: Dict[Tuple[Any, Any], int] = {}
+        self._page_keys: List[Tuple[Any, Any]] = []
+        self._page_rows: List[List[int]] = []
+        # (doc_id, section_id // 10) -> group id, group id -> rows
+        self._section_groups: Dict[Tuple[Any, int], int] = {}
+        self._section_rows: List[List[int]] = []
+        self._tags: Dict[Any, List[int]] = {}
+        # Group ids per row (NO_GROUP when the metadata is missing)
+        self._row_page = RowBuffer(np.zeros(0, dtype=np.int32))
+        self._row_section = RowBuffer(np.zeros(0, dtype=np.int32))
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def rebuild(self, metadatas: Iterable[Dict[str, Any]]):
+        """Re-index from scratch, numbering rows from 0."""
+        self.clear()
+        self.append(0, list(metadatas))
+
+    def append(self, start: int, metadatas: List[Dict[str, Any]]):
+        """Add the metadata of rows start..start+len(metadatas)-1."""
+        if start != self._size:
+            raise ValueError(f"Rows must be added in order (expected {self._size}, got {start})")
+        if not metadatas:
+            return
+
+        page_ids = []
+        section_ids = []
+        for row, metadata in enumerate(metadatas, start):
+            doc_id = metadata.get("doc_id")
+
+            page = metadata.get("page")
+            group = NO_GROUP
+            if isinstance(page, int) and page:
+                group = self._page_groups.get((doc_id, page))
+                if group is None:
+                    group = len(self._page_rows)
+                    self._page_groups[(doc_id, page)] = group
+                    self._page_keys.append((doc_id, page))
+                    self._page_rows.append([])
+                self._page_rows[group].append(row)
+            page_ids.append(group)
+
+            section_id = metadata.get("section_id")
+            group = NO_GROUP
+            if isinstance(section_id, int) and section_id:
+                group = self._section_groups.get((doc_id, section_id // 10))
+                if group is None:
+                    group = len(self._section_rows)
+                    self._section_groups[(doc_id, section_id // 10)] = group
+                    self._section_rows.append([])
+                self._section_rows[group].append(row)
+            section_ids.append(group)
+
+            for tag in metadata.get("topic_tags") or []:
+                self._tags.setdefault(tag, []).append(row)
+
+        self._row_page.append(np.asarray(page_ids, dtype=np.int32))
+        self._row_section.append(np.asarray(section_ids, dtype=np.int32))
+        self._size += len(metadatas)
+
+    def adjacent_pages(self, row: int) -> List[List[int]]:
+        """Rows of the row's page, then of the previous and next page (each ascending)."""
+        group = int(self._row_page.view()[row])
+        if group == NO_GROUP:
+            return []
+        doc_id, page = self._page_keys[group]
+        pages = [self._page_rows[group]]
+        for neighbor in (page - 1, page + 1):
+            other = self._page_groups.get((doc_id, neighbor))
+            if other is not None:
+                pages.append(self._page_rows[other])
+        return pages
+
+    def section_siblings(self, row: int) -> List[int]:
+        """Rows of the same document whose section_id is in the row's decade."""
+        group = int(self._row_section.view()[row])
+        return self._section_rows[group] if group != NO_GROUP else []
+
+    def tagged(self, tag: Any) -> List[int]:
+        """Rows carrying a topic tag, ascending."""
+        return self._tags.get(tag, [])
+
+
+def live_rows(rows: List[int], limit: int, size: int, deleted: np.ndarray) -> Iterator[int]:
+    """Yield at most limit live rows below size from an ascending row list."""
+    taken = 0
+    for row in rows:
+        if taken >= limit or row >= size:
+            return
+        if deleted[row]:
+            continue
+        taken += 1
+        yield row
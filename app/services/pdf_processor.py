@@ -11,6 +11,7 @@ from typing import List, Dict, Any
 from dataclasses import dataclass
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from ..config import settings
+from .rule_refs import rule_keys
 
 
 @dataclass
@@ -211,6 +212,7 @@ class PDFProcessor:
             "source": f"{filename} (Page {page_num})"
         }
         metadata.update(meta)
+        metadata["rule_keys"] = rule_keys(metadata)
             
         chunks.append(DocumentChunk(
             text=text,
@@ -231,6 +233,7 @@ class PDFProcessor:
             "source": f"{filename} (Page {page_num})"
         }
         metadata.update(meta)
+        metadata["rule_keys"] = rule_keys(metadata)
             
         chunks.append(DocumentChunk(
             text=text,
@@ -3,6 +3,8 @@ import re
 from typing import List, Dict, Any, AsyncGenerator, Optional
 from dataclasses import dataclass
 from .vector_store import VectorStore, SearchResult
+from .metadata_columns import Filter, In
+from .rule_refs import extract_rule_refs, rule_keys
 from ..llm import get_llm_provider
 from ..config import settings
 
@@ -53,10 +55,17 @@ class RAGService:
             if term in q_lower:
                 must_have.append(term)
         
+        # Rule references, normalized for the rule lookup index (1102.a -> 1102A);
+        # only ones written as "Rule/Section NNNN" may stand in for vector search
+        rule_refs = extract_rule_refs(question)
+        explicit_rule_refs = extract_rule_refs(question, explicit=True)
+        
         return {
             "answer_mode": mode,
             "subject_role": subject_role,
             "must_have_terms": must_have,
+            "rule_refs": rule_refs,
+            "explicit_rule_refs": explicit_rule_refs,
             "avoid_terms": [],
             "needs_neighbor_expansion": mode == "COVERAGE"
         }
@@ -108,6 +117,17 @@ class RAGService:
             # Cap score
             res.score = min(0.99, res.score)
 
+    def _retrieval_filter(self, router_info: Dict) -> Optional[Filter]:
+        """Role gate pushed into vector search (chunks without a role count as general).
+        
+        Not applied when there are must-have terms: Gate A keeps a chunk with
+        another role label if it contains one, so those chunks must still reach it.
+        """
+        role = router_info.get("subject_role")
+        if not role or role == "general" or router_info.get("must_have_terms"):
+            return None
+        return In("subject_role", [role, "general", None])
+
     def _filter_evidence(self, results: List[SearchResult], router_info: Dict) -> List[SearchResult]:
         """Step 5: Evidence Filter (Gate A & B)."""
         filtered = []
@@ -154,21 +174,34 @@ class RAGService:
         
         all_results = []
         seen_chunks = set()
+        where = self._retrieval_filter(router_info)
+        
+        # Step 3.0: Rule lookup - rule numbers resolve by dictionary lookup and are
+        # merged with the vector results. Only a DIRECT question whose explicit
+        # "Rule/Section NNNN" reference resolved skips the vector leg (no embedding
+        # call); a bare number may be a year or a count
+        rule_results = []
+        if router_info.get("rule_refs"):
+            rule_results = self.vector_store.lookup_rules(router_info["rule_refs"], limit=10, filter_doc_id=filter_doc_id)
+        result_lists = [rule_results]
+        explicit_refs = set(router_info.get("explicit_rule_refs", []))
+        explicit_hit = any(explicit_refs.intersection(rule_keys(r.metadata)) for r in rule_results)
         
-        # Step 8 Settings: 5 queries x top 5 each
-        for q in queries:
-            if not q or not q.strip():
-                continue
+        # Step 8 Settings: 5 queries x top 5 each, embedded and scored in one batch
+        queries = [q for q in queries if q and q.strip()]
+        if not (explicit_hit and mode == "DIRECT"):
             try:
-                results = self.vector_store.search(q, top_k=5, filter_doc_id=filter_doc_id)
-                for r in results:
-                    chunk_key = r.chunk_id if hasattr(r, 'chunk_id') else f"{r.metadata.get('doc_id')}_{r.metadata.get('page')}_{r.metadata.get('chunk_index')}"
-                    if chunk_key not in seen_chunks:
-                        all_results.append(r)
-                        seen_chunks.add(chunk_key)
+                batch = await self.vector_store.search_many_async(queries, top_k=5, filter_doc_id=filter_doc_id, where=where)
+                result_lists.extend(batch.results)
             except Exception as e:
-                # Silently fail for individual query failures
-                pass
+                print(f"Vector search failed: {e}")
+        
+        for results in result_lists:
+            for r in results:
+                chunk_key = r.chunk_id if hasattr(r, 'chunk_id') else f"{r.metadata.get('doc_id')}_{r.metadata.get('page')}_{r.metadata.get('chunk_index')}"
+                if chunk_key not in seen_chunks:
+                    all_results.append(r)
+                    seen_chunks.add(chunk_key)
 
         # Step 3.1b: Hybrid Search (Keyword Scan for must-have terms)
         must_have = router_info.get("must_have_terms", [])
@@ -178,7 +211,8 @@ class RAGService:
                 for r in keyword_results:
                      chunk_key = r.chunk_id if hasattr(r, 'chunk_id') else f"{r.metadata.get('doc_id')}_{r.metadata.get('page')}_{r.metadata.get('chunk_index')}"
                      if chunk_key not in seen_chunks:
-                         r.score = 0.85 # High score for exact keyword usage
+                         # High score for exact keyword usage; keep BM25 order (0.75..0.85)
+                         r.score = 0.75 + 0.2 * (r.score - 0.5)
                          all_results.append(r)
                          seen_chunks.add(chunk_key)
             except Exception as e:
@@ -0,0 +1,57 @@
+"""
+Rule-number keys shared by ingestion, the metadata index and the router.
+
+Rules are referred to as 1102, 1102A, 1102.A or "Rule 1102.a"; every form
+normalizes to the same key, so an explicit reference in a question is a
+dictionary lookup away from the chunks under that rule.
+Kept free of app imports, like vector_math.
+"""
+
+import re
+from typing import List, Dict, Any, Optional
+
+# A rule number and optional subrule: 1102, 1102A, 1102.A, 1102.12. Longer numbers
+# (11025) and parts of dashed numbers (555-1234) are not rule numbers, and a
+# subrule without a dot must be letters
+_RULE_NUMBER = r'(?<![\d-])(\d{4})(?!\d|-\d)(?:\.([A-Z0-9]{1,2})|([A-Z]{1,2}))?\b'
+
+# Rule references as written in questions and headers
+RULE_REF_PATTERN = re.compile(r'\b' + _RULE_NUMBER, re.IGNORECASE)
+# References that name themselves as rules: "Rule 1102.a", "Section 7207", "§ 4501"
+EXPLICIT_RULE_REF_PATTERN = re.compile(r'(?:\b(?:rules?|sections?|sec\.?)|§)\s*' + _RULE_NUMBER, re.IGNORECASE)
+
+
+def normalize_rule_ref(section: Any, subrule: Optional[str] = None) -> str:
+    """Canonical lookup key for a rule: "1102" or, with a subrule, "1102A"."""
+    key = str(section).strip()
+    if subrule:
+        key += re.sub(r'[^A-Z0-9]', '', str(subrule).upper())
+    return key
+
+
+def rule_keys(metadata: Dict[str, Any]) -> List[str]:
+    """Keys a chunk is found under: its section and, if any, section plus subrule."""
+    section_id = metadata.get("section_id")
+    if not section_id:
+        return []
+    keys = [normalize_rule_ref(section_id)]
+    if metadata.get("subrule"):
+        keys.append(normalize_rule_ref(section_id, metadata["subrule"]))
+    return keys
+
+
+def extract_rule_refs(text: str, explicit: bool = False) -> List[str]:
+    """
+    Normalized rule references named in free text, in order of appearance.
+
+    Any four-digit number may be a rule (or a year); with explicit=True only
+    numbers introduced by "Rule", "Section" or "§" are returned.
+    """
+    pattern = EXPLICIT_RULE_REF_PATTERN if explicit else RULE_REF_PATTERN
+    refs = []
+    for match in pattern.finditer(text):
+        subrule = match.group(2) or match.group(3)
+        for key in (normalize_rule_ref(match.group(1)), normalize_rule_ref(match.group(1), subrule)):
+            if key not in refs:
+                refs.append(key)
+    return refs
@@ -0,0 +1,370 @@
+"""
+Append-only segment log used to persist the VectorStore.
+
+Every add writes a new immutable segment directory and every delete records
+a tombstone, so a mutation costs O(new rows) instead of rewriting the whole
+corpus. The manifest (index.json) is the single commit point: it is replaced
+with write-temp-then-rename after the segment files are fsynced, so a crash
+leaves either the previous or the new state on disk, never a mix.
+
+Layout (format_version 2):
+    index.json                       - manifest: segments, tombstones, counters
+    segments/seg-00000001/
+        embeddings.npy               - normalized float32 rows, memory-mapped on load
+        texts.jsonl                  - one {"chunk_id", "text"} object per row
+        metadata.jsonl               - one metadata object per row
+
+A tombstone {"doc_id", "seq"} hides the rows of that document in every
+segment with a lower seq. Compaction merges the live rows into one segment
+and drops the tombstones it has applied.
+
+Several processes may open the same directory: one writer and any number
+of read-only logs, which memory-map the same segment files (shared page
+cache) and poll the manifest generation to notice new commits.
+"""
+
+import os
+import json
+import shutil
+import threading
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+from .vector_math import TailedRows, row_blocks
+
+LOG_FORMAT_VERSION = 2
+MANIFEST_FILE = "index.json"
+SEGMENTS_DIR = "segments"
+EMBEDDINGS_FILE = "embeddings.npy"
+TEXTS_FILE = "texts.jsonl"
+METADATA_FILE = "metadata.jsonl"
+
+# (chunk_id, text, metadata) for one stored row
+Record = Tuple[str, str, Dict[str, Any]]
+
+
+def _fsync_dir(path: Path):
+    """Flush a directory entry so a rename inside it survives a crash."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return  # Not supported on Windows
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SegmentLog:
+    """Manifest plus immutable segments on disk.
+
+    Not thread-safe for concurrent writers on its own: seq allocation,
+    commit() and the manifest swap in compact() serialize on an internal
+    lock, but callers are expected to stage appends/tombstones from a
+    single writer.
+    A read_only log never writes or deletes anything under root.
+    """
+
+    def __init__(self, root: Path, compact_threshold: int = 8, read_only: bool = False):
+        self.root = Path(root)
+        self.segments_dir = self.root / SEGMENTS_DIR
+        self.manifest_file = self.root / MANIFEST_FILE
+        self.compact_threshold = compact_threshold
+        self.read_only = read_only
+
+        self._lock = threading.Lock()
+        self._manifest = self._empty_manifest()
+        self._next_seq = 1
+        self._pending_segments: List[Tuple[Dict[str, Any], List[Record], np.ndarray]] = []
+        self._pending_tombstones: List[Dict[str, Any]] = []
+        # Bumped by rewrite(); a compaction started before it must not swap in
+        self._rewrite_epoch = 0
+
+    @staticmethod
+    def _empty_manifest() -> Dict[str, Any]:
+        return {
+            "format_version": LOG_FORMAT_VERSION,
+            "generation": 0,
+            "next_seq": 1,
+            "dim": 0,
+            "embedding_model": None,
+            "segments": [],
+            "tombstones": []
+        }
+
+    def exists(self) -> bool:
+        return self.manifest_file.exists()
+
+    @property
+    def generation(self) -> int:
+        return self._manifest["generation"]
+
+    @property
+    def committed_seq(self) -> int:
+        """Highest seq covered by the committed manifest."""
+        return self._manifest["next_seq"] - 1
+
+    @property
+    def rewrite_epoch(self) -> int:
+        """Changes whenever rewrite() replaces the whole log (pass it to compact())."""
+        return self._rewrite_epoch
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending_segments or self._pending_tombstones)
+
+    def read_generation(self) -> Optional[int]:
+        """Generation of the manifest now on disk, which another process may have committed."""
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get("generation")
+        except (OSError, ValueError):
+            return None
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"Segment log at {self.root} is open read-only")
+
+    @property
+    def needs_compaction(self) -> bool:
+        return (
+            len(self._manifest["segments"]) > self.compact_threshold
+            or len(self._manifest["tombstones"]) > self.compact_threshold
+        )
+
+    def _allocate_seq(self) -> int:
+        # Appends and tombstones run on the writer thread, compaction on its own
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            return seq
+
+    def _segment_path(self, name: str) -> Path:
+        return self.segments_dir / name
+
+    def load(self) -> Tuple[List[Record], Optional[np.ndarray]]:
+        """Read the committed state, applying tombstones.
+
+        Each segment stays a read-only memmap; several are returned as one
+        TailedRows view over them, so loading never copies the matrix. Only
+        segments with tombstoned rows are gathered into memory.
+        """
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        version = manifest.get("format_version")
+        if version != LOG_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version: {version}")
+
+        self._manifest = manifest
+        self._next_seq = manifest["next_seq"]
+        if not self.read_only:
+            # A reader cannot tell a crashed write from the writer's segment in progress
+            self._remove_orphans()
+
+        records: List[Record] = []
+        blocks: List[np.ndarray] = []
+        for segment in sorted(manifest["segments"], key=lambda s: s["seq"]):
+            seg_records, seg_embeddings = self._read_segment(segment)
+            dead = {t["doc_id"] for t in manifest["tombstones"] if t["seq"] > segment["seq"]}
+            if dead:
+                keep = [i for i, r in enumerate(seg_records) if r[2].get("doc_id") not in dead]
+                if len(keep) != len(seg_records):
+                    seg_records = [seg_records[i] for i in keep]
+                    seg_embeddings = seg_embeddings[keep] if keep else None
+            if seg_records:
+                records.extend(seg_records)
+                blocks.append(seg_embeddings)
+
+        if not blocks:
+            return records, None
+        if len(blocks) == 1:
+            return records, blocks[0]
+        return records, TailedRows(*blocks)
+
+    def _read_segment(self, segment: Dict[str, Any]) -> Tuple[List[Record], Optional[np.ndarray]]:
+        path = self._segment_path(segment["name"])
+        records: List[Record] = []
+        with open(path / TEXTS_FILE, 'r', encoding='utf-8') as texts_f, \
+             open(path / METADATA_FILE, 'r', encoding='utf-8') as meta_f:
+            for text_line, meta_line in zip(texts_f, meta_f):
+                entry = json.loads(text_line)
+                records.append((entry["chunk_id"], entry["text"], json.loads(meta_line)))
+
+        if len(records) != segment.get("count", len(records)):
+            raise ValueError(f"Segment {segment['name']} does not match the manifest")
+        if not records:
+            return records, None
+        return records, np.load(path / EMBEDDINGS_FILE, mmap_mode='r')
+
+    def _remove_orphans(self):
+        """Drop segment directories a crash left behind without a manifest entry."""
+        if not self.segments_dir.exists():
+            return
+        live = {s["name"] for s in self._manifest["segments"]}
+        for path in self.segments_dir.iterdir():
+            if path.name not in live:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def append(self, records: List[Record], embeddings: np.ndarray):
+        """Stage a new immutable segment; written on the next commit()."""
+        self._check_writable()
+        if not records:
+            return
+        seq = self._allocate_seq()
+        segment = {"name": f"seg-{seq:08d}", "seq": seq, "count": len(records)}
+        self._pending_segments.append((segment, records, embeddings))
+
+    def tombstone(self, doc_id: str):
+        """Stage a delete of every earlier row of doc_id; written on the next commit()."""
+        self._check_writable()
+        self._pending_tombstones.append({"doc_id": doc_id, "seq": self._allocate_seq()})
+
+    def commit(self, embedding_model: Optional[str] = None):
+        """Write all staged segments and tombstones under one manifest swap."""
+        with self._lock:
+            if not self.has_pending:
+                return
+
+            segments = []
+            dim = 0
+            for segment, records, embeddings in self._pending_segments:
+                self._write_segment(segment["name"], records, embeddings)
+                segments.append(segment)
+                dim = int(embeddings.shape[1])
+
+            manifest = dict(self._manifest)
+            manifest["segments"] = self._manifest["segments"] + segments
+            manifest["tombstones"] = self._manifest["tombstones"] + self._pending_tombstones
+            self._stamp(manifest, embedding_model, dim)
+            self._write_manifest(manifest)
+
+            self._manifest = manifest
+            self._pending_segments = []
+            self._pending_tombstones = []
+
+    def compact(
+        self,
+        records: List[Record],
+        embeddings: Optional[np.ndarray],
+        upto_seq: int,
+        embedding_model: Optional[str] = None,
+        epoch: Optional[int] = None
+    ) -> Optional[np.ndarray]:
+        """Replace every segment with seq <= upto_seq by one merged segment.
+
+        records/embeddings must be the live rows as of upto_seq. Segments and
+        tombstones committed after upto_seq are kept, so compaction can run in
+        the background while new documents are appended.
+
+        Args:
+            epoch: rewrite_epoch read together with records; if a rewrite()
+                happened since, the merged rows are stale and nothing is swapped in
+
+        Returns:
+            The merged segment's embeddings, memory-mapped (None if empty),
+            so the caller can drop its in-memory copy of those rows
+
+        Raises:
+            RuntimeError: The log was rewritten while compacting
+        """
+        self._check_writable()
+        name = f"seg-{self._allocate_seq():08d}"
+
+        # The expensive part runs without holding the lock
+        new_segments = []
+        if records:
+            self._write_segment(name, records, embeddings)
+            new_segments.append({"name": name, "seq": upto_seq, "count": len(records)})
+
+        with self._lock:
+            if epoch is not None and epoch != self._rewrite_epoch:
+                stale = True
+                old = []
+            else:
+                stale = False
+                old = [s for s in self._manifest["segments"] if s["seq"] <= upto_seq]
+                manifest = dict(self._manifest)
+                manifest["segments"] = new_segments + [s for s in self._manifest["segments"] if s["seq"] > upto_seq]
+                manifest["tombstones"] = [t for t in self._manifest["tombstones"] if t["seq"] > upto_seq]
+                self._stamp(manifest, embedding_model, int(embeddings.shape[1]) if records else 0)
+                self._write_manifest(manifest)
+                self._manifest = manifest
+        if stale:
+            if records:
+                self._remove_segment(name)
+            raise RuntimeError("Segment log was rewritten during compaction; merged segment discarded")
+
+        for segment in old:
+            self._remove_segment(segment["name"])
+        if not records:
+            return None
+        return np.load(self._segment_path(name) / EMBEDDINGS_FILE, mmap_mode='r')
+
+    def rewrite(
+        self,
+        records: List[Record],
+        embeddings: Optional[np.ndarray],
+        embedding_model: Optional[str] = None
+    ) -> Optional[np.ndarray]:
+        """Discard staged changes and persist exactly the given rows (returns them memory-mapped)."""
+        self._check_writable()
+        self._pending_segments = []
+        self._pending_tombstones = []
+        with self._lock:
+            # Invalidates any compaction still merging the rows being replaced
+            self._rewrite_epoch += 1
+            epoch = self._rewrite_epoch
+        upto_seq = self._allocate_seq()
+        return self.compact(records, embeddings, upto_seq, embedding_model, epoch=epoch)
+
+    def _stamp(self, manifest: Dict[str, Any], embedding_model: Optional[str], dim: int):
+        manifest["generation"] = self._manifest["generation"] + 1
+        manifest["next_seq"] = self._next_seq
+        if embedding_model:
+            manifest["embedding_model"] = embedding_model
+        if dim:
+            manifest["dim"] = dim
+
+    def _write_segment(self, name: str, records: List[Record], embeddings: np.ndarray):
+        """Write a segment into a temp directory, fsync it, then rename into place."""
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.segments_dir / f".tmp-{name}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir()
+
+        # Written block by block, so a memmapped base plus tail is never concatenated in RAM
+        if not isinstance(embeddings, TailedRows):
+            embeddings = np.asarray(embeddings)
+        shape = (len(embeddings),) + tuple(embeddings.shape[1:])
+        matrix = np.lib.format.open_memmap(tmp_path / EMBEDDINGS_FILE, mode='w+', dtype=np.float32, shape=shape)
+        for start, block in row_blocks(embeddings):
+            matrix[start:start + len(block)] = block
+        matrix.flush()
+        del matrix
+        with open(tmp_path / EMBEDDINGS_FILE, 'rb+') as f:
+            os.fsync(f.fileno())
+        with open(tmp_path / TEXTS_FILE, 'w', encoding='utf-8') as f:
+            for chunk_id, text, _ in records:
+                f.write(json.dumps({"chunk_id": chunk_id, "text": text}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with open(tmp_path / METADATA_FILE, 'w', encoding='utf-8') as f:
+            for _, _, metadata in records:
+                f.write(json.dumps(metadata) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.segments_dir / name)
+        _fsync_dir(self.segments_dir)
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        tmp_path = self.manifest_file.with_name(MANIFEST_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_file)
+        _fsync_dir(self.root)
+
+    def _remove_segment(self, name: str):
+        shutil.rmtree(self.segments_dir / name, ignore_errors=True)
@@ -1,3 +1,4 @@
+import os
 from app.config import settings
 
 def get_llm(model_name: str = None):
@@ -18,12 +19,22 @@ def get_llm(model_name: str = None):
 def get_embeddings():
     if settings.LLM_PROVIDER == "openai":
         from langchain_openai import OpenAIEmbeddings
-        return OpenAIEmbeddings(
+        model = settings.OPENAI_EMBEDDING_MODEL
+        embeddings = OpenAIEmbeddings(
             api_key=settings.OPENAI_API_KEY,
-            model=settings.OPENAI_EMBEDDING_MODEL
+            model=model
         )
-    from langchain_ollama import OllamaEmbeddings
-    return OllamaEmbeddings(
-        base_url=settings.OLLAMA_BASE_URL,
-        model=settings.EMBEDDING_MODEL 
-    )
+    else:
+        from langchain_ollama import OllamaEmbeddings
+        model = settings.EMBEDDING_MODEL
+        embeddings = OllamaEmbeddings(
+            base_url=settings.OLLAMA_BASE_URL,
+            model=model
+        )
+    
+    # Skip the on-disk cache on Vercel (read-only filesystem)
+    if os.environ.get("VERCEL"):
+        return embeddings
+    
+    from app.services.embedding_cache import CachedEmbeddings, get_embedding_cache
+    return CachedEmbeddings(embeddings, model, get_embedding_cache(settings.CHROMA_PERSIST_DIRECTORY))
@@ -0,0 +1,247 @@
+"""
+NumPy helpers shared by the vector search paths.
+Kept free of app imports so the serverless bundle can use them too.
+"""
+
+from typing import Optional, Sequence, Tuple, List, Iterator
+import numpy as np
+
+
+def top_k_indices(scores: np.ndarray, k: int, min_score: Optional[float] = None) -> np.ndarray:
+    """
+    Return the indices of the k highest scores, best first.
+
+    Uses np.argpartition to select the top k in O(n) and only sorts those k,
+    instead of sorting every score just to keep a handful.
+
+    Args:
+        scores: 1-D array of similarity scores
+        k: Number of indices to return
+        min_score: Optional threshold; scores below it are never returned
+
+    Returns:
+        Array of indices into scores, ordered by descending score, then
+        ascending index
+    """
+    if k <= 0 or scores.shape[0] == 0:
+        return np.empty(0, dtype=np.intp)
+
+    candidates = None
+    values = scores
+    if min_score is not None:
+        candidates = np.flatnonzero(scores >= min_score)
+        values = scores[candidates]
+
+    n = values.shape[0]
+    if k < n:
+        # argpartition only finds the k-th best score; which of several rows
+        # tied with it it keeps, and in what order, is arbitrary
+        kth = values[np.argpartition(values, n - k)[n - k]]
+        above = np.flatnonzero(values > kth)
+        tied = np.flatnonzero(values == kth)[:k - len(above)]
+        selected = np.concatenate([above, tied])
+    else:
+        selected = np.arange(n)
+
+    # Sort just the selected rows, which are in ascending row order within
+    # each score; stable, so tied scores go to the lower row
+    order = selected[np.argsort(-values[selected], kind="stable")]
+    return order if candidates is None else candidates[order]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Tuple[np.ndarray, np.ndarray]],
+    k: int,
+    constant: int = 60
+) -> List[Tuple[int, float]]:
+    """
+    Merge several best-first rankings with reciprocal rank fusion.
+
+    A row earns 1 / (constant + rank) from every ranking it appears in, so
+    rows found by several queries rise above a single query's top hit.
+
+    Args:
+        rankings: (rows, scores) pairs, each ordered best first
+        k: Number of fused rows to return
+        constant: RRF damping constant (60 in the original paper)
+
+    Returns:
+        (row, best score across rankings) pairs ordered by fused rank
+    """
+    fused = {}
+    best = {}
+    for rows, scores in rankings:
+        for rank, (row, score) in enumerate(zip(rows.tolist(), scores.tolist())):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (constant + rank + 1)
+            best[row] = max(best.get(row, score), score)
+    # Ties keep first-seen order
+    order = sorted(fused, key=fused.get, reverse=True)[:k]
+    return [(row, best[row]) for row in order]
+
+
+class TailedRows:
+    """
+    Read-only (n, dim) matrix made of consecutive row blocks, typically
+    memory-mapped segment files followed by an in-memory tail of rows
+    appended since.
+
+    Lets the store serve several segments, and append to them, without
+    copying them into RAM. Supports what the search and index paths use:
+    len/shape/dtype, a single row, slices, fancy-index gathers and
+    np.asarray; use row_blocks() or matmul_rows() to multiply against it
+    block by block. base is every block but the last, tail the last one.
+    """
+
+    def __init__(self, *blocks):
+        flat = []
+        for block in blocks:
+            flat.extend(block.blocks if isinstance(block, TailedRows) else [block])
+        self.blocks = tuple(block for block in flat if len(block)) or tuple(flat[:1])
+        self.offsets = np.cumsum([0] + [len(block) for block in self.blocks])
+        self.shape = (int(self.offsets[-1]),) + self.blocks[0].shape[1:]
+        self.dtype = self.blocks[0].dtype
+        self.ndim = self.blocks[0].ndim
+
+    @property
+    def base(self):
+        if len(self.blocks) <= 2:
+            return self.blocks[0]
+        return TailedRows(*self.blocks[:-1])
+
+    @property
+    def tail(self) -> np.ndarray:
+        if len(self.blocks) == 1:
+            return self.blocks[0][:0]
+        return self.blocks[-1]
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _block_of(self, rows):
+        return np.searchsorted(self.offsets, rows, side='right') - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            pieces = []
+            for block, lo, hi in zip(self.blocks, self.offsets[:-1], self.offsets[1:]):
+                if lo < stop and hi > start:
+                    pieces.append(block[max(start - lo, 0):min(stop, hi) - lo])
+            if not pieces:
+                return self.blocks[0][:0]
+            return pieces[0] if len(pieces) == 1 else TailedRows(*pieces)
+        if isinstance(key, (int, np.integer)):
+            row = key + len(self) if key < 0 else key
+            if not 0 <= row < len(self):
+                raise IndexError(f"row {key} out of range for {len(self)} rows")
+            i = int(self._block_of(row))
+            return self.blocks[i][row - self.offsets[i]]
+
+        rows = np.asarray(key)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = np.where(rows < 0, rows + len(self), rows)
+        gathered = np.empty((len(rows),) + self.shape[1:], dtype=self.dtype)
+        which = self._block_of(rows)
+        for i, block in enumerate(self.blocks):
+            hit = which == i
+            if hit.any():
+                gathered[hit] = block[rows[hit] - self.offsets[i]]
+        return gathered
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = np.concatenate(self.blocks)
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+
+def row_blocks(matrix, lo: int = 0, hi: Optional[int] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yield (first row, ndarray) pieces covering rows lo..hi-1 of an array or TailedRows."""
+    hi = len(matrix) if hi is None else hi
+    if not isinstance(matrix, TailedRows):
+        yield lo, matrix[lo:hi]
+        return
+    found = False
+    for block, start, stop in zip(matrix.blocks, matrix.offsets[:-1], matrix.offsets[1:]):
+        if start < hi and stop > lo:
+            found = True
+            yield int(max(lo, start)), block[max(lo - start, 0):min(hi, stop) - start]
+    if not found:
+        yield lo, matrix.blocks[-1][:0]
+
+
+def matmul_rows(queries: np.ndarray, matrix, lo: int = 0, hi: Optional[int] = None) -> np.ndarray:
+    """queries @ matrix[lo:hi].T, computed block by block so a TailedRows is never concatenated."""
+    parts = [queries @ block.T for _, block in row_blocks(matrix, lo, hi)]
+    return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=-1)
+
+
+class RowBuffer:
+    """
+    Append-only array with a preallocated, capacity-doubling backing store.
+
+    Appends copy only the new rows (amortized O(new rows)) instead of
+    np.vstack-ing the whole array each time; readers use view(), a
+    zero-copy slice of the filled prefix. Rows behind a view handed out
+    earlier are never modified by later appends.
+
+    The initial array is used as-is until the first append copies it into
+    an owned buffer. With keep_base=True it is never copied: appends go to
+    a separate tail and view() returns a TailedRows once there is one, so a
+    read-only memmap stays on disk instead of moving into RAM.
+    """
+
+    def __init__(self, rows: Optional[np.ndarray] = None, keep_base: bool = False):
+        self._base = rows if keep_base else None
+        self._offset = 0 if self._base is None else len(self._base)
+        self._data = None if keep_base else rows
+        self._size = 0 if rows is None else len(rows)
+        self._owned = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return self._offset + (0 if self._data is None else len(self._data))
+
+    def view(self) -> Optional[np.ndarray]:
+        """The filled rows, without copying."""
+        if self._base is None:
+            return None if self._data is None else self._data[:self._size]
+        if self._size == self._offset:
+            return self._base
+        return TailedRows(self._base, self._data[:self._size - self._offset])
+
+    def append(self, rows) -> np.ndarray:
+        """Append rows and return the new view."""
+        rows = np.asarray(rows)
+        filled = self._size - self._offset
+        needed = filled + len(rows)
+        if self._data is None or not self._owned or needed > len(self._data):
+            like = self._data if self._data is not None else self._base
+            dtype = rows.dtype if like is None else like.dtype
+            data = np.empty((max(needed, 2 * filled),) + rows.shape[1:], dtype=dtype)
+            if filled:
+                data[:filled] = self._data[:filled]
+            self._data = data
+            self._owned = True
+        self._data[filled:needed] = rows
+        self._size += len(rows)
+        return self.view()
+
+    def rebase(self, base: np.ndarray) -> np.ndarray:
+        """
+        Serve the first len(base) rows from base from now on.
+
+        Used after those rows were written to a segment file: base is its
+        memmap, and only the rows after it stay in memory (moved to a fresh
+        tail). Views handed out earlier are unaffected. Returns the new view.
+        """
+        tail = np.array(self.view()[len(base):self._size])
+        self._base = base
+        self._offset = len(base)
+        self._data = tail if len(tail) else None
+        self._owned = self._data is not None
+        return self.view()
@@ -10,6 +10,8 @@ from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 import httpx
 
+from .vector_math import top_k_indices
+
 # Cache for loaded data
 _vector_data = None
 _embeddings_matrix = None
@@ -42,9 +44,12 @@ def _load_vector_data():
     with open(index_path, 'rb') as f:
         _vector_data = pickle.load(f)
     
-    # Convert embeddings to numpy matrix
+    # Convert embeddings to a float32 matrix of unit-length rows once, instead
+    # of holding float64 and re-normalizing every row on each query
     if _vector_data.get('embeddings'):
-        _embeddings_matrix = np.array(_vector_data['embeddings'])
+        _embeddings_matrix = np.array(_vector_data['embeddings'], dtype=np.float32)
+        norms = np.linalg.norm(_embeddings_matrix, axis=1, keepdims=True)
+        _embeddings_matrix /= norms + 1e-10
     
     print(f"✅ Loaded {len(_vector_data.get('documents', []))} documents from vector index")
     return _vector_data, _embeddings_matrix
@@ -69,20 +74,25 @@ def get_embedding_from_openai(text: str, api_key: str) -> List[float]:
 
 
 def cosine_similarity(query_embedding: np.ndarray, doc_embeddings: np.ndarray) -> np.ndarray:
-    """Compute cosine similarity between query and documents."""
-    # Normalize vectors
+    """Compute cosine similarity between query and pre-normalized documents."""
+    # Rows of doc_embeddings are unit-length (see _load_vector_data)
     query_norm = query_embedding / (np.linalg.norm(query_embedding) + 1e-10)
-    doc_norms = doc_embeddings / (np.linalg.norm(doc_embeddings, axis=1, keepdims=True) + 1e-10)
     
     # Compute cosine similarity
-    similarities = np.dot(doc_norms, query_norm)
+    similarities = np.dot(doc_embeddings, query_norm)
     return similarities
 
 
-def search_serverless(query: str, api_key: str, top_k: int = 10) -> List[SearchResult]:
+def search_serverless(
+    query: str,
+    api_key: str,
+    top_k: int = 10,
+    min_score: Optional[float] = None
+) -> List[SearchResult]:
     """
     Perform vector similarity search using pre-computed embeddings.
     Uses OpenAI API directly for query embedding.
+    Chunks scoring below min_score (raw cosine) are skipped.
     """
     vector_data, embeddings_matrix = _load_vector_data()
     
@@ -92,7 +102,7 @@ def search_serverless(query: str, api_key: str, top_k: int = 10) -> List[SearchR
     
     # Get query embedding from OpenAI
     try:
-        query_embedding = np.array(get_embedding_from_openai(query, api_key))
+        query_embedding = np.array(get_embedding_from_openai(query, api_key), dtype=np.float32)
     except Exception as e:
         print(f"❌ Failed to get embedding: {e}")
         return []
@@ -101,7 +111,7 @@ def search_serverless(query: str, api_key: str, top_k: int = 10) -> List[SearchR
     similarities = cosine_similarity(query_embedding, embeddings_matrix)
     
     # Get top-k results
-    top_indices = np.argsort(similarities)[::-1][:top_k]
+    top_indices = top_k_indices(similarities, top_k, min_score=min_score)
     
     # Build results
     results = []
@@ -5,33 +5,102 @@ No PyTorch or ONNX runtime required.
 """
 
 import json
+import time
+import heapq
 import pickle
+import hashlib
+import threading
+import functools
 import numpy as np
 import asyncio
 import httpx
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass, asdict
 from ..config import settings
 from .pdf_processor import DocumentChunk, ProcessedDocument
+from .ann_factory import create_ann_index
+from .ann_index import BaseANNIndex, measure_recall
+from .embedding_cache import QueryEmbeddingCache, get_embedding_cache
+from .keyword_index import BM25Index
+from .metadata_columns import Eq, Filter, MetadataColumns
+from .metadata_index import MetadataIndex
+from .neighbor_index import NeighborIndex, live_rows
+from .segment_log import SegmentLog
+from .vector_math import RowBuffer, matmul_rows, reciprocal_rank_fusion, top_k_indices
 
 
-@dataclass
+# Score of a chunk found by an explicit rule reference
+RULE_MATCH_SCORE = 0.9
+
+# Neighbors taken per hit from each adjacent page, its section decade and each of its tags
+NEIGHBOR_FANOUT = (5, 10, 5)
+
+# Rows linked into the ANN index per step of the background insert thread
+ANN_INSERT_BATCH = 256
+
+
+@dataclass(slots=True)
 class SearchResult:
     """Represents a search result from the vector store."""
     text: str
     metadata: Dict[str, Any]
     score: float
+    # Row of the chunk in the snapshot that produced it (-1 if unknown)
+    row: int = -1
+
+
+@dataclass(slots=True)
+class MultiSearchResult:
+    """Results of search_many(): one list per query, plus the fused ranking if requested."""
+    results: List[List[SearchResult]]
+    fused: Optional[List[SearchResult]] = None
+
+
+@dataclass(frozen=True, slots=True)
+class StoreSnapshot:
+    """
+    Immutable view of everything a read needs, published by writers.
+    
+    documents and the indexes may grow in place past size (appends are
+    never visible through an older snapshot's bounds); anything that
+    renumbers or rewrites rows publishes new objects instead.
+    """
+    documents: List["StoredDocument"]
+    embeddings: Optional[np.ndarray]
+    deleted: np.ndarray
+    deleted_count: int
+    columns: MetadataColumns
+    metadata_index: MetadataIndex
+    keyword_index: BM25Index
+    neighbors: NeighborIndex
+    ann_index: Optional[BaseANNIndex]
+    size: int
+    generation: int
 
 
-@dataclass
+@dataclass(slots=True)
 class StoredDocument:
-    """A document stored in the vector store."""
+    """A document stored in the vector store.
+    
+    Holds only references; the chunk's vector is its row in the embedding
+    matrix, which is the single copy of every embedding.
+    """
     chunk_id: str
     text: str
-    embedding: List[float]
     metadata: Dict[str, Any]
 
+    def __setstate__(self, state):
+        # Pickles from before slots (vector_store.pkl) carry a __dict__ that
+        # also holds an embedding list, which is dropped here
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **(state[1] or {})}
+        for name in ("chunk_id", "text", "metadata"):
+            object.__setattr__(self, name, state[name])
+
 
 class VectorStore:
     """NumPy-based vector store for document embeddings.
@@ -55,18 +124,117 @@ class VectorStore:
         
         # Store documents in memory with persistence
         self._documents: List[StoredDocument] = []
+        # _embeddings and _deleted are views of the filled prefix of
+        # capacity-doubling buffers, so appends never copy the whole matrix.
+        # Rows loaded or compacted into a segment stay memory-mapped; rows
+        # appended since are an in-memory tail (a TailedRows view)
         self._embeddings: Optional[np.ndarray] = None
+        self._embedding_buffer = RowBuffer()
+        # Tombstone bitmap: deleted rows stay in place until compaction purges them
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_buffer = RowBuffer(self._deleted)
+        self._deleted_count = 0
+        self._metadata_index = MetadataIndex()
+        self._metadata_columns = MetadataColumns()
+        self._neighbor_index = NeighborIndex()
+        self._keyword_index = BM25Index()
+        # chunk_id -> row of its live copy (writer-side; re-uploads reuse or replace rows)
+        self._chunk_rows: Dict[str, int] = {}
+        
+        # Multi-process deployments: one "writer" process ingests; "reader"
+        # workers memory-map its segments read-only (one shared copy of the
+        # matrix in the page cache) and re-attach when the manifest
+        # generation changes
+        self._shared_mode = getattr(settings, "vector_shared_mode", "off")
+        self._read_only = self._shared_mode == "reader"
+        self._refresh_interval = getattr(settings, "vector_refresh_interval", 2.0)
+        self._next_refresh = 0.0
+        # Re-attaching re-reads every segment and rebuilds the indexes, so it
+        # runs off the request path; reads keep the previous snapshot meanwhile
+        self._background_refresh = getattr(settings, "vector_background_refresh", True)
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._attached_generation: Optional[int] = None
         
-        # Persistence path
+        # Persistence: append-only segment log (see segment_log.py)
         self._persist_dir = Path(settings.chroma_persist_dir)
         self._persist_dir.mkdir(parents=True, exist_ok=True)
-        self._data_file = self._persist_dir / "vector_store.pkl"
+        self._legacy_file = self._persist_dir / "vector_store.pkl"
+        self._log = SegmentLog(
+            self._persist_dir,
+            compact_threshold=getattr(settings, "vector_compact_segments", 8),
+            read_only=self._read_only
+        )
+        self._background_compaction = getattr(settings, "vector_background_compaction", True)
+        self._compact_deleted_ratio = getattr(settings, "vector_compact_deleted_ratio", 0.25)
+        
+        # Writers (ingestion, deletes, compaction) serialize on this lock and
+        # publish a new snapshot when done; readers never take it
+        self._lock = threading.RLock()
+        self._snapshot_generation = 0
+        self._snapshot: Optional[StoreSnapshot] = None
+        self._batch_depth = 0
+        self._compaction_thread: Optional[threading.Thread] = None
         
         # Ollama settings
         self._ollama_url = settings.ollama_base_url
         self._embedding_model = settings.embedding_model
+        self._embed_batch_size = max(1, getattr(settings, "embedding_batch_size", 32))
+        self._embed_concurrency = max(1, getattr(settings, "embedding_concurrency", 4))
+        
+        # Chunk embeddings are cached on disk by (model, sha256(text))
+        self._embedding_cache = None
+        if getattr(settings, "embedding_cache_enabled", True):
+            self._embedding_cache = get_embedding_cache(self._persist_dir)
+        
+        # Pooled async HTTP client (created per event loop) and a bounded
+        # pool for CPU-bound scoring, so search_async never blocks the loop
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_client_loop = None
+        self._search_executor = ThreadPoolExecutor(
+            max_workers=max(1, getattr(settings, "search_threads", 4)),
+            thread_name_prefix="vector-search"
+        )
+        
+        # Sharded scans: exact searches over large matrices are split into
+        # row-range shards (views, no copies) scored in parallel and merged
+        # with a heap; NumPy releases the GIL inside the matmuls
+        self._shards = max(1, getattr(settings, "vector_shards", 1))
+        self._shard_min_rows = max(1, getattr(settings, "vector_shard_min_rows", 8192))
+        self._shard_executor: Optional[ThreadPoolExecutor] = None
+        if self._shards > 1:
+            # Separate from _search_executor, whose workers wait on these tasks
+            self._shard_executor = ThreadPoolExecutor(
+                max_workers=self._shards,
+                thread_name_prefix="vector-shard"
+            )
+        
+        # Repeated questions reuse their query vector
+        self._query_cache = QueryEmbeddingCache(
+            maxsize=getattr(settings, "query_cache_size", 256),
+            ttl=getattr(settings, "query_cache_ttl", 3600.0)
+        )
+        
+        # Optional ANN index ("flat" = exact search only); trained off the
+        # request path and swapped in when ready
+        self._index_kind = getattr(settings, "vector_index", "flat")
+        self._ann_min_rows = getattr(settings, "ann_min_rows", 1024)
+        self._ann_background = getattr(settings, "ann_background_build", True)
+        self._ann_index: Optional[BaseANNIndex] = None
+        self._ann_recall: Optional[float] = None
+        self._ann_thread: Optional[threading.Thread] = None
+        # New rows are linked into the index, and deleted rows dropped from
+        # it, by a background thread; searches scan the rows it does not
+        # cover yet exactly and skip deleted rows via the snapshot.
+        # _ann_lock keeps saves from seeing a half-linked batch
+        self._ann_insert_thread: Optional[threading.Thread] = None
+        self._ann_removals: List[np.ndarray] = []
+        self._ann_lock = threading.Lock()
+        self._ann_file = self._persist_dir / f"{self._index_kind}_index.npz"
+        # Bumped whenever rows are renumbered, which invalidates row ids held by the ANN index
+        self._row_generation = 0
         
         # Load existing data
+        self._publish()
         self._load()
         
         self._initialized = True
@@ -75,31 +243,487 @@ class VectorStore:
     
     def _load(self):
         """Load persisted data from disk."""
-        if self._data_file.exists():
+        try:
+            if self._log.exists():
+                records, embeddings = self._log.load()
+                self._set_rows([
+                    StoredDocument(chunk_id=chunk_id, text=text, metadata=metadata)
+                    for chunk_id, text, metadata in records
+                ], embeddings)
+            elif self._legacy_file.exists():
+                self._load_legacy()
+                # Migrate to the segment log so the next start is zero-copy
+                if not self._read_only:
+                    self._save()
+            else:
+                return
+            self._rebuild_indexes()
+            print(f"Loaded {len(self._documents)} documents from disk.")
+        except Exception as e:
+            print(f"Error loading data: {e}")
+            self._set_rows([], None)
+            self._rebuild_indexes()
+            self._publish()
+            return
+
+        self._attached_generation = self._log.generation
+        self._load_ann_index()
+        self._publish()
+        if self._needs_compaction():
+            self._schedule_compaction()
+        if self._ann_index is None:
+            self._schedule_ann_rebuild()
+
+    def _set_rows(self, documents: List[StoredDocument], embeddings: Optional[np.ndarray]):
+        """Replace every row (load, purge, clear); all of them start live."""
+        self._documents = documents
+        self._embedding_buffer = RowBuffer(embeddings, keep_base=True)
+        self._embeddings = embeddings
+        self._deleted_buffer = RowBuffer(np.zeros(len(documents), dtype=bool))
+        self._deleted = self._deleted_buffer.view()
+        self._deleted_count = 0
+
+    def _rebuild_indexes(self):
+        """Re-derive the metadata and keyword indexes from the stored rows.
+        
+        Fresh objects are built, so snapshots still holding the old ones
+        keep reading consistent row numbers.
+        """
+        self._metadata_index = MetadataIndex()
+        self._metadata_index.rebuild(doc.metadata for doc in self._documents)
+        self._metadata_columns = MetadataColumns()
+        self._metadata_columns.rebuild(doc.metadata for doc in self._documents)
+        self._neighbor_index = NeighborIndex()
+        self._neighbor_index.rebuild(doc.metadata for doc in self._documents)
+        self._keyword_index = BM25Index()
+        self._keyword_index.rebuild(doc.text for doc in self._documents)
+        self._chunk_rows = {doc.chunk_id: row for row, doc in enumerate(self._documents)}
+
+    def _publish(self):
+        """Atomically replace the snapshot readers see (call with the lock held, after a write)."""
+        self._snapshot_generation += 1
+        size = len(self._documents)
+        self._snapshot = StoreSnapshot(
+            documents=self._documents,
+            embeddings=self._embeddings,
+            deleted=self._deleted,
+            deleted_count=self._deleted_count,
+            columns=self._metadata_columns,
+            metadata_index=self._metadata_index,
+            keyword_index=self._keyword_index,
+            neighbors=self._neighbor_index,
+            ann_index=self._ann_index,
+            size=size,
+            generation=self._snapshot_generation
+        )
+
+    def snapshot(self) -> StoreSnapshot:
+        """The current read snapshot; stays valid however the store changes afterwards."""
+        if self._read_only:
+            self._maybe_refresh()
+        return self._snapshot
+
+    def _maybe_refresh(self):
+        """Schedule a re-attach if the writer committed since the last check (at most every refresh interval).
+        
+        Only the manifest generation is read here; the reload itself runs in
+        the background and publishes a new snapshot when it is ready.
+        """
+        now = time.monotonic()
+        if now < self._next_refresh:
+            return
+        self._next_refresh = now + self._refresh_interval
+        if self._log.read_generation() != self._attached_generation:
+            self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        """Re-attach, in a background thread unless disabled in settings."""
+        if not self._background_refresh:
+            self.refresh()
+            return
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(target=self.refresh, name="vector-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def refresh(self) -> bool:
+        """
+        Re-load the committed state written by another process (reader mode).
+        
+        The segment files are memory-mapped again and published as a new
+        snapshot; searches in flight keep reading the previous one.
+        
+        Returns:
+            True if a newer generation was attached
+        """
+        with self._lock:
+            generation = self._log.read_generation()
+            if generation is None or generation == self._attached_generation:
+                return False
             try:
-                with open(self._data_file, 'rb') as f:
-                    data = pickle.load(f)
-                    self._documents = data.get('documents', [])
-                    embeddings = data.get('embeddings')
-                    if embeddings is not None:
-                        self._embeddings = np.array(embeddings)
-                print(f"Loaded {len(self._documents)} documents from disk.")
+                records, embeddings = self._log.load()
             except Exception as e:
-                print(f"Error loading data: {e}")
-                self._documents = []
-                self._embeddings = None
-    
+                # Typically a compaction removed a segment mid-read; retried on the next check
+                print(f"Error re-attaching vector store: {e}")
+                return False
+            self._set_rows([
+                StoredDocument(chunk_id=chunk_id, text=text, metadata=metadata)
+                for chunk_id, text, metadata in records
+            ], embeddings)
+            self._rebuild_indexes()
+            self._row_generation += 1
+            self._ann_index = None
+            self._ann_removals = []
+            self._attached_generation = self._log.generation
+            if not self._load_ann_index():
+                self._schedule_ann_rebuild()
+            self._publish()
+        print(f"Re-attached vector store at generation {self._attached_generation} ({len(self._documents)} chunks).")
+        return True
+
+    def _read_only_error(self) -> Dict[str, Any]:
+        return {"status": "error", "message": "Vector store is read-only in this worker"}
+
+    def _index_rows(self, start: int, docs: List[StoredDocument]):
+        """Add newly appended rows to the metadata and keyword indexes."""
+        for offset, doc in enumerate(docs):
+            self._metadata_index.add(start + offset, doc.metadata)
+            self._keyword_index.add(start + offset, doc.text)
+            self._chunk_rows[doc.chunk_id] = start + offset
+        metadatas = [doc.metadata for doc in docs]
+        self._metadata_columns.append(start, metadatas)
+        self._neighbor_index.append(start, metadatas)
+
+    def _load_legacy(self):
+        """Load a pickled store written before the segment log (vector_store.pkl)."""
+        with open(self._legacy_file, 'rb') as f:
+            data = pickle.load(f)
+            embeddings = data.get('embeddings')
+            self._set_rows(
+                data.get('documents', []),
+                self._normalize(embeddings) if embeddings is not None else None
+            )
+
+    def _records(self, docs: List[StoredDocument]):
+        return [(doc.chunk_id, doc.text, doc.metadata) for doc in docs]
+
     def _save(self):
-        """Persist data to disk."""
+        """Rewrite the whole store as a single segment (migration and clear())."""
+        with self._lock:
+            try:
+                merged = self._log.rewrite(self._records(self._documents), self._embeddings, self._embedding_model)
+            except Exception as e:
+                print(f"Error saving data: {e}")
+                return
+            if merged is not None:
+                self._rebase_embeddings(merged)
+
+    def _commit(self):
+        """Flush staged segments/tombstones unless a batch() is still open."""
+        if self._batch_depth:
+            return
         try:
-            data = {
-                'documents': self._documents,
-                'embeddings': self._embeddings.tolist() if self._embeddings is not None else None
-            }
-            with open(self._data_file, 'wb') as f:
-                pickle.dump(data, f)
+            self._log.commit(self._embedding_model)
         except Exception as e:
             print(f"Error saving data: {e}")
+            return
+        if self._needs_compaction():
+            self._schedule_compaction()
+
+    def _needs_compaction(self) -> bool:
+        """Too many segments/tombstones on disk, or too many dead rows in memory."""
+        if self._read_only:
+            return False
+        return (
+            self._log.needs_compaction
+            or self._deleted_count > self._compact_deleted_ratio * len(self._documents)
+        )
+
+    @contextmanager
+    def batch(self):
+        """Group several adds/deletes into a single commit (one fsync round).
+        
+        Usage:
+            with vector_store.batch():
+                for doc in docs:
+                    await vector_store.add_document_async(doc)
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                self._commit()
+
+    def _schedule_compaction(self):
+        """Merge segments, in a background thread unless disabled in settings."""
+        if not self._background_compaction:
+            self.compact()
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._compaction_thread = threading.Thread(target=self.compact, name="vector-compaction", daemon=True)
+        self._compaction_thread.start()
+
+    def compact(self) -> bool:
+        """Purge deleted rows, merge all committed segments into one and drop applied tombstones.
+        
+        Returns:
+            False if skipped because uncommitted changes are pending
+        """
+        with self._lock:
+            if self._read_only or self._batch_depth or self._log.has_pending:
+                return False
+            self._purge_deleted()
+            records = self._records(self._documents)
+            embeddings = self._embeddings
+            upto_seq = self._log.committed_seq
+            epoch = self._log.rewrite_epoch
+            generation = self._row_generation
+        try:
+            # Writing the merged segment happens outside the lock so ingestion can continue;
+            # the log refuses the swap if clear() rewrote it in the meantime
+            merged = self._log.compact(records, embeddings, upto_seq, self._embedding_model, epoch=epoch)
+        except Exception as e:
+            print(f"Error compacting vector store: {e}")
+            return False
+        with self._lock:
+            # Unless rows were renumbered meanwhile, the merged rows are now read from the segment file
+            if merged is not None and generation == self._row_generation:
+                self._rebase_embeddings(merged)
+                self._publish()
+        # Refresh the saved graph so a restart does not re-insert every row added since
+        if self._ann_index is not None and self._ann_index.persistent:
+            self.save_ann_index()
+        return True
+
+    def _rebase_embeddings(self, merged: np.ndarray):
+        """Serve the first len(merged) rows from a just-written segment's memmap (call with the lock held).
+        
+        The in-memory copy of those rows is released once no snapshot uses
+        it; only rows appended after them stay resident.
+        """
+        self._embeddings = self._embedding_buffer.rebase(merged)
+        if self._ann_index is not None:
+            self._ann_index.attach(self._embeddings)
+
+    def _purge_deleted(self):
+        """Physically drop tombstoned rows (renumbers the remaining rows)."""
+        if not self._deleted_count:
+            return
+        keep = np.flatnonzero(~self._deleted)
+        documents = [self._documents[i] for i in keep]
+        self._set_rows(documents, self._embeddings[keep] if len(keep) else None)
+        self._rebuild_indexes()
+        self._invalidate_ann()
+        self._publish()
+
+    def clear(self):
+        """Remove every document from the store."""
+        if self._read_only:
+            print("Vector store is read-only in this worker; clear() ignored")
+            return
+        # Let a background compaction finish first instead of racing it on disk
+        compaction = self._compaction_thread
+        if compaction is not None and compaction is not threading.current_thread():
+            compaction.join()
+        with self._lock:
+            self._set_rows([], None)
+            self._rebuild_indexes()
+            self._invalidate_ann()
+            self._publish()
+            self._save()
+
+    def _invalidate_ann(self):
+        """Drop the ANN index after rows were renumbered; searches are exact until it is rebuilt."""
+        self._row_generation += 1
+        self._ann_index = None
+        self._ann_removals = []
+        self._schedule_ann_rebuild()
+
+    def _schedule_ann_rebuild(self):
+        """Train the ANN index, in a background thread unless disabled in settings."""
+        if self._index_kind == "flat" or len(self._documents) < self._ann_min_rows:
+            return
+        if not self._ann_background:
+            self.rebuild_ann_index()
+            return
+        if self._ann_thread is not None and self._ann_thread.is_alive():
+            return
+        self._ann_thread = threading.Thread(target=self.rebuild_ann_index, name="vector-ann-build", daemon=True)
+        self._ann_thread.start()
+
+    def _schedule_ann_insert(self):
+        """Apply appends and deletes to the ANN index, in a background thread unless disabled in settings.
+        
+        Call with the lock held. Searches scan the uncovered rows exactly meanwhile.
+        """
+        if not self._ann_background:
+            self._insert_ann_rows()
+            return
+        if self._ann_insert_thread is not None:
+            return  # The running thread picks up these rows too
+        self._ann_insert_thread = threading.Thread(target=self._insert_ann_rows, name="vector-ann-insert", daemon=True)
+        self._ann_insert_thread.start()
+
+    def _insert_ann_rows(self):
+        """Link appended rows into the ANN index and drop deleted ones, in batches outside the writer lock."""
+        try:
+            while True:
+                with self._lock:
+                    index = self._ann_index
+                    removals, self._ann_removals = self._ann_removals, []
+                    start = 0 if index is None else index.size
+                    stop = min(len(self._documents), start + ANN_INSERT_BATCH)
+                    if index is None or (start >= stop and not removals):
+                        self._ann_insert_thread = None
+                        return
+                    vectors = np.asarray(self._embeddings[start:stop]) if stop > start else None
+                    # Covers rows deleted before they were linked; later deletes are queued
+                    deleted = self._deleted
+                
+                with self._ann_lock:
+                    if vectors is not None:
+                        index.add(start, vectors)
+                    rows = np.concatenate(removals + [np.flatnonzero(deleted[start:stop]) + start])
+                    rows = rows[rows < index.size]
+                    if len(rows):
+                        index.remove(rows)
+                if index.needs_rebuild:
+                    with self._lock:
+                        if index is self._ann_index:
+                            self._schedule_ann_rebuild()
+        except Exception as e:
+            print(f"Error inserting into {self._index_kind} index: {e}")
+            with self._lock:
+                self._ann_insert_thread = None
+
+    def rebuild_ann_index(self) -> bool:
+        """Train a fresh ANN index over the current rows and swap it in.
+        
+        Training runs without holding the writer lock; rows appended in the
+        meantime are added to the new index before it is published.
+        
+        Returns:
+            True if a new index was published
+        """
+        try:
+            while True:
+                with self._lock:
+                    embeddings = self._embeddings
+                    size = len(self._documents)
+                    generation = self._row_generation
+                if self._index_kind == "flat" or embeddings is None or size < self._ann_min_rows:
+                    return False
+                fingerprint = self._row_fingerprint(size)
+                
+                index = create_ann_index(self._index_kind, settings)
+                vectors = embeddings[:size]
+                index.build(vectors)
+                recall = self._sample_recall(index, vectors)
+                # Saved before publishing, while nothing else can mutate it
+                self._save_ann_index(index, fingerprint)
+                
+                with self._lock:
+                    if generation != self._row_generation:
+                        continue  # Rows were renumbered while training; start over
+                    index.attach(self._embeddings)
+                    if self._deleted_count:
+                        index.remove(np.flatnonzero(self._deleted[:size]))
+                    self._ann_index = index
+                    self._ann_recall = recall
+                    self._publish()
+                    # Rows appended while training are linked like any other new rows
+                    self._schedule_ann_insert()
+                print(f"Built {self._index_kind} index over {size} chunks (sampled recall {recall:.3f})")
+                return True
+        except Exception as e:
+            print(f"Error building {self._index_kind} index: {e}")
+            return False
+
+    def _row_fingerprint(self, size: int) -> str:
+        """Hash of the first size rows, used to check a saved ANN index still matches them."""
+        digest = hashlib.sha1()
+        for doc in self._documents[:size]:
+            digest.update(doc.chunk_id.encode("utf-8"))
+            digest.update(hashlib.sha1(doc.text.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def _save_ann_index(self, index: BaseANNIndex, fingerprint: str):
+        """Persist a graph-type index next to the segment log."""
+        if not index.persistent or self._read_only:
+            return
+        try:
+            index.save(self._ann_file, fingerprint)
+        except Exception as e:
+            print(f"Error saving {self._index_kind} index: {e}")
+
+    def save_ann_index(self):
+        """Persist the active ANN index so the next start can skip the rebuild."""
+        with self._lock, self._ann_lock:
+            index = self._ann_index
+            if index is not None:
+                self._save_ann_index(index, self._row_fingerprint(index.size))
+
+    def _load_ann_index(self) -> bool:
+        """Load a saved ANN index whose rows are still a prefix of the store's rows.
+        
+        Rows appended since it was saved are inserted incrementally, in the
+        background unless disabled in settings.
+        """
+        if self._index_kind == "flat" or self._embeddings is None or not self._ann_file.exists():
+            return False
+        try:
+            index = create_ann_index(self._index_kind, settings)
+            if not index.persistent:
+                return False
+            fingerprint = index.load(self._ann_file)
+            if index.size > len(self._documents) or fingerprint != self._row_fingerprint(index.size):
+                print(f"Saved {self._index_kind} index is stale; rebuilding")
+                return False
+            index.attach(self._embeddings)
+        except Exception as e:
+            print(f"Error loading {self._index_kind} index: {e}")
+            return False
+        self._ann_index = index
+        print(f"Loaded {self._index_kind} index over {index.size} chunks.")
+        self._schedule_ann_insert()
+        return True
+
+    def _sample_recall(self, index: BaseANNIndex, vectors: np.ndarray, top_k: int = 10) -> float:
+        """Recall@top_k against exact search, using a sample of stored rows as queries."""
+        sample_size = min(len(vectors), getattr(settings, "ann_recall_sample", 32))
+        rows = np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)
+        return measure_recall(index, vectors, np.asarray(vectors[rows]), top_k)
+
+    def evaluate_ann_recall(self, queries: Optional[List[str]] = None, top_k: int = 10) -> Dict[str, Any]:
+        """
+        Report how closely the ANN index matches exact search.
+        
+        Args:
+            queries: Optional query texts to embed; defaults to sampled stored chunks
+            top_k: Results compared per query
+            
+        Returns:
+            Index type, recall@top_k (None when no index is active) and query count
+        """
+        index = self._ann_index
+        embeddings = self._embeddings
+        report = {"index": self._index_kind, "top_k": top_k, "recall": None, "queries": 0}
+        if index is None or embeddings is None:
+            return report
+        
+        vectors = embeddings[:index.size]
+        if queries:
+            query_vectors = np.vstack([self.embed_query(q) for q in queries])
+            report["recall"] = measure_recall(index, vectors, query_vectors, top_k)
+            report["queries"] = len(queries)
+        else:
+            report["recall"] = self._sample_recall(index, vectors, top_k)
+            report["queries"] = min(len(vectors), getattr(settings, "ann_recall_sample", 32))
+        return report
     
     def embed_text(self, text: str) -> List[float]:
         """Generate embedding for a single text using Ollama."""
@@ -114,12 +738,52 @@ class VectorStore:
         response.raise_for_status()
         return response.json()["embedding"]
     
+    def embed_query(self, query: str) -> np.ndarray:
+        """Unit-length float32 query vector, served from the LRU cache when possible."""
+        vector = self._query_cache.get(self._embedding_model, query)
+        if vector is None:
+            vector = self._normalize(self.embed_text(query))[0]
+            self._query_cache.put(self._embedding_model, query, vector)
+        return vector
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        size = self._embed_batch_size
+        return [texts[i:i + size] for i in range(0, len(texts), size)]
+
+    def _parse_batch(self, response: httpx.Response, expected: int) -> List[List[float]]:
+        response.raise_for_status()
+        embeddings = response.json()["embeddings"]
+        if len(embeddings) != expected:
+            raise ValueError(f"Expected {expected} embeddings, got {len(embeddings)}")
+        return embeddings
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts in one request to Ollama's batch endpoint."""
+        response = httpx.post(
+            f"{self._ollama_url}/api/embed",
+            json={
+                "model": self._embedding_model,
+                "input": texts
+            },
+            timeout=120.0
+        )
+        return self._parse_batch(response, len(texts))
+
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts using Ollama."""
+        """Generate embeddings for multiple texts using Ollama.
+        
+        Texts are sent in batches of embedding_batch_size; a batch that fails
+        is retried one text at a time through the single-text endpoint.
+        """
         embeddings = []
-        for text in texts:
-            embeddings.append(self.embed_text(text))
+        for batch in self._batches(texts):
+            try:
+                embeddings.extend(self.embed_batch(batch))
+            except Exception as e:
+                print(f"Batch embedding failed ({e}), falling back to per-item requests")
+                embeddings.extend(self.embed_text(text) for text in batch)
         return embeddings
+
     async def embed_text_async(self, client: httpx.AsyncClient, text: str) -> List[float]:
         """Generate embedding for a single text using Ollama asynchronously."""
         response = await client.post(
@@ -133,135 +797,260 @@ class VectorStore:
         response.raise_for_status()
         return response.json()["embedding"]
 
+    async def embed_batch_async(self, client: httpx.AsyncClient, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts in one request to Ollama's batch endpoint asynchronously."""
+        response = await client.post(
+            f"{self._ollama_url}/api/embed",
+            json={
+                "model": self._embedding_model,
+                "input": texts
+            },
+            timeout=120.0
+        )
+        return self._parse_batch(response, len(texts))
+
     async def embed_texts_async(self, texts: List[str]) -> List[List[float]]:
         """
         Generate embeddings for multiple texts in parallel using Ollama.
-        Uses a semaphore to limit concurrency.
+        Sends batches of embedding_batch_size, at most embedding_concurrency
+        in flight; a failed batch falls back to per-item requests.
         """
-        semaphore = asyncio.Semaphore(10)  # Limit to 10 concurrent requests
+        semaphore = asyncio.Semaphore(self._embed_concurrency)
         
-        async def semi_safe_embed(client, text):
+        async def embed_one_batch(client, batch):
             async with semaphore:
-                return await self.embed_text_async(client, text)
+                try:
+                    return await self.embed_batch_async(client, batch)
+                except Exception as e:
+                    print(f"Batch embedding failed ({e}), falling back to per-item requests")
+                    return [await self.embed_text_async(client, text) for text in batch]
         
-        timeout = httpx.Timeout(120.0, connect=10.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            tasks = [semi_safe_embed(client, text) for text in texts]
-            return await asyncio.gather(*tasks)
+        client = self._get_async_client()
+        tasks = [embed_one_batch(client, batch) for batch in self._batches(texts)]
+        results = await asyncio.gather(*tasks)
+        return [embedding for batch in results for embedding in batch]
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Shared AsyncClient for the running event loop (connections are reused)."""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0))
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def aclose(self):
+        """Close the pooled async HTTP client."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    async def embed_query_async(self, query: str) -> np.ndarray:
+        """Async variant of embed_query using the pooled client."""
+        vector = self._query_cache.get(self._embedding_model, query)
+        if vector is None:
+            embedding = await self.embed_text_async(self._get_async_client(), query)
+            vector = self._normalize(embedding)[0]
+            self._query_cache.put(self._embedding_model, query, vector)
+        return vector
+
+    def _embed_chunks(self, texts: List[str]) -> List[List[float]]:
+        """Embed chunk texts, skipping the embedding service for cached ones."""
+        if self._embedding_cache is None:
+            return self.embed_texts(texts)
+        return self._embedding_cache.get_or_embed(self._embedding_model, texts, self.embed_texts)
+
+    async def _embed_chunks_async(self, texts: List[str]) -> List[List[float]]:
+        """Async variant of _embed_chunks."""
+        if self._embedding_cache is None:
+            return await self.embed_texts_async(texts)
+        return await self._embedding_cache.get_or_embed_async(self._embedding_model, texts, self.embed_texts_async)
 
     async def add_document_async(self, doc: ProcessedDocument) -> Dict[str, Any]:
         """
         Add a processed document to the vector store asynchronously.
         
+        Re-uploading a doc_id with the same chunks is a no-op; changed content
+        replaces the old rows in one commit, re-embedding only changed chunks.
+        
         Args:
             doc: ProcessedDocument with chunks
             
         Returns:
             Summary of the indexing operation
         """
+        if self._read_only:
+            return self._read_only_error()
         if not doc.chunks:
             return {"status": "error", "message": "No chunks to index"}
+        if self._is_unchanged(doc):
+            return self._unchanged_summary(doc)
         
-        # Generate embeddings for all chunks in parallel
-        texts = [chunk.text for chunk in doc.chunks]
-        embeddings = await self.embed_texts_async(texts)
-        
-        # Create stored documents
-        new_docs = []
-        for chunk, embedding in zip(doc.chunks, embeddings):
-            stored_doc = StoredDocument(
-                chunk_id=chunk.chunk_id,
-                text=chunk.text,
-                embedding=embedding,
-                metadata=chunk.metadata
-            )
-            new_docs.append(stored_doc)
+        # Generate embeddings in parallel for chunks not already stored with the same text
+        reused, missing = self._reusable_vectors(doc.chunks)
+        embeddings = await self._embed_chunks_async([doc.chunks[i].text for i in missing]) if missing else []
+        
+        return self._store_document(doc, reused, missing, embeddings)
+
+    @staticmethod
+    def _content_fingerprint(pairs) -> str:
+        """Hash of a document's (chunk_id, text) pairs, in order."""
+        digest = hashlib.sha1()
+        for chunk_id, text in pairs:
+            digest.update(chunk_id.encode("utf-8") + b"\0" + text.encode("utf-8") + b"\0")
+        return digest.hexdigest()
+
+    def _live_rows(self, doc_id: str) -> np.ndarray:
+        """Rows of doc_id that are not tombstoned (call with the lock held)."""
+        rows = np.asarray(self._metadata_index.candidates({"doc_id": doc_id}), dtype=np.int64)
+        return rows[~self._deleted[rows]]
+
+    def _is_unchanged(self, doc: ProcessedDocument) -> bool:
+        """The live rows of doc.doc_id hold exactly doc's chunks (same ids, texts and order)."""
+        with self._lock:
+            stored = [(self._documents[row].chunk_id, self._documents[row].text) for row in self._live_rows(doc.doc_id)]
+        if len(stored) != len(doc.chunks):
+            return False
+        incoming = [(chunk.chunk_id, chunk.text) for chunk in doc.chunks]
+        return self._content_fingerprint(stored) == self._content_fingerprint(incoming)
+
+    def _unchanged_summary(self, doc: ProcessedDocument) -> Dict[str, Any]:
+        return {
+            "status": "success",
+            "doc_id": doc.doc_id,
+            "filename": doc.filename,
+            "chunks_indexed": 0,
+            "unchanged": True,
+            "message": "Document is already indexed",
+            "total_documents": len(self._documents) - self._deleted_count
+        }
+
+    def _reusable_vectors(self, chunks: List[DocumentChunk]):
+        """
+        Split chunks into those whose chunk_id is stored with the same text and the rest.
         
-        # Add to collection
-        self._documents.extend(new_docs)
+        Returns:
+            ({position: stored vector}, [positions that need embedding])
+        """
+        reused = {}
+        missing = []
+        with self._lock:
+            for i, chunk in enumerate(chunks):
+                row = self._chunk_rows.get(chunk.chunk_id)
+                if row is not None and not self._deleted[row] and self._documents[row].text == chunk.text:
+                    reused[i] = np.array(self._embeddings[row])
+                else:
+                    missing.append(i)
+        return reused, missing
+
+    def _store_document(self, doc: ProcessedDocument, reused: Dict[int, np.ndarray],
+                        missing: List[int], embeddings: List[List[float]]) -> Dict[str, Any]:
+        """Append doc's rows, atomically replacing any earlier version of the same doc_id."""
+        # Normalized once, here, instead of per search (reused rows already are)
+        fresh = self._normalize(embeddings) if missing else None
+        dim = fresh.shape[1] if fresh is not None else len(next(iter(reused.values())))
+        new_embeddings = np.empty((len(doc.chunks), dim), dtype=np.float32)
+        for i, vector in reused.items():
+            new_embeddings[i] = vector
+        if missing:
+            new_embeddings[missing] = fresh
         
-        # Update embeddings matrix
-        new_embeddings = np.array(embeddings)
-        if self._embeddings is None:
-            self._embeddings = new_embeddings
-        else:
-            self._embeddings = np.vstack([self._embeddings, new_embeddings])
+        # Create stored documents (vectors live only in the matrix)
+        new_docs = [
+            StoredDocument(chunk_id=chunk.chunk_id, text=chunk.text, metadata=chunk.metadata)
+            for chunk in doc.chunks
+        ]
         
-        # Persist changes
-        self._save()
+        with self._lock:
+            # Another upload of the same content may have won the race
+            if self._is_unchanged(doc):
+                return self._unchanged_summary(doc)
+            # Old rows are tombstoned and the new ones appended under one
+            # snapshot publish and one manifest commit
+            replaced = self._tombstone_rows(doc.doc_id)
+            self._append_rows(new_docs, new_embeddings)
+            # Live rows, as in get_stats (tombstoned ones wait for compaction)
+            total = len(self._documents) - self._deleted_count
         
         return {
             "status": "success",
             "doc_id": doc.doc_id,
             "filename": doc.filename,
             "chunks_indexed": len(new_docs),
-            "total_documents": len(self._documents)
+            "chunks_replaced": replaced,
+            "chunks_embedded": len(missing),
+            "total_documents": total
         }
 
-    def _cosine_similarity(self, query_embedding: np.ndarray, doc_embeddings: np.ndarray) -> np.ndarray:
-        """Compute cosine similarity between query and documents."""
-        # Normalize vectors
-        query_norm = query_embedding / np.linalg.norm(query_embedding)
-        doc_norms = doc_embeddings / np.linalg.norm(doc_embeddings, axis=1, keepdims=True)
-        
-        # Compute cosine similarity
-        similarities = np.dot(doc_norms, query_norm)
-        return similarities
-    
+    def _append_rows(self, new_docs: List[StoredDocument], new_embeddings: np.ndarray):
+        """Append rows to the collection, its indexes and the segment log."""
+        with self._lock:
+            # Add to collection and indexes
+            start = len(self._documents)
+            self._deleted = self._deleted_buffer.append(np.zeros(len(new_docs), dtype=bool))
+            self._documents.extend(new_docs)
+            self._index_rows(start, new_docs)
+            
+            # Update embeddings matrix (amortized O(new rows); searches see the filled prefix)
+            self._embeddings = self._embedding_buffer.append(new_embeddings)
+            
+            # New rows are linked into the ANN index off the request path
+            if self._ann_index is not None:
+                self._ann_index.attach(self._embeddings)
+                self._schedule_ann_insert()
+            else:
+                self._schedule_ann_rebuild()
+            
+            # Searches pick up the new rows from here on
+            self._publish()
+            
+            # Persist changes as a new segment
+            self._log.append(self._records(new_docs), new_embeddings)
+            self._commit()
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        """Return vectors as a contiguous float32 matrix of unit-length rows."""
+        matrix = np.array(vectors, dtype=np.float32, order="C")
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return matrix
+
     def add_document(self, doc: ProcessedDocument) -> Dict[str, Any]:
         """
         Add a processed document to the vector store.
         
+        Re-uploading a doc_id with the same chunks is a no-op; changed content
+        replaces the old rows in one commit, re-embedding only changed chunks.
+        
         Args:
             doc: ProcessedDocument with chunks
             
         Returns:
             Summary of the indexing operation
         """
+        if self._read_only:
+            return self._read_only_error()
         if not doc.chunks:
             return {"status": "error", "message": "No chunks to index"}
+        if self._is_unchanged(doc):
+            return self._unchanged_summary(doc)
         
-        # Generate embeddings for all chunks
-        texts = [chunk.text for chunk in doc.chunks]
-        embeddings = self.embed_texts(texts)
-        
-        # Create stored documents
-        new_docs = []
-        for chunk, embedding in zip(doc.chunks, embeddings):
-            stored_doc = StoredDocument(
-                chunk_id=chunk.chunk_id,
-                text=chunk.text,
-                embedding=embedding,
-                metadata=chunk.metadata
-            )
-            new_docs.append(stored_doc)
-        
-        # Add to collection
-        self._documents.extend(new_docs)
-        
-        # Update embeddings matrix
-        new_embeddings = np.array(embeddings)
-        if self._embeddings is None:
-            self._embeddings = new_embeddings
-        else:
-            self._embeddings = np.vstack([self._embeddings, new_embeddings])
+        # Generate embeddings for chunks not already stored with the same text
+        reused, missing = self._reusable_vectors(doc.chunks)
+        embeddings = self._embed_chunks([doc.chunks[i].text for i in missing]) if missing else []
         
-        # Persist changes
-        self._save()
-        
-        return {
-            "status": "success",
-            "doc_id": doc.doc_id,
-            "filename": doc.filename,
-            "chunks_indexed": len(new_docs),
-            "total_documents": len(self._documents)
-        }
+        return self._store_document(doc, reused, missing, embeddings)
     
     def search(
         self,
         query: str,
         top_k: int = None,
-        filter_doc_id: Optional[str] = None
+        filter_doc_id: Optional[str] = None,
+        min_score: Optional[float] = None,
+        where: Optional[Filter] = None
     ) -> List[SearchResult]:
         """
         Search for similar documents.
@@ -270,63 +1059,324 @@ class VectorStore:
             query: Search query text
             top_k: Number of results to return
             filter_doc_id: Optional filter by document ID
+            min_score: Optional raw cosine similarity threshold
+            where: Optional metadata filter expression (see metadata_columns.py)
             
         Returns:
             List of SearchResult objects
         """
         top_k = top_k or settings.top_k_results
         
-        if not self._documents or self._embeddings is None:
+        if not self.snapshot().size:
             return []
         
-        # Generate query embedding
-        query_embedding = np.array(self.embed_text(query))
+        # Generate query embedding (cached for repeated questions)
+        query_embedding = self.embed_query(query)
+        return self._search_vector(query_embedding, top_k, filter_doc_id, min_score, where)
+
+    async def search_async(
+        self,
+        query: str,
+        top_k: int = None,
+        filter_doc_id: Optional[str] = None,
+        min_score: Optional[float] = None,
+        where: Optional[Filter] = None
+    ) -> List[SearchResult]:
+        """
+        Non-blocking version of search().
+        
+        The query is embedded over the pooled async client and the similarity
+        scan runs on the bounded search thread pool, so concurrent requests
+        are not serialized on the event loop.
+        """
+        top_k = top_k or settings.top_k_results
+        
+        if not self.snapshot().size:
+            return []
+        
+        query_embedding = await self.embed_query_async(query)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._search_executor,
+            functools.partial(self._search_vector, query_embedding, top_k, filter_doc_id, min_score, where)
+        )
+
+    def _search_state(self, filter_doc_id: Optional[str], where: Optional[Filter]):
+        """
+        The snapshot a search reads, and the rows it must skip.
+        
+        Returns:
+            (snapshot, excluded, where): excluded is a mask over the
+            snapshot's rows (tombstones plus rows the filter rejects) or None
+        """
+        snapshot = self.snapshot()
+        n = snapshot.size
         
-        # Filter documents if needed
         if filter_doc_id:
-            indices = [i for i, doc in enumerate(self._documents) 
-                      if doc.metadata.get("doc_id") == filter_doc_id]
-            if not indices:
-                return []
-            filtered_embeddings = self._embeddings[indices]
-            filtered_docs = [self._documents[i] for i in indices]
+            doc_filter = Eq("doc_id", filter_doc_id)
+            where = doc_filter if where is None else doc_filter & where
+        
+        # One mask over the score vector (no copy of the matching matrix rows)
+        excluded = snapshot.deleted[:n] if snapshot.deleted_count else None
+        if where is not None:
+            keep = where.mask(snapshot.columns, n)
+            excluded = ~keep if excluded is None else excluded | ~keep
+        return snapshot, excluded, where
+
+    @staticmethod
+    def _make_result(doc: StoredDocument, raw_score: float, row: int = -1) -> SearchResult:
+        """Wrap a row and its raw cosine score as a SearchResult."""
+        # Apply a confidence boost to the score for better UI display
+        # This makes reasonably good matches feel more 'confident'
+        boosted_score = raw_score
+        if raw_score > 0.4:
+            # Scale from [0.4, 0.9] to [0.6, 0.98]
+            boosted_score = 0.6 + (raw_score - 0.4) * (0.38 / 0.5)
+        
+        return SearchResult(
+            text=doc.text,
+            metadata=doc.metadata,
+            score=min(0.99, max(0.01, boosted_score)),
+            row=row
+        )
+
+    def _search_vector(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int,
+        filter_doc_id: Optional[str] = None,
+        min_score: Optional[float] = None,
+        where: Optional[Filter] = None
+    ) -> List[SearchResult]:
+        """Score an embedded query against the matrix and build the top-k results."""
+        snapshot, excluded, where = self._search_state(filter_doc_id, where)
+        query = self._normalize(query_embedding)
+        
+        # Filtered searches scan exactly; otherwise the ANN index (if any)
+        # proposes candidates, which are rescored exactly
+        if snapshot.ann_index is not None and where is None:
+            rows, scores = self._rescore(snapshot, query[0], top_k, min_score)
         else:
-            filtered_embeddings = self._embeddings
-            filtered_docs = self._documents
+            rows, scores = self._scan(query, snapshot.embeddings, snapshot.size, excluded, top_k, min_score)[0]
         
-        # Compute similarities
-        similarities = self._cosine_similarity(query_embedding, filtered_embeddings)
+        return [self._make_result(snapshot.documents[row], float(score), int(row)) for row, score in zip(rows, scores)]
+
+    @staticmethod
+    def _rescore(snapshot: StoreSnapshot, query: np.ndarray, top_k: int, min_score: Optional[float]):
+        """Exact top-k among the live candidates the ANN index proposes: (rows, scores).
         
-        # Get top-k results
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        Rows the index has not linked yet are scored exactly as well.
+        """
+        covered = min(snapshot.ann_index.size, snapshot.size)
+        rows = snapshot.ann_index.search_within(query, top_k, snapshot.embeddings, covered)
+        # The index may already hold rows (and deletes) published after this snapshot
+        rows = rows[rows < covered]
+        similarities = snapshot.embeddings[rows] @ query
+        if covered < snapshot.size:
+            rows = np.concatenate([rows, np.arange(covered, snapshot.size)])
+            similarities = np.concatenate([similarities, matmul_rows(query, snapshot.embeddings, covered, snapshot.size)])
+        live = ~snapshot.deleted[rows]
+        rows, similarities = rows[live], similarities[live]
+        top = top_k_indices(similarities, top_k, min_score=min_score)
+        return rows[top], similarities[top]
+
+    def _shard_bounds(self, n: int) -> List[tuple]:
+        """Row ranges [lo, hi) of the shards a scan over n rows is split into."""
+        count = min(self._shards, n // self._shard_min_rows)
+        if count <= 1:
+            return [(0, n)]
+        size = -(-n // count)
+        return [(lo, min(lo + size, n)) for lo in range(0, n, size)]
+
+    @staticmethod
+    def _scan_shard(queries: np.ndarray, embeddings: np.ndarray, excluded: Optional[np.ndarray],
+                    lo: int, hi: int, top_k: int, min_score: Optional[float]):
+        """Per-query (rows, scores), best first, within rows lo..hi-1."""
+        similarities = matmul_rows(queries, embeddings, lo, hi)
+        if excluded is not None:
+            similarities[:, excluded[lo:hi]] = -np.inf
+        ranked = []
+        for row_scores in similarities:
+            top = top_k_indices(row_scores, top_k, min_score=min_score)
+            ranked.append((top + lo, row_scores[top]))
+        return ranked
+
+    def _scan(self, queries: np.ndarray, embeddings: np.ndarray, n: int,
+              excluded: Optional[np.ndarray], top_k: int, min_score: Optional[float]):
+        """
+        Exact top-k over rows :n for each unit-length query row.
         
-        # Build results
-        results = []
-        for idx in top_indices:
-            doc = filtered_docs[idx]
-            # Apply a confidence boost to the score for better UI display
-            # This makes reasonably good matches feel more 'confident'
-            raw_score = float(similarities[idx])
-            boosted_score = raw_score
-            if raw_score > 0.4:
-                # Scale from [0.4, 0.9] to [0.6, 0.98]
-                boosted_score = 0.6 + (raw_score - 0.4) * (0.38 / 0.5)
-            
-            results.append(SearchResult(
-                text=doc.text,
-                metadata=doc.metadata,
-                score=min(0.99, max(0.01, boosted_score))
+        Large matrices are scattered over row-range shards on the shard pool
+        and each query's shard rankings are gathered with a k-way heap merge.
+        
+        Returns:
+            One (rows, scores) pair per query, best first
+        """
+        if excluded is not None and min_score is None:
+            # Excluded rows score -inf and must never be returned
+            min_score = -np.finfo(np.float32).max
+        
+        bounds = self._shard_bounds(n)
+        if len(bounds) == 1 or self._shard_executor is None:
+            return self._scan_shard(queries, embeddings, excluded, 0, n, top_k, min_score)
+        
+        shards = list(self._shard_executor.map(
+            lambda bound: self._scan_shard(queries, embeddings, excluded, bound[0], bound[1], top_k, min_score),
+            bounds
+        ))
+        merged = []
+        for q in range(len(queries)):
+            # Shards are in row order, so ties still go to the lower row
+            best = list(islice(heapq.merge(
+                *(zip(shard[q][1].tolist(), shard[q][0].tolist()) for shard in shards),
+                key=lambda pair: pair[0],
+                reverse=True
+            ), top_k))
+            merged.append((
+                np.array([row for _, row in best], dtype=np.intp),
+                np.array([score for score, _ in best], dtype=np.float32)
             ))
+        return merged
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """(q, dim) unit-length query matrix; cache misses are embedded in one batched request."""
+        cached, misses = self._query_lookup(queries)
+        embeddings = self.embed_texts(misses) if misses else []
+        return self._query_matrix(queries, cached, misses, embeddings)
+
+    async def embed_queries_async(self, queries: List[str]) -> np.ndarray:
+        """Async variant of embed_queries using the pooled client."""
+        cached, misses = self._query_lookup(queries)
+        embeddings = await self.embed_texts_async(misses) if misses else []
+        return self._query_matrix(queries, cached, misses, embeddings)
+
+    def _query_lookup(self, queries: List[str]):
+        """Cached query vectors, and the distinct queries still to embed (first-seen order)."""
+        cached, misses = {}, []
+        for query in dict.fromkeys(queries):
+            vector = self._query_cache.get(self._embedding_model, query)
+            if vector is None:
+                misses.append(query)
+            else:
+                cached[query] = vector
+        return cached, misses
+
+    def _query_matrix(self, queries: List[str], cached: Dict[str, np.ndarray], misses: List[str], embeddings) -> np.ndarray:
+        """Stack query vectors in query order, caching the freshly embedded ones."""
+        if misses:
+            for query, vector in zip(misses, self._normalize(embeddings)):
+                self._query_cache.put(self._embedding_model, query, vector)
+                cached[query] = vector
+        return np.vstack([cached[query] for query in queries])
+
+    def search_many(
+        self,
+        queries: List[str],
+        top_k: int = None,
+        filter_doc_id: Optional[str] = None,
+        min_score: Optional[float] = None,
+        where: Optional[Filter] = None,
+        fuse: bool = False
+    ) -> MultiSearchResult:
+        """
+        Search several queries (e.g. expansions of one question) at once.
         
-        return results
+        All queries are embedded in one batched request and scored with a
+        single (q, dim) x (dim, n) product instead of one scan per query.
+        
+        Args:
+            queries: Search query texts
+            top_k: Number of results per query (and for the fused ranking)
+            filter_doc_id: Optional filter by document ID
+            min_score: Optional raw cosine similarity threshold
+            where: Optional metadata filter expression, shared by all queries
+            fuse: Also merge the per-query rankings with reciprocal rank fusion
+            
+        Returns:
+            MultiSearchResult with one result list per query and the fused list
+        """
+        top_k = top_k or settings.top_k_results
+        
+        if not queries or not self.snapshot().size:
+            return MultiSearchResult(results=[[] for _ in queries], fused=[] if fuse else None)
+        
+        query_matrix = self.embed_queries(queries)
+        return self._search_matrix(query_matrix, top_k, filter_doc_id, min_score, where, fuse)
+
+    async def search_many_async(
+        self,
+        queries: List[str],
+        top_k: int = None,
+        filter_doc_id: Optional[str] = None,
+        min_score: Optional[float] = None,
+        where: Optional[Filter] = None,
+        fuse: bool = False
+    ) -> MultiSearchResult:
+        """Non-blocking version of search_many(); scoring runs on the search thread pool."""
+        top_k = top_k or settings.top_k_results
+        
+        if not queries or not self.snapshot().size:
+            return MultiSearchResult(results=[[] for _ in queries], fused=[] if fuse else None)
+        
+        query_matrix = await self.embed_queries_async(queries)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._search_executor,
+            functools.partial(self._search_matrix, query_matrix, top_k, filter_doc_id, min_score, where, fuse)
+        )
+
+    def _search_matrix(
+        self,
+        query_matrix: np.ndarray,
+        top_k: int,
+        filter_doc_id: Optional[str] = None,
+        min_score: Optional[float] = None,
+        where: Optional[Filter] = None,
+        fuse: bool = False
+    ) -> MultiSearchResult:
+        """Score a matrix of embedded queries and build per-query (and fused) results."""
+        snapshot, excluded, where = self._search_state(filter_doc_id, where)
+        documents = snapshot.documents
+        
+        if snapshot.ann_index is not None and where is None:
+            # Candidates differ per query, so each is rescored on its own
+            scored = [self._rescore(snapshot, query, top_k, min_score) for query in query_matrix]
+        else:
+            # One matrix-matrix product per shard covers every query
+            scored = self._scan(query_matrix, snapshot.embeddings, snapshot.size, excluded, top_k, min_score)
+        
+        results = [
+            [self._make_result(documents[row], float(score), int(row)) for row, score in zip(rows, scores)]
+            for rows, scores in scored
+        ]
+        fused = None
+        if fuse:
+            fused = [
+                self._make_result(documents[row], score, row)
+                for row, score in reciprocal_rank_fusion(scored, top_k)
+            ]
+        return MultiSearchResult(results=results, fused=fused)
     
     def search_by_metadata(self, filters: Dict[str, Any], limit: int = 10) -> List[SearchResult]:
         """Search documents by metadata filters."""
-        if not self._documents:
+        snapshot = self.snapshot()
+        if not snapshot.size:
             return []
             
+        # Only visit rows the inverted index says can match; each is still
+        # checked against every filter below
+        rows = snapshot.metadata_index.candidates(filters)
+        if rows is None:
+            rows = range(snapshot.size)
+        deleted = snapshot.deleted
+        
         results = []
-        for doc in self._documents:
+        for row in rows:
+            if row >= snapshot.size:
+                break  # Appended after this snapshot (candidates are in row order)
+            if deleted[row]:
+                continue
+            doc = snapshot.documents[row]
             match = True
             for key, value in filters.items():
                 if key not in doc.metadata:
@@ -352,93 +1402,121 @@ class VectorStore:
                 results.append(SearchResult(
                     text=doc.text,
                     metadata=doc.metadata,
-                    score=1.0 # Exact metadata match
+                    score=1.0, # Exact metadata match
+                    row=row
                 ))
                 if len(results) >= limit:
                     break
                     
         return results
 
-    def keyword_scan(self, keywords: List[str], limit: int = 10) -> List[SearchResult]:
-        """Perform a keyword/regex scan on documents."""
-        if not self._documents:
-            return []
+    def lookup_rules(self, refs: List[str], limit: int = 10, filter_doc_id: Optional[str] = None) -> List[SearchResult]:
+        """
+        Chunks filed under explicit rule references, without embedding anything.
+        
+        Args:
+            refs: Normalized rule keys (see rule_refs.extract_rule_refs)
+            limit: Maximum number of chunks to return
+            filter_doc_id: Optional filter by document ID
             
+        Returns:
+            SearchResults for the most specific references first, in row order within each
+        """
+        snapshot = self.snapshot()
         results = []
-        import re
-        patterns = [re.compile(rf"\b{re.escape(k)}\b", re.IGNORECASE) for k in keywords]
-        
-        for doc in self._documents:
-            lower_text = doc.text.lower()
-            match_count = 0
-            for pattern in patterns:
-                if pattern.search(doc.text):
-                    match_count += 1
-            
-            if match_count > 0:
-                results.append(SearchResult(
-                    text=doc.text,
-                    metadata=doc.metadata,
-                    score=min(1.0, 0.5 + (match_count * 0.1))
-                ))
-            
-            if len(results) >= limit:
-                break
-                
-        # Sort by score
-        results.sort(key=lambda x: x.score, reverse=True)
-        return results[:limit]
+        seen_rows = set()
+        # "1102A" before "1102", whose rows include it
+        for ref in sorted(dict.fromkeys(refs), key=len, reverse=True):
+            rows = snapshot.metadata_index.rule_rows(ref)
+            # Stops as soon as limit results are collected
+            for row in live_rows(rows, len(rows), snapshot.size, snapshot.deleted):
+                doc = snapshot.documents[row]
+                if row in seen_rows or (filter_doc_id and doc.metadata.get("doc_id") != filter_doc_id):
+                    continue
+                seen_rows.add(row)
+                results.append(SearchResult(text=doc.text, metadata=doc.metadata, score=RULE_MATCH_SCORE, row=row))
+                if len(results) >= limit:
+                    return results
+        return results
+
+    def keyword_scan(self, keywords: List[str], limit: int = 10) -> List[SearchResult]:
+        """Rank chunks containing any of the keywords with BM25."""
+        snapshot = self.snapshot()
+        if not snapshot.size or not keywords:
+            return []
+        
+        hits = snapshot.keyword_index.search(
+            keywords,
+            top_k=limit,
+            exclude=snapshot.deleted if snapshot.deleted_count else None,
+            size=snapshot.size
+        )
+        if not hits:
+            return []
+        
+        # Scale BM25 into (0.5, 1.0] relative to the best hit
+        best = hits[0][1]
+        return [
+            SearchResult(
+                text=snapshot.documents[row].text,
+                metadata=snapshot.documents[row].metadata,
+                score=min(1.0, 0.5 + 0.5 * score / best),
+                row=row
+            )
+            for row, score in hits
+        ]
+
+    def _resolve_row(self, snapshot: StoreSnapshot, result: SearchResult) -> int:
+        """Row of a result in snapshot, or -1 (e.g. rows were renumbered since it was found)."""
+        row = result.row
+        if 0 <= row < snapshot.size and snapshot.documents[row].metadata is result.metadata:
+            return row
+        # Fall back to the chunk's page postings
+        candidates = snapshot.metadata_index.candidates(
+            {"doc_id": result.metadata.get("doc_id"), "page": result.metadata.get("page")}
+        ) or []
+        for row in candidates:
+            if row < snapshot.size and snapshot.documents[row].metadata == result.metadata:
+                return row
+        return -1
 
     def expand_neighbors(self, base_results: List[SearchResult], limit_per_hit: int = 3) -> List[SearchResult]:
-        """Expand retrieval to include neighboring pages/sections."""
+        """Expand retrieval to include neighboring pages/sections.
+        
+        Walks the adjacency lists built at ingest (see neighbor_index.py);
+        fan-out per hit is bounded by NEIGHBOR_FANOUT and results are
+        deduplicated by row number.
+        """
+        snapshot = self.snapshot()
+        neighbors = snapshot.neighbors
+        deleted = snapshot.deleted
         expanded_results = list(base_results)
-        seen_ids = {f"{r.metadata.get('doc_id')}_{r.metadata.get('page')}_{r.metadata.get('chunk_index')}" for r in base_results}
+        base_rows = [self._resolve_row(snapshot, r) for r in base_results]
+        seen_rows = {row for row in base_rows if row >= 0}
+        
+        def add(rows: List[int], limit: int, score: float):
+            for row in live_rows(rows, limit, snapshot.size, deleted):
+                if row not in seen_rows:
+                    doc = snapshot.documents[row]
+                    expanded_results.append(SearchResult(text=doc.text, metadata=doc.metadata, score=score, row=row))
+                    seen_rows.add(row)
         
-        for res in base_results:
-            doc_id = res.metadata.get("doc_id")
-            page = res.metadata.get("page")
-            section_id = res.metadata.get("section_id")
-            topic_tags = res.metadata.get("topic_tags", [])
+        page_limit, section_limit, tag_limit = NEIGHBOR_FANOUT
+        for res, row in zip(base_results, base_rows):
+            if row < 0:
+                continue
             
-            # 1. Same page (±1)
-            if page:
-                neighbor_pages = self.search_by_metadata({"doc_id": doc_id, "page": page}, limit=5)
-                # Also try page-1 if page > 1
-                if page > 1:
-                    neighbor_pages.extend(self.search_by_metadata({"doc_id": doc_id, "page": page - 1}, limit=5))
-                neighbor_pages.extend(self.search_by_metadata({"doc_id": doc_id, "page": page + 1}, limit=5))
-                
-                for nr in neighbor_pages:
-                    nr_id = f"{nr.metadata.get('doc_id')}_{nr.metadata.get('page')}_{nr.metadata.get('chunk_index')}"
-                    if nr_id not in seen_ids:
-                        nr.score = 0.8 # Neighbors have slightly lower score
-                        expanded_results.append(nr)
-                        seen_ids.add(nr_id)
-
-            # 2. Section range neighbours (e.g. 7201..7209 if base is 7207)
-            if section_id:
-                # Find range
-                section_start = (section_id // 10) * 10
-                section_end = section_start + 9
-                neighbor_sections = self.search_by_metadata({"doc_id": doc_id, "section_id": (section_start, section_end)}, limit=10)
-                
-                for nr in neighbor_sections:
-                    nr_id = f"{nr.metadata.get('doc_id')}_{nr.metadata.get('page')}_{nr.metadata.get('chunk_index')}"
-                    if nr_id not in seen_ids:
-                        nr.score = 0.85
-                        expanded_results.append(nr)
-                        seen_ids.add(nr_id)
+            # 1. Same page (±1); neighbors have slightly lower score
+            for page_rows in neighbors.adjacent_pages(row):
+                add(page_rows, page_limit, 0.8)
+            
+            # 2. Section range neighbours (e.g. 7200..7209 if base is 7207)
+            add(neighbors.section_siblings(row), section_limit, 0.85)
             
             # 3. Same topic tag (e.g. "regionals")
-            for tag in topic_tags:
-                topic_results = self.search_by_metadata({"topic_tags": tag}, limit=5)
-                for tr in topic_results:
-                    tr_id = f"{tr.metadata.get('doc_id')}_{tr.metadata.get('page')}_{tr.metadata.get('chunk_index')}"
-                    if tr_id not in seen_ids:
-                        tr.score = 0.75
-                        expanded_results.append(tr)
-                        seen_ids.add(tr_id)
-                        
+            for tag in res.metadata.get("topic_tags") or []:
+                add(neighbors.tagged(tag), tag_limit, 0.75)
+        
         return expanded_results
     
     def delete_document(self, doc_id: str) -> Dict[str, Any]:
@@ -451,39 +1529,60 @@ class VectorStore:
         Returns:
             Deletion summary
         """
-        # Find indices to delete
-        indices_to_delete = [i for i, doc in enumerate(self._documents) 
-                           if doc.metadata.get("doc_id") == doc_id]
-        
-        if not indices_to_delete:
-            return {"status": "not_found", "message": f"No document with ID {doc_id}"}
-        
-        # Remove from documents list
-        indices_to_keep = [i for i in range(len(self._documents)) 
-                         if i not in indices_to_delete]
-        
-        self._documents = [self._documents[i] for i in indices_to_keep]
-        
-        # Update embeddings matrix
-        if indices_to_keep and self._embeddings is not None:
-            self._embeddings = self._embeddings[indices_to_keep]
-        else:
-            self._embeddings = None
-        
-        # Persist changes
-        self._save()
+        if self._read_only:
+            return self._read_only_error()
+        with self._lock:
+            deleted_count = self._tombstone_rows(doc_id)
+            if not deleted_count:
+                return {"status": "not_found", "message": f"No document with ID {doc_id}"}
+            self._publish()
+            self._commit()
         
         return {
             "status": "success",
             "doc_id": doc_id,
-            "chunks_deleted": len(indices_to_delete)
+            "chunks_deleted": deleted_count
         }
+
+    def _tombstone_rows(self, doc_id: str) -> int:
+        """Mark doc_id's live rows deleted and stage the log tombstone (call with the lock held).
+        
+        Returns:
+            Number of rows deleted; the caller publishes and commits
+        """
+        # Rows come from the doc_id postings; only still-live ones are deleted
+        rows = self._live_rows(doc_id)
+        if not len(rows):
+            return 0
+        
+        # Logical delete: searches skip tombstoned rows until compaction purges them.
+        # The mask is copied, not written in place, so published snapshots stay unchanged
+        deleted = self._deleted.copy()
+        deleted[rows] = True
+        self._deleted_buffer = RowBuffer(deleted)
+        self._deleted = deleted
+        self._deleted_count += len(rows)
+        for row in rows:
+            chunk_id = self._documents[row].chunk_id
+            if self._chunk_rows.get(chunk_id) == row:
+                del self._chunk_rows[chunk_id]
+        if self._ann_index is not None:
+            self._ann_removals.append(rows)
+            self._schedule_ann_insert()
+        
+        # Persisted as a tombstone with the next commit
+        self._log.tombstone(doc_id)
+        return len(rows)
     
     def list_documents(self) -> List[Dict[str, Any]]:
         """List all indexed documents."""
         # Group by document
         docs = {}
-        for doc in self._documents:
+        snapshot = self.snapshot()
+        deleted = snapshot.deleted
+        for row, doc in enumerate(snapshot.documents[:snapshot.size]):
+            if deleted[row]:
+                continue
             doc_id = doc.metadata.get("doc_id")
             if doc_id not in docs:
                 docs[doc_id] = {
@@ -495,11 +1594,23 @@ class VectorStore:
         
         return list(docs.values())
     
+    def _ann_stats(self) -> Dict[str, Any]:
+        index = self._ann_index
+        if index is None:
+            return {"type": self._index_kind, "active": False}
+        return {**index.stats(), "active": True, "recall": self._ann_recall}
+    
     def get_stats(self) -> Dict[str, Any]:
         """Get vector store statistics."""
+        snapshot = self.snapshot()
         docs = self.list_documents()
         return {
-            "total_chunks": len(self._documents),
+            "total_chunks": snapshot.size - snapshot.deleted_count,
+            "deleted_chunks": snapshot.deleted_count,
             "total_documents": len(docs),
+            "query_cache": self._query_cache.stats(),
+            "ann_index": self._ann_stats(),
+            "shards": len(self._shard_bounds(snapshot.size)),
+            "generation": snapshot.generation,
             "documents": docs
         }
@@ -1,7 +1,5 @@
 import sys
 import os
-import pickle
-from pathlib import Path
 
 # Add app to path
 sys.path.append(os.getcwd())
@@ -9,17 +7,12 @@ sys.path.append(os.getcwd())
 from app.services.vector_store import VectorStore
 
 def check_chunks():
-    # Force load from disk
-    persist_dir = Path("./chroma_db")
-    data_file = persist_dir / "vector_store.pkl"
+    # Loads the on-disk index (migrating an old vector_store.pkl if needed)
+    docs = VectorStore()._documents
     
-    if not data_file.exists():
+    if not docs:
         print("No vector store found.")
         return
-
-    with open(data_file, 'rb') as f:
-        data = pickle.load(f)
-        docs = data.get('documents', [])
         
     print(f"Total docs: {len(docs)}")
     
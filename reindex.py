@@ -15,9 +15,7 @@ async def reindex():
     
     # Initialize VectorStore and CLEAR it
     vs = VectorStore()
-    vs._documents = []
-    vs._embeddings = None
-    vs._save()
+    vs.clear()
     print("Vector Store cleared.")
     
     upload_dir = Path("./uploads")
@@ -27,18 +25,20 @@ async def reindex():
         print("No PDF files found in uploads/")
         return
         
-    for file_path in files:
-        print(f"Processing {file_path.name}...")
-        try:
-            # Process the PDF
-            processed_doc = pdf_processor.process_pdf(str(file_path), file_path.name)
-            
-            # Index in vector store
-            result = await vs.add_document_async(processed_doc)
-            print(f"Indexed {result['chunks_indexed']} chunks.")
-            
-        except Exception as e:
-            print(f"Error processing {file_path.name}: {e}")
+    # One commit for the whole run instead of one per PDF
+    with vs.batch():
+        for file_path in files:
+            print(f"Processing {file_path.name}...")
+            try:
+                # Process the PDF
+                processed_doc = pdf_processor.process_pdf(str(file_path), file_path.name)
+                
+                # Index in vector store
+                result = await vs.add_document_async(processed_doc)
+                print(f"Indexed {result['chunks_indexed']} chunks.")
+                
+            except Exception as e:
+                print(f"Error processing {file_path.name}: {e}")
 
 if __name__ == "__main__":
     if sys.platform == 'win32':
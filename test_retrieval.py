@@ -37,8 +37,8 @@ async def test_retrieval():
         print("Searching...")
         all_results = []
         seen = set()
-        for i, query in enumerate(queries):
-            results = rag.vector_store.search(query, top_k=3)
+        batch = rag.vector_store.search_many(queries, top_k=3)
+        for i, (query, results) in enumerate(zip(queries, batch.results)):
             print(f"  Query {i+1} ('{query}'): Found {len(results)} results")
             for r in results:
                 key = f"{r.metadata.get('doc_id')}_{r.metadata.get('chunk_index')}"
@@ -0,0 +1,1941 @@
+"""
+Vector Store Tests
+"""
+import re
+import zlib
+import asyncio
+import threading
+import json
+import pickle
+import pytest
+import httpx
+import numpy as np
+from types import SimpleNamespace
+from dataclasses import dataclass
+
+from app.services import vector_store as vector_store_module
+from app.services.vector_store import VectorStore, StoredDocument
+from app.services.pdf_processor import DocumentChunk, ProcessedDocument
+from app.services.vector_math import (
+    RowBuffer, TailedRows, matmul_rows, reciprocal_rank_fusion, row_blocks, top_k_indices
+)
+from app.services.embedding_cache import EmbeddingCache, CachedEmbeddings, QueryEmbeddingCache
+from app.services.ann_factory import create_ann_index
+from app.services.ann_index import measure_recall
+from app.services.ivf_index import IVFIndex
+from app.services.hnsw_index import HNSWIndex
+from app.services.quantized_index import ScalarQuantizedIndex
+from app.services.binary_index import BinaryIndex, POPCOUNT_TABLE, pack_signs
+from app.services.neighbor_index import NeighborIndex, live_rows
+from app.services.rule_refs import extract_rule_refs, normalize_rule_ref, rule_keys
+from app.services.metadata_columns import (
+    MetadataColumns, Eq, In, Range, HasTag, filter_from_dict, MAX_TAG_BITS
+)
+
+EMBEDDING_DIM = 64
+
+
+def fake_embedding(text: str):
+    """Deterministic bag-of-words embedding so similar texts score higher"""
+    vector = [0.0] * EMBEDDING_DIM
+    for token in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(token.encode()) % EMBEDDING_DIM] += 1.0
+    return vector
+
+
+def make_document(doc_id: str, texts, filename: str = "rulebook.pdf", **meta) -> ProcessedDocument:
+    """Build a ProcessedDocument with one chunk per text"""
+    chunks = []
+    for i, text in enumerate(texts):
+        metadata = {
+            "doc_id": doc_id,
+            "filename": filename,
+            "page": i + 1,
+            "chunk_index": 0,
+            "section_id": None,
+            "subrule": None,
+            "section_full": None,
+            "subject_role": "general",
+            "topic_tags": [],
+        }
+        metadata.update(meta)
+        chunks.append(DocumentChunk(text=text, metadata=metadata, chunk_id=f"{doc_id}_p{i + 1}_c0"))
+    return ProcessedDocument(
+        doc_id=doc_id,
+        filename=filename,
+        total_pages=len(texts),
+        total_chunks=len(chunks),
+        chunks=chunks
+    )
+
+
+@pytest.fixture
+def store_settings(tmp_path, monkeypatch):
+    """Point the vector store at a temporary directory"""
+    test_settings = SimpleNamespace(
+        chroma_persist_dir=str(tmp_path / "vectors"),
+        ollama_base_url="http://ollama.test",
+        embedding_model="test-embed",
+        top_k_results=5,
+        vector_compact_segments=8,
+        vector_background_compaction=False,
+        embedding_batch_size=4,
+        embedding_concurrency=2,
+    )
+    monkeypatch.setattr(vector_store_module, "settings", test_settings)
+    return test_settings
+
+
+@pytest.fixture
+def store(store_settings, monkeypatch):
+    """Fresh VectorStore instance with a fake embedding backend"""
+    async def fake_embed_texts_async(self, texts):
+        return [fake_embedding(t) for t in texts]
+
+    async def fake_embed_text_async(self, client, text):
+        return fake_embedding(text)
+
+    monkeypatch.setattr(VectorStore, "_instance", None)
+    monkeypatch.setattr(VectorStore, "embed_text", lambda self, text: fake_embedding(text))
+    monkeypatch.setattr(VectorStore, "embed_texts", lambda self, texts: [fake_embedding(t) for t in texts])
+    monkeypatch.setattr(VectorStore, "embed_texts_async", fake_embed_texts_async)
+    monkeypatch.setattr(VectorStore, "embed_text_async", fake_embed_text_async)
+    yield VectorStore()
+    VectorStore._instance = None
+
+
+@dataclass
+class LegacyStoredDocument:
+    """StoredDocument as pickled before it was slotted (with an embedding list)"""
+    chunk_id: str
+    text: str
+    embedding: list
+    metadata: dict
+
+
+LegacyStoredDocument.__module__ = StoredDocument.__module__
+LegacyStoredDocument.__qualname__ = StoredDocument.__qualname__
+
+
+def reopen(monkeypatch):
+    """Drop the singleton so the next VectorStore() reloads from disk"""
+    monkeypatch.setattr(VectorStore, "_instance", None)
+    return VectorStore()
+
+
+class TestEmbeddingMatrix:
+    """Test the in-memory embedding matrix"""
+
+    def test_embeddings_are_normalized_float32(self, store):
+        """Rows are unit-length float32 after indexing"""
+        store.add_document(make_document("doc1", ["coach must be 21 years old", "whip length rules"]))
+
+        assert store._embeddings.dtype == np.float32
+        assert store._embeddings.flags["C_CONTIGUOUS"]
+        np.testing.assert_allclose(np.linalg.norm(store._embeddings, axis=1), 1.0, rtol=1e-5)
+
+    def test_search_ranks_best_match_first(self, store):
+        """The most similar chunk is returned first"""
+        store.add_document(make_document("doc1", [
+            "coach must be 21 years old",
+            "whip length may not exceed 30 inches",
+            "points accumulate toward regionals",
+        ]))
+
+        results = store.search("whip length limit", top_k=2)
+        assert len(results) == 2
+        assert "whip" in results[0].text
+        assert results[0].score >= results[1].score
+
+    def test_filter_doc_id(self, store):
+        """Search can be restricted to one document"""
+        store.add_document(make_document("doc1", ["whip rules for riders"]))
+        store.add_document(make_document("doc2", ["whip rules for coaches"]))
+
+        results = store.search("whip rules", top_k=5, filter_doc_id="doc2")
+        assert [r.metadata["doc_id"] for r in results] == ["doc2"]
+
+    @pytest.mark.asyncio
+    async def test_add_document_async(self, store):
+        """Async indexing produces the same matrix layout"""
+        result = await store.add_document_async(make_document("doc1", ["alternate riders", "designated alternate"]))
+
+        assert result["chunks_indexed"] == 2
+        assert store._embeddings.shape == (2, EMBEDDING_DIM)
+        assert store._embeddings.dtype == np.float32
+
+
+class TestTopK:
+    """Test the shared top-k selection helper"""
+
+    def test_matches_full_sort(self):
+        """argpartition selection agrees with a full sort"""
+        scores = np.random.default_rng(0).random(1000).astype(np.float32)
+        expected = np.argsort(scores)[::-1][:10]
+        np.testing.assert_array_equal(top_k_indices(scores, 10), expected)
+
+    def test_k_larger_than_scores(self):
+        """Asking for more rows than exist returns all of them, sorted"""
+        scores = np.array([0.2, 0.9, 0.5])
+        assert top_k_indices(scores, 10).tolist() == [1, 2, 0]
+
+    def test_ties_go_to_lower_rows(self):
+        """Tied scores are selected and ordered by ascending row"""
+        scores = np.zeros(20, dtype=np.float32)
+        scores[[3, 7, 11, 15]] = 0.5
+        assert top_k_indices(scores, 3).tolist() == [3, 7, 11]
+        scores[11] = 0.9
+        assert top_k_indices(scores, 3).tolist() == [11, 3, 7]
+        assert top_k_indices(np.ones(10), 4, min_score=0.5).tolist() == [0, 1, 2, 3]
+
+    def test_min_score_threshold(self):
+        """Rows below the threshold are never selected"""
+        scores = np.array([0.2, 0.9, 0.5, 0.7])
+        assert top_k_indices(scores, 3, min_score=0.6).tolist() == [1, 3]
+        assert top_k_indices(scores, 3, min_score=0.95).tolist() == []
+
+    def test_search_min_score(self, store):
+        """search() drops low-similarity chunks before building results"""
+        store.add_document(make_document("doc1", ["whip length rules", "coach age requirement"]))
+
+        results = store.search("whip length rules", top_k=5, min_score=0.9)
+        assert [r.text for r in results] == ["whip length rules"]
+
+
+class TestPersistence:
+    """Test saving and reloading the store"""
+
+    def test_reload_keeps_documents(self, store, monkeypatch):
+        """Indexed chunks survive a restart"""
+        store.add_document(make_document("doc1", ["coach must be 21 years old", "whip rules"]))
+
+        reloaded = reopen(monkeypatch)
+        assert len(reloaded._documents) == 2
+        assert reloaded._embeddings.dtype == np.float32
+        assert reloaded.search("whip", top_k=1)[0].text == "whip rules"
+
+    def test_reload_memory_maps_embeddings(self, store, monkeypatch):
+        """Embeddings are opened read-only with np.memmap rather than copied"""
+        store.add_document(make_document("doc1", ["coach rules", "whip rules"]))
+
+        reloaded = reopen(monkeypatch)
+        assert isinstance(reloaded._embeddings, np.memmap)
+        assert not reloaded._embeddings.flags["WRITEABLE"]
+
+    def test_reload_maps_every_segment(self, store, monkeypatch):
+        """Several segments load as one view over their memmaps instead of a concatenated copy"""
+        for i in range(3):
+            store.add_document(make_document(f"doc{i}", [f"rule {i} coach", f"rule {i} whip"]))
+
+        reloaded = reopen(monkeypatch)
+        embeddings = reloaded._embeddings
+        assert isinstance(embeddings, TailedRows) and len(embeddings.blocks) == 3
+        assert all(isinstance(block, np.memmap) for block in embeddings.blocks)
+        np.testing.assert_allclose(np.asarray(embeddings), np.asarray(store._embeddings))
+        assert reloaded.search("rule 2 whip", top_k=1)[0].text == "rule 2 whip"
+
+        reloaded.add_document(make_document("doc3", ["rule 3 coach"]))
+        assert reloaded._embeddings.shape == (7, EMBEDDING_DIM)
+        assert reopen(monkeypatch).search("rule 3 coach", top_k=1)[0].text == "rule 3 coach"
+
+    def test_add_after_memory_mapped_load(self, store, monkeypatch):
+        """Indexing into a memory-mapped store works and persists"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        reloaded = reopen(monkeypatch)
+        reloaded.add_document(make_document("doc2", ["whip rules"]))
+
+        assert len(reopen(monkeypatch)._documents) == 2
+
+    def test_legacy_pickle_is_migrated(self, store_settings, monkeypatch, tmp_path):
+        """An old vector_store.pkl is loaded and rewritten in the new format"""
+        persist_dir = tmp_path / "vectors"
+        persist_dir.mkdir(parents=True)
+        docs = [
+            LegacyStoredDocument(chunk_id="old_1", text="whip rules", embedding=fake_embedding("whip rules"),
+                                 metadata={"doc_id": "old", "page": 1}),
+            LegacyStoredDocument(chunk_id="old_2", text="coach rules", embedding=fake_embedding("coach rules"),
+                                 metadata={"doc_id": "old", "page": 2}),
+        ]
+        # Pickle under the StoredDocument name, as the old store did
+        with monkeypatch.context() as m:
+            m.setattr(vector_store_module, "StoredDocument", LegacyStoredDocument)
+            with open(persist_dir / "vector_store.pkl", "wb") as f:
+                pickle.dump({"documents": docs, "embeddings": [d.embedding for d in docs]}, f)
+
+        migrated = reopen(monkeypatch)
+        assert len(migrated._documents) == 2
+        assert isinstance(migrated._documents[0], StoredDocument)
+        assert migrated._documents[1].metadata == {"doc_id": "old", "page": 2}
+        np.testing.assert_allclose(np.linalg.norm(migrated._embeddings, axis=1), 1.0, rtol=1e-5)
+        assert (persist_dir / "index.json").exists()
+        assert len(reopen(monkeypatch)._documents) == 2
+
+    def test_delete_document(self, store):
+        """Deleting a document removes its chunks"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        store.add_document(make_document("doc2", ["rider rules", "horse rules"]))
+
+        result = store.delete_document("doc2")
+        assert result["chunks_deleted"] == 2
+        assert store.get_stats()["total_chunks"] == 1
+        assert store.delete_document("missing")["status"] == "not_found"
+
+
+def read_manifest(store_settings):
+    with open(f"{store_settings.chroma_persist_dir}/index.json") as f:
+        return json.load(f)
+
+
+class TestSegmentLog:
+    """Test append-only segment persistence"""
+
+    def test_each_add_writes_a_segment(self, store, store_settings):
+        """Adding documents appends segments instead of rewriting the store"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        store.add_document(make_document("doc2", ["whip rules"]))
+
+        manifest = read_manifest(store_settings)
+        assert manifest["format_version"] == 2
+        assert manifest["dim"] == EMBEDDING_DIM
+        assert [seg["count"] for seg in manifest["segments"]] == [1, 1]
+
+    def test_delete_writes_tombstone(self, store, store_settings, monkeypatch):
+        """Deletes are tombstones that hide rows on reload"""
+        store._compact_deleted_ratio = 1.0  # Keep the dead rows until reload
+        store.add_document(make_document("doc1", ["coach rules"]))
+        store.add_document(make_document("doc2", ["whip rules", "horse rules"]))
+        store.delete_document("doc2")
+
+        manifest = read_manifest(store_settings)
+        assert len(manifest["segments"]) == 2
+        assert [t["doc_id"] for t in manifest["tombstones"]] == ["doc2"]
+
+        reloaded = reopen(monkeypatch)
+        assert [d.chunk_id for d in reloaded._documents] == ["doc1_p1_c0"]
+        assert reloaded._embeddings.shape == (1, EMBEDDING_DIM)
+
+    def test_readd_after_delete(self, store, monkeypatch):
+        """A tombstone only hides rows written before it"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        store.delete_document("doc1")
+        store.add_document(make_document("doc1", ["coach rules"]))
+
+        assert len(reopen(monkeypatch)._documents) == 1
+
+    def test_batch_groups_commits(self, store, store_settings):
+        """Mutations inside batch() share one manifest commit"""
+        with store.batch():
+            store.add_document(make_document("doc1", ["coach rules"]))
+            store.add_document(make_document("doc2", ["whip rules"]))
+            assert store._log.has_pending
+
+        manifest = read_manifest(store_settings)
+        assert manifest["generation"] == 1
+        assert len(manifest["segments"]) == 2
+
+    def test_compaction_merges_segments(self, store, store_settings, monkeypatch):
+        """Compaction leaves one segment with only live rows"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        store.add_document(make_document("doc2", ["whip rules"]))
+        store.delete_document("doc1")
+
+        assert store.compact()
+        manifest = read_manifest(store_settings)
+        assert len(manifest["segments"]) == 1
+        assert manifest["tombstones"] == []
+
+        reloaded = reopen(monkeypatch)
+        assert [d.chunk_id for d in reloaded._documents] == ["doc2_p1_c0"]
+        assert isinstance(reloaded._embeddings, np.memmap)
+
+    def test_threshold_triggers_compaction(self, store, store_settings):
+        """Exceeding the segment threshold compacts automatically"""
+        store._log.compact_threshold = 2
+        for i in range(3):
+            store.add_document(make_document(f"doc{i}", [f"rule {i}"]))
+
+        assert len(read_manifest(store_settings)["segments"]) == 1
+
+    def test_seq_allocation_is_unique_across_threads(self, store):
+        """The writer and a background compaction never get the same seq"""
+        seqs = []
+
+        def allocate():
+            seqs.extend(store._log._allocate_seq() for _ in range(2000))
+        threads = [threading.Thread(target=allocate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(set(seqs)) == len(seqs) == 8000
+
+    def test_clear_during_compaction_is_not_undone(self, store, store_settings, monkeypatch):
+        """A compaction that started before clear() does not bring the rows back"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        store.add_document(make_document("doc2", ["whip rules"]))
+        log_compact = store._log.compact
+        raced = []
+
+        def compact_racing_clear(*args, **kwargs):
+            if not raced:
+                raced.append(True)
+                store.clear()  # Lands while the merged segment is being written
+            return log_compact(*args, **kwargs)
+        monkeypatch.setattr(store._log, "compact", compact_racing_clear)
+
+        assert not store.compact()
+        assert read_manifest(store_settings)["segments"] == []
+        assert not list(store._log.segments_dir.glob("seg-*"))
+        assert reopen(monkeypatch)._documents == []
+
+    def test_clear_waits_for_background_compaction(self, store):
+        """clear() joins a running compaction before rewriting the log"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        release = threading.Event()
+        finished = []
+
+        def slow_compaction():
+            release.wait(5)
+            finished.append(True)
+        store._compaction_thread = threading.Thread(target=slow_compaction)
+        store._compaction_thread.start()
+        threading.Timer(0.2, release.set).start()
+        store.clear()
+
+        assert finished == [True]
+        assert store._documents == []
+
+    def test_clear(self, store, monkeypatch):
+        """clear() empties the persisted store"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        store.clear()
+
+        assert reopen(monkeypatch)._documents == []
+
+
+def rulebook_document(doc_id: str = "rules") -> ProcessedDocument:
+    """Six chunks over three pages with sections, roles and tags"""
+    doc = make_document(doc_id, [
+        "7201 points are acquired at each show",
+        "7203 riders accumulate points",
+        "7207 36 points qualify for regionals",
+        "1102 the coach must be 21 years old",
+        "4501 designated alternate riders",
+        "4502 alternate substitution",
+    ])
+    layout = [
+        (1, 7201, "rider", ["points"]),
+        (1, 7203, "rider", ["points"]),
+        (2, 7207, "rider", ["points", "regionals"]),
+        (2, 1102, "coach", []),
+        (3, 4501, "rider", []),
+        (3, 4502, "general", []),
+    ]
+    for chunk, (page, section, role, tags) in zip(doc.chunks, layout):
+        chunk.metadata.update({
+            "page": page,
+            "section_id": section,
+            "section_full": str(section),
+            "subject_role": role,
+            "topic_tags": tags,
+        })
+        chunk.chunk_id = f"{doc_id}_p{page}_s{section}_c0"
+        chunk.metadata["chunk_index"] = section
+    return doc
+
+
+class TestMetadataIndex:
+    """Test metadata lookups backed by the inverted index"""
+
+    def test_lookup_by_page(self, store):
+        """(doc_id, page) lookups return only that page"""
+        store.add_document(rulebook_document())
+
+        results = store.search_by_metadata({"doc_id": "rules", "page": 2})
+        assert [r.metadata["section_id"] for r in results] == [7207, 1102]
+
+    def test_lookup_by_tag_and_role(self, store):
+        """Tag membership and role equality use their own indexes"""
+        store.add_document(rulebook_document())
+
+        tagged = store.search_by_metadata({"topic_tags": "regionals"})
+        assert [r.metadata["section_id"] for r in tagged] == [7207]
+        coaches = store.search_by_metadata({"subject_role": "coach"})
+        assert [r.metadata["section_id"] for r in coaches] == [1102]
+
+    def test_section_range(self, store):
+        """Section ranges are answered from the sorted section index"""
+        store.add_document(rulebook_document())
+
+        results = store.search_by_metadata({"doc_id": "rules", "section_id": (7200, 7209)})
+        assert [r.metadata["section_id"] for r in results] == [7201, 7203, 7207]
+
+    def test_combined_filters_and_limit(self, store):
+        """All filters are applied and the limit is honoured"""
+        store.add_document(rulebook_document())
+
+        results = store.search_by_metadata({"topic_tags": "points", "page": 1}, limit=1)
+        assert [r.metadata["section_id"] for r in results] == [7201]
+
+    def test_index_follows_deletes(self, store):
+        """Deleted documents disappear from metadata lookups"""
+        store.add_document(rulebook_document("a"))
+        store.add_document(rulebook_document("b"))
+        store.delete_document("a")
+
+        results = store.search_by_metadata({"subject_role": "coach"})
+        assert [r.metadata["doc_id"] for r in results] == ["b"]
+        assert store.search_by_metadata({"doc_id": "a"}) == []
+
+    def test_index_rebuilt_on_load(self, store, monkeypatch):
+        """A reloaded store can answer indexed lookups"""
+        store.add_document(rulebook_document())
+
+        reloaded = reopen(monkeypatch)
+        assert len(reloaded.search_by_metadata({"doc_id": "rules", "page": 3})) == 2
+
+    def test_expand_neighbors(self, store):
+        """Neighbor expansion pulls in adjacent pages, sections and tags"""
+        store.add_document(rulebook_document())
+        base = store.search_by_metadata({"section_id": 7207})
+
+        expanded = store.expand_neighbors(base)
+        sections = {r.metadata["section_id"] for r in expanded}
+        assert {7201, 7203, 7207, 1102, 4501, 4502} <= sections
+        assert len(expanded) == len({(r.metadata["page"], r.metadata["section_id"]) for r in expanded})
+
+
+class TestKeywordIndex:
+    """Test BM25 keyword retrieval"""
+
+    def test_ranks_best_match_first(self, store):
+        """Chunks with more (and rarer) matching terms rank higher"""
+        store.add_document(make_document("doc1", [
+            "riders may carry a whip",
+            "standing martingale is allowed",
+            "a martingale and a whip are both allowed for riders",
+            "coach requirements",
+        ]))
+
+        results = store.keyword_scan(["martingale", "whip"], limit=2)
+        assert results[0].text == "a martingale and a whip are both allowed for riders"
+        assert len(results) == 2
+        assert results[0].score >= results[1].score
+
+    def test_returns_best_not_first_matches(self, store):
+        """The limit applies after ranking, not after the first matches found"""
+        texts = ["4501 mentioned in passing among many other words here"] * 5
+        texts.append("4501 alternate 4501 alternate rules")
+        store.add_document(make_document("doc1", texts))
+
+        results = store.keyword_scan(["4501", "alternate"], limit=1)
+        assert results[0].text == "4501 alternate 4501 alternate rules"
+
+    def test_no_matches(self, store):
+        """Unknown keywords return nothing"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        assert store.keyword_scan(["dressage"]) == []
+
+    def test_index_follows_deletes(self, store):
+        """Deleted chunks are no longer keyword hits"""
+        store.add_document(make_document("doc1", ["whip rules"]))
+        store.add_document(make_document("doc2", ["whip length"]))
+        store.delete_document("doc1")
+
+        assert [r.text for r in store.keyword_scan(["whip"])] == ["whip length"]
+
+
+class FakeOllama:
+    """Records embedding requests and answers them with fake_embedding"""
+
+    def __init__(self):
+        self.requests = []
+        self.fail_batches = False
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append((request.url.path, body))
+        if request.url.path == "/api/embed":
+            if self.fail_batches:
+                return httpx.Response(500, json={"error": "batch failed"})
+            return httpx.Response(200, json={"embeddings": [fake_embedding(t) for t in body["input"]]})
+        return httpx.Response(200, json={"embedding": fake_embedding(body["prompt"])})
+
+    def paths(self):
+        return [path for path, _ in self.requests]
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    """Route the store's httpx calls to an in-process fake Ollama server"""
+    fake = FakeOllama()
+    transport = httpx.MockTransport(fake.handle)
+    real_async_client = httpx.AsyncClient
+
+    def fake_post(url, **kwargs):
+        kwargs.pop("timeout", None)
+        with httpx.Client(transport=transport) as client:
+            return client.post(url, **kwargs)
+
+    def fake_async_client(*args, **kwargs):
+        return real_async_client(*args, transport=transport, **kwargs)
+
+    monkeypatch.setattr(httpx, "post", fake_post)
+    monkeypatch.setattr(httpx, "AsyncClient", fake_async_client)
+    return fake
+
+
+@pytest.fixture
+def http_store(store_settings, ollama, monkeypatch):
+    """VectorStore that talks to the fake Ollama server over httpx"""
+    monkeypatch.setattr(VectorStore, "_instance", None)
+    yield VectorStore()
+    VectorStore._instance = None
+
+
+class TestBatchedEmbeddings:
+    """Test batched requests to Ollama's /api/embed endpoint"""
+
+    def test_sync_batches(self, http_store, ollama):
+        """Ten chunks with batch size 4 take three requests"""
+        http_store.add_document(make_document("doc1", [f"rule {i}" for i in range(10)]))
+
+        assert ollama.paths() == ["/api/embed"] * 3
+        assert [len(body["input"]) for _, body in ollama.requests] == [4, 4, 2]
+        assert http_store._embeddings.shape == (10, EMBEDDING_DIM)
+
+    @pytest.mark.asyncio
+    async def test_async_batches_keep_order(self, http_store, ollama):
+        """Concurrent batches are reassembled in chunk order"""
+        texts = [f"rule number {i}" for i in range(9)]
+        embeddings = await http_store.embed_texts_async(texts)
+
+        assert ollama.paths().count("/api/embed") == 3
+        assert embeddings == [fake_embedding(t) for t in texts]
+
+    def test_falls_back_per_item(self, http_store, ollama):
+        """A failing batch is retried one text at a time"""
+        ollama.fail_batches = True
+        embeddings = http_store.embed_texts(["a b", "c d", "e f"])
+
+        assert ollama.paths() == ["/api/embed", "/api/embeddings", "/api/embeddings", "/api/embeddings"]
+        assert embeddings == [fake_embedding(t) for t in ["a b", "c d", "e f"]]
+
+    @pytest.mark.asyncio
+    async def test_async_falls_back_per_item(self, http_store, ollama):
+        """The async path falls back per item as well"""
+        ollama.fail_batches = True
+        embeddings = await http_store.embed_texts_async(["a b", "c d"])
+
+        assert ollama.paths().count("/api/embeddings") == 2
+        assert embeddings == [fake_embedding(t) for t in ["a b", "c d"]]
+
+
+class TestEmbeddingCache:
+    """Test the persistent content-addressed embedding cache"""
+
+    def test_reindex_skips_embedding_service(self, http_store, ollama, monkeypatch):
+        """Re-indexing unchanged chunks is served from the cache"""
+        doc = make_document("doc1", ["coach rules", "whip rules", "horse rules"])
+        http_store.add_document(doc)
+        requests_after_first_index = len(ollama.requests)
+
+        reloaded = reopen(monkeypatch)
+        reloaded.clear()
+        reloaded.add_document(doc)
+
+        assert len(ollama.requests) == requests_after_first_index
+        assert reloaded._embeddings.shape == (3, EMBEDDING_DIM)
+
+    def test_only_new_chunks_are_embedded(self, http_store, ollama):
+        """Only texts missing from the cache are sent, once each"""
+        http_store.add_document(make_document("doc1", ["coach rules"]))
+        ollama.requests.clear()
+
+        http_store.add_document(make_document("doc2", ["coach rules", "new rule", "new rule"]))
+        assert [body["input"] for _, body in ollama.requests] == [["new rule"]]
+
+    def test_cache_is_keyed_by_model(self, tmp_path):
+        """Vectors cached for one model are not returned for another"""
+        cache = EmbeddingCache(tmp_path / "cache.sqlite3")
+        cache.put_many("model-a", ["text"], [[1.0, 2.0]])
+
+        assert cache.get_many("model-a", ["text", "other"]) == [[1.0, 2.0], None]
+        assert cache.get_many("model-b", ["text"]) == [None]
+
+    def test_langchain_wrapper(self, tmp_path):
+        """CachedEmbeddings only forwards cache misses to the wrapped embeddings"""
+        class CountingEmbeddings:
+            calls = []
+
+            def embed_documents(self, texts):
+                self.calls.append(list(texts))
+                return [fake_embedding(t)[:4] for t in texts]
+
+        inner = CountingEmbeddings()
+        cached = CachedEmbeddings(inner, "model", EmbeddingCache(tmp_path / "cache.sqlite3"))
+        first = cached.embed_documents(["a", "b"])
+        second = cached.embed_documents(["b", "a", "c"])
+
+        assert inner.calls == [["a", "b"], ["c"]]
+        assert second[:2] == [first[1], first[0]]
+
+
+class TestQueryCache:
+    """Test the in-memory query embedding cache"""
+
+    def test_repeated_question_skips_embedding(self, http_store, ollama):
+        """The same question (modulo case/whitespace) is embedded once"""
+        http_store.add_document(make_document("doc1", ["coach rules", "whip rules"]))
+        ollama.requests.clear()
+
+        first = http_store.search("Whip rules?", top_k=1)
+        second = http_store.search("  whip   RULES? ", top_k=1)
+
+        assert ollama.paths() == ["/api/embeddings"]
+        assert first[0].text == second[0].text
+        stats = http_store.get_stats()["query_cache"]
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted first"""
+        cache = QueryEmbeddingCache(maxsize=2)
+        cache.put("m", "a", [1.0])
+        cache.put("m", "b", [2.0])
+        cache.get("m", "a")
+        cache.put("m", "c", [3.0])
+
+        assert cache.get("m", "b") is None
+        assert cache.get("m", "a") is not None
+
+    def test_ttl_expiry(self):
+        """Entries older than the TTL are treated as misses"""
+        cache = QueryEmbeddingCache(ttl=-1)
+        cache.put("m", "a", [1.0])
+        assert cache.get("m", "a") is None
+
+    def test_model_change_invalidates(self):
+        """Switching embedding model drops cached vectors"""
+        cache = QueryEmbeddingCache()
+        cache.put("model-a", "question", [1.0])
+
+        assert cache.get("model-b", "question") is None
+        assert cache.get("model-a", "question") is None
+
+
+class TestAsyncSearch:
+    """Test the non-blocking search API"""
+
+    @pytest.mark.asyncio
+    async def test_matches_sync_search(self, store):
+        """search_async returns the same ranking as search"""
+        store.add_document(make_document("doc1", ["coach rules", "whip length rules", "horse rules"]))
+
+        async_results = await store.search_async("whip length", top_k=2)
+        sync_results = store.search("whip length", top_k=2)
+        assert [r.text for r in async_results] == [r.text for r in sync_results]
+
+    @pytest.mark.asyncio
+    async def test_scoring_runs_off_the_event_loop(self, store, monkeypatch):
+        """The similarity scan runs on the search thread pool"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        threads = []
+        original = VectorStore._search_vector
+
+        def recording_search_vector(self, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return original(self, *args, **kwargs)
+
+        monkeypatch.setattr(VectorStore, "_search_vector", recording_search_vector)
+        await store.search_async("coach", filter_doc_id="doc1")
+
+        assert threads and threads[0].startswith("vector-search")
+
+    @pytest.mark.asyncio
+    async def test_uses_pooled_client(self, http_store, ollama):
+        """Concurrent searches share one AsyncClient and embed over HTTP"""
+        http_store.add_document(make_document("doc1", ["coach rules", "whip rules"]))
+        ollama.requests.clear()
+
+        results = await asyncio.gather(
+            http_store.search_async("coach"),
+            http_store.search_async("whip"),
+        )
+        client = http_store._async_client
+
+        assert [r[0].text for r in results] == ["coach rules", "whip rules"]
+        assert ollama.paths() == ["/api/embeddings", "/api/embeddings"]
+        await http_store.search_async("horse")
+        assert http_store._async_client is client
+        await http_store.aclose()
+
+
+def clustered_vectors(n: int, dim: int = 32, clusters: int = 16, seed: int = 0) -> np.ndarray:
+    """Unit-length rows scattered around random cluster centres"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    vectors = centres[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def corpus_document(doc_id: str, count: int) -> ProcessedDocument:
+    """A document with count distinct chunks"""
+    words = ["coach", "whip", "horse", "regionals", "points", "rider", "alternate", "jump"]
+    texts = [f"rule {i} {words[i % 8]} {words[(i * 3) % 8]} {words[(i * 5 + 1) % 8]}" for i in range(count)]
+    return make_document(doc_id, texts)
+
+
+@pytest.fixture
+def ivf_store(store_settings, store, monkeypatch):
+    """VectorStore with a synchronously trained IVF index"""
+    store_settings.vector_index = "ivf"
+    store_settings.ann_min_rows = 16
+    store_settings.ann_background_build = False
+    store_settings.ivf_nlist = 4
+    store_settings.ivf_nprobe = 4
+    return reopen(monkeypatch)
+
+
+class TestIVFIndex:
+    """Test the IVF approximate index"""
+
+    def test_full_probe_matches_exact(self):
+        """Probing every list returns every row, so recall is exact"""
+        vectors = clustered_vectors(500)
+        index = IVFIndex(nlist=10, nprobe=10)
+        index.build(vectors)
+
+        assert index.size == 500
+        assert sorted(index.search(vectors[0], 10).tolist()) == list(range(500))
+        assert measure_recall(index, vectors, vectors[:20], k=10) == 1.0
+
+    def test_partial_probe_scans_fewer_rows(self):
+        """A small nprobe scans a fraction of the rows and keeps most neighbours"""
+        vectors = clustered_vectors(2000)
+        index = IVFIndex(nlist=16, nprobe=3)
+        index.build(vectors)
+
+        assert len(index.search(vectors[0], 10)) < 2000
+        assert measure_recall(index, vectors, vectors[:50], k=10) >= 0.8
+
+    def test_incremental_add(self):
+        """Added rows are assigned to lists and flag a rebuild once the index doubles"""
+        vectors = clustered_vectors(300)
+        index = IVFIndex(nlist=8, nprobe=8)
+        index.build(vectors[:100])
+        index.add(100, vectors[100:200])
+
+        assert index.size == 200
+        assert not index.needs_rebuild
+        assert 150 in index.search(vectors[150], 5).tolist()
+
+        index.add(200, vectors[200:])
+        assert index.needs_rebuild
+        with pytest.raises(ValueError):
+            index.add(100, vectors[:10])
+
+    def test_factory(self):
+        """flat means no index; unknown kinds are rejected"""
+        assert create_ann_index("flat", SimpleNamespace()) is None
+        assert isinstance(create_ann_index("ivf", SimpleNamespace(ivf_nprobe=2)), IVFIndex)
+        with pytest.raises(ValueError):
+            create_ann_index("annoy", SimpleNamespace())
+
+    def test_store_search_matches_flat(self, ivf_store, store_settings, monkeypatch):
+        """With every list probed the IVF store ranks like exact search"""
+        ivf_store.add_document(corpus_document("doc1", 40))
+        stats = ivf_store.get_stats()["ann_index"]
+        assert stats["active"] and stats["type"] == "ivf"
+        assert stats["recall"] == 1.0
+
+        ivf_results = ivf_store.search("whip horse", top_k=5)
+        store_settings.vector_index = "flat"
+        flat_store = reopen(monkeypatch)
+        assert flat_store.get_stats()["ann_index"]["active"] is False
+        flat_results = flat_store.search("whip horse", top_k=5)
+        assert [r.text for r in ivf_results] == [r.text for r in flat_results]
+
+    def test_store_follows_adds_and_deletes(self, ivf_store):
+        """Adds extend the index; deletes rebuild it over the renumbered rows"""
+        ivf_store.add_document(corpus_document("doc1", 20))
+        ivf_store.add_document(corpus_document("doc2", 10))
+        assert ivf_store._ann_index.size == 30
+
+        ivf_store.delete_document("doc1")
+        assert ivf_store._ann_index is None  # Below ann_min_rows after the delete
+        assert {r.metadata["doc_id"] for r in ivf_store.search("coach", top_k=5)} == {"doc2"}
+
+    def test_evaluate_recall(self, ivf_store):
+        """Recall is reported against exact search for sampled rows or given queries"""
+        assert ivf_store.evaluate_ann_recall()["recall"] is None
+        ivf_store.add_document(corpus_document("doc1", 40))
+
+        report = ivf_store.evaluate_ann_recall(top_k=5)
+        assert report["index"] == "ivf" and report["recall"] == 1.0
+        report = ivf_store.evaluate_ann_recall(["whip rules", "coach points"], top_k=5)
+        assert report["queries"] == 2 and report["recall"] == 1.0
+
+
+@pytest.fixture
+def hnsw_store(store_settings, store, monkeypatch):
+    """VectorStore with a synchronously built HNSW index"""
+    store_settings.vector_index = "hnsw"
+    store_settings.ann_min_rows = 16
+    store_settings.ann_background_build = False
+    store_settings.hnsw_m = 8
+    store_settings.hnsw_ef_search = 32
+    return reopen(monkeypatch)
+
+
+class TestHNSWIndex:
+    """Test the HNSW graph index"""
+
+    def test_recall(self):
+        """Graph search finds nearly all exact neighbours"""
+        vectors = clustered_vectors(800)
+        index = HNSWIndex(m=8, ef_construction=64, ef_search=32)
+        index.build(vectors)
+
+        assert index.size == 800
+        assert len(index.search(vectors[0], 10)) < 800
+        assert measure_recall(index, vectors, vectors[:50], k=10) >= 0.95
+
+    def test_incremental_insert(self):
+        """Rows inserted after the build are reachable"""
+        vectors = clustered_vectors(400)
+        index = HNSWIndex(m=8)
+        index.build(vectors[:200])
+        index.attach(vectors)
+        index.add(200, vectors[200:])
+
+        assert index.size == 400
+        assert 350 in index.search(vectors[350], 5).tolist()
+        with pytest.raises(ValueError):
+            index.add(100, vectors[:10])
+
+    def test_removed_rows_are_not_returned(self):
+        """Removed rows still route searches but are never candidates"""
+        vectors = clustered_vectors(300)
+        index = HNSWIndex(m=8)
+        index.build(vectors)
+        index.remove([5, 6])
+
+        rows = index.search(vectors[5], 10).tolist()
+        assert 5 not in rows and 6 not in rows
+        assert len(rows) >= 10
+        assert index.stats()["deleted"] == 2
+
+    def test_save_and_load(self, tmp_path):
+        """A saved graph answers queries identically after loading"""
+        vectors = clustered_vectors(300)
+        index = HNSWIndex(m=8)
+        index.build(vectors)
+        index.remove([7])
+        index.save(tmp_path / "hnsw_index.npz", "abc")
+
+        loaded = HNSWIndex(m=8)
+        assert loaded.load(tmp_path / "hnsw_index.npz") == "abc"
+        loaded.attach(vectors)
+        for row in (0, 7, 123):
+            assert loaded.search(vectors[row], 10).tolist() == index.search(vectors[row], 10).tolist()
+        assert HNSWIndex(m=16).load(tmp_path / "hnsw_index.npz") is None
+
+    def test_store_persists_graph(self, hnsw_store, monkeypatch):
+        """The graph is saved next to the segments and reloaded instead of rebuilt"""
+        hnsw_store.add_document(corpus_document("doc1", 30))
+        assert (hnsw_store._persist_dir / "hnsw_index.npz").exists()
+        hnsw_store.add_document(corpus_document("doc2", 5))
+        expected = [r.text for r in hnsw_store.search("whip horse", top_k=5)]
+
+        monkeypatch.setattr(HNSWIndex, "build", lambda self, vectors: pytest.fail("graph was rebuilt"))
+        reopened = reopen(monkeypatch)
+        assert reopened._ann_index.size == 35  # Saved 30 rows plus the 5 appended after
+        assert reopened.get_stats()["ann_index"]["type"] == "hnsw"
+        assert [r.text for r in reopened.search("whip horse", top_k=5)] == expected
+
+    def test_store_rebuilds_stale_graph(self, hnsw_store, monkeypatch):
+        """A saved graph that no longer matches the rows is discarded"""
+        hnsw_store.add_document(corpus_document("doc1", 20))
+        hnsw_store.add_document(corpus_document("doc2", 20))
+        hnsw_store.delete_document("doc1")
+
+        index = HNSWIndex(m=8)
+        index.build(clustered_vectors(20, dim=EMBEDDING_DIM))
+        index.save(hnsw_store._ann_file, "stale")
+        reopened = reopen(monkeypatch)
+        assert reopened._ann_index is not None
+        assert reopened._ann_file.exists()
+        assert {r.metadata["doc_id"] for r in reopened.search("coach", top_k=5)} == {"doc2"}
+
+    def test_store_links_new_rows_off_the_request_path(self, hnsw_store, monkeypatch):
+        """Adds return before the graph insert; searches scan the rows it does not cover yet"""
+        hnsw_store.add_document(corpus_document("doc1", 30))
+        index = hnsw_store._ann_index
+        hnsw_store._ann_background = True
+        release = threading.Event()
+        inserters = []
+        add = index.add
+
+        def slow_add(start, vectors):
+            inserters.append(threading.current_thread())
+            release.wait(timeout=10)
+            add(start, vectors)
+        monkeypatch.setattr(index, "add", slow_add)
+
+        hnsw_store.add_document(make_document("doc2", ["zebra saddle pad", "unicorn bridle"]))
+        assert index.size == 30 and not release.is_set()
+        assert hnsw_store.search("zebra saddle pad", top_k=1)[0].metadata["doc_id"] == "doc2"
+        hnsw_store.delete_document("doc2")  # Reaches rows that are not linked yet
+        assert not release.is_set() and index.size == 30
+
+        release.set()
+        hnsw_store._ann_insert_thread.join(timeout=10)
+        assert inserters and all(t is not threading.current_thread() for t in inserters)
+        assert hnsw_store._ann_insert_thread is None and index.size == 32
+        assert {30, 31} <= index._deleted
+        assert all(r.metadata["doc_id"] == "doc1" for r in hnsw_store.search("zebra saddle pad", top_k=5))
+
+
+class TestScalarQuantizedIndex:
+    """Test the int8 quantized first pass"""
+
+    def test_codes_round_trip(self):
+        """Codes are a quarter of float32 and decode to within half a step"""
+        vectors = clustered_vectors(500, dim=48)
+        index = ScalarQuantizedIndex()
+        index.build(vectors)
+
+        assert index._codes.dtype == np.int8
+        assert index._codes.nbytes * 4 == vectors.nbytes
+        error = np.abs(index.decode(index._codes) - vectors)
+        assert (error <= index.scale / 2 + 1e-6).all()
+
+    def test_integer_scores_track_exact(self):
+        """The integer pass keeps the exact neighbours among its candidates"""
+        vectors = clustered_vectors(3000, dim=48)
+        index = ScalarQuantizedIndex(rerank=40)
+        index.build(vectors)
+
+        assert index.scores(vectors[0]).dtype == np.int32
+        assert len(index.search(vectors[0], 10)) == 40
+        assert measure_recall(index, vectors, vectors[:50], k=10) >= 0.98
+
+    def test_add_and_remove(self):
+        """Appended rows are encoded with the fitted ranges; removed rows are skipped"""
+        vectors = clustered_vectors(400, dim=48)
+        index = ScalarQuantizedIndex(rerank=20)
+        index.build(vectors[:300])
+        index.add(300, vectors[300:])
+        index.remove([350])
+
+        assert index.size == 400
+        rows = index.search(vectors[350], 5).tolist()
+        assert 350 not in rows and len(rows) == 20
+        assert 360 in index.search(vectors[360], 5).tolist()
+
+    def test_store_search_matches_flat(self, store_settings, store, monkeypatch):
+        """Reranked int8 search returns the exact top results"""
+        store_settings.vector_index = "int8"
+        store_settings.ann_min_rows = 16
+        store_settings.ann_background_build = False
+        int8_store = reopen(monkeypatch)
+        int8_store.add_document(corpus_document("doc1", 40))
+        assert int8_store.get_stats()["ann_index"]["type"] == "int8"
+        int8_results = int8_store.search("whip horse", top_k=5)
+
+        store_settings.vector_index = "flat"
+        flat_results = reopen(monkeypatch).search("whip horse", top_k=5)
+        assert [r.text for r in int8_results] == [r.text for r in flat_results]
+
+    def test_full_precision_rows_stay_on_disk(self, store_settings, store, monkeypatch):
+        """After compaction or reload only the codes and rows added since are resident"""
+        store_settings.vector_index = "int8"
+        store_settings.ann_min_rows = 16
+        store_settings.ann_background_build = False
+        int8_store = reopen(monkeypatch)
+        int8_store.add_document(corpus_document("doc1", 40))
+        assert int8_store.compact()
+        assert isinstance(int8_store._embeddings, np.memmap)
+        assert int8_store.snapshot().embeddings is int8_store._embeddings
+
+        reloaded = reopen(monkeypatch)
+        reloaded.add_document(corpus_document("doc2", 4))
+        embeddings = reloaded._embeddings
+        assert isinstance(embeddings.base, np.memmap) and len(embeddings.tail) == 4
+        assert reloaded.search("whip horse", top_k=3)
+        assert {r.metadata["doc_id"] for r in reloaded.search("rule 2 horse", top_k=50)} == {"doc1", "doc2"}
+
+
+class TestBinaryIndex:
+    """Test the sign-bit Hamming prefilter"""
+
+    def test_codes_are_packed_sign_bits(self):
+        """One bit per dimension, 1/32 of the float32 matrix"""
+        vectors = clustered_vectors(100, dim=64)
+        index = BinaryIndex()
+        index.build(vectors)
+
+        assert index._codes.shape == (100, 8)
+        assert index._codes.nbytes * 32 == vectors.nbytes
+        np.testing.assert_array_equal(np.unpackbits(index._codes, axis=1).astype(bool), vectors > 0)
+        assert POPCOUNT_TABLE[255] == 8 and POPCOUNT_TABLE[0b1010] == 2
+
+    def test_hamming_distance(self):
+        """Distances count the differing sign bits"""
+        vectors = clustered_vectors(50, dim=64)
+        index = BinaryIndex()
+        index.build(vectors)
+
+        expected = ((vectors > 0) != (vectors[3] > 0)).sum(axis=1)
+        np.testing.assert_array_equal(index.distances(vectors[3]), expected)
+        assert pack_signs(vectors[:1]).dtype == np.uint8
+
+    def test_prefilter_keeps_neighbours(self):
+        """Exact rescoring of the Hamming candidates recovers the true top results"""
+        vectors = clustered_vectors(3000, dim=64)
+        index = BinaryIndex(candidates=200)
+        index.build(vectors[:2000])
+        index.add(2000, vectors[2000:])
+        index.remove([2500])
+
+        rows = index.search(vectors[2500], 10).tolist()
+        assert len(rows) == 200 and 2500 not in rows
+        assert measure_recall(index, vectors, vectors[:50], k=10) >= 0.9
+
+    def test_store_search_matches_flat(self, store_settings, store, monkeypatch):
+        """Binary prefilter plus cosine rescoring ranks like exact search"""
+        store_settings.vector_index = "binary"
+        store_settings.ann_min_rows = 16
+        store_settings.ann_background_build = False
+        binary_store = reopen(monkeypatch)
+        binary_store.add_document(corpus_document("doc1", 40))
+        assert binary_store.get_stats()["ann_index"]["type"] == "binary"
+        binary_results = binary_store.search("whip horse", top_k=5)
+
+        store_settings.vector_index = "flat"
+        flat_results = reopen(monkeypatch).search("whip horse", top_k=5)
+        assert [r.text for r in binary_results] == [r.text for r in flat_results]
+
+
+class TestTombstoneDeletes:
+    """Test logical deletes and compaction"""
+
+    @pytest.fixture
+    def lazy_store(self, store):
+        """Store that keeps dead rows until compact() is called"""
+        store._compact_deleted_ratio = 1.0
+        store.add_document(make_document("doc1", ["coach rules", "whip rules"], topic_tags=["equipment"]))
+        store.add_document(make_document("doc2", ["coach points", "whip length"], topic_tags=["equipment"]))
+        return store
+
+    def test_delete_is_logical(self, lazy_store):
+        """Deleted rows stay in place and are skipped by every read path"""
+        result = lazy_store.delete_document("doc1")
+
+        assert result["chunks_deleted"] == 2
+        assert len(lazy_store._documents) == 4
+        assert lazy_store._deleted.tolist() == [True, True, False, False]
+        assert {r.metadata["doc_id"] for r in lazy_store.search("coach whip", top_k=10)} == {"doc2"}
+        assert lazy_store.search("coach", filter_doc_id="doc1") == []
+        assert {r.metadata["doc_id"] for r in lazy_store.keyword_scan(["coach", "whip"])} == {"doc2"}
+        assert {r.metadata["doc_id"] for r in lazy_store.search_by_metadata({"topic_tags": "equipment"})} == {"doc2"}
+        assert [d["doc_id"] for d in lazy_store.list_documents()] == ["doc2"]
+        stats = lazy_store.get_stats()
+        assert stats["total_chunks"] == 2 and stats["deleted_chunks"] == 2
+
+    def test_delete_twice(self, lazy_store):
+        """A document with only dead rows is not found"""
+        lazy_store.delete_document("doc1")
+        assert lazy_store.delete_document("doc1")["status"] == "not_found"
+
+    def test_readd_then_delete(self, lazy_store):
+        """Re-added rows are live and are the only ones the next delete touches"""
+        lazy_store.delete_document("doc1")
+        lazy_store.add_document(make_document("doc1", ["coach rules"]))
+
+        assert [r.text for r in lazy_store.search("coach", filter_doc_id="doc1")] == ["coach rules"]
+        assert lazy_store.delete_document("doc1")["chunks_deleted"] == 1
+
+    def test_compaction_purges_dead_rows(self, lazy_store, monkeypatch):
+        """compact() drops tombstoned rows and renumbers the rest"""
+        lazy_store.delete_document("doc1")
+        assert lazy_store.compact()
+
+        assert [d.chunk_id for d in lazy_store._documents] == ["doc2_p1_c0", "doc2_p2_c0"]
+        assert lazy_store._embeddings.shape == (2, EMBEDDING_DIM)
+        assert lazy_store._deleted_count == 0
+        assert [r.metadata["doc_id"] for r in lazy_store.search_by_metadata({"doc_id": "doc2"})] == ["doc2", "doc2"]
+        assert len(reopen(monkeypatch)._documents) == 2
+
+    def test_threshold_triggers_compaction(self, store):
+        """Once dead rows pass vector_compact_deleted_ratio they are purged"""
+        store.add_document(make_document("doc1", ["coach rules", "whip rules", "horse rules"]))
+        store.add_document(make_document("doc2", ["points"]))
+        store.delete_document("doc1")
+
+        assert len(store._documents) == 1
+        assert store._deleted_count == 0
+
+    def test_ann_index_skips_deleted_rows(self, ivf_store):
+        """Deletes mark rows in the ANN index instead of rebuilding it"""
+        ivf_store._compact_deleted_ratio = 1.0
+        ivf_store.add_document(corpus_document("doc1", 20))
+        ivf_store.add_document(corpus_document("doc2", 20))
+        index = ivf_store._ann_index
+        ivf_store.delete_document("doc1")
+
+        assert ivf_store._ann_index is index
+        assert {r.metadata["doc_id"] for r in ivf_store.search("coach whip", top_k=10)} == {"doc2"}
+
+
+class TestRowBuffer:
+    """Test the capacity-doubling embedding buffer"""
+
+    def test_append_doubles_capacity(self):
+        """Capacity grows geometrically, so reallocations are logarithmic"""
+        buffer = RowBuffer()
+        capacities = set()
+        for i in range(100):
+            view = buffer.append(np.full((1, 4), i, dtype=np.float32))
+            capacities.add(buffer.capacity)
+
+        assert len(buffer) == 100 and view.shape == (100, 4)
+        assert len(capacities) <= 8
+        np.testing.assert_array_equal(view[:, 0], np.arange(100))
+
+    def test_views_are_stable(self):
+        """A view handed out earlier is not changed by later appends"""
+        buffer = RowBuffer(np.zeros(3, dtype=bool))
+        first = buffer.append([True])
+        buffer.append([False, True])
+
+        assert first.tolist() == [False, False, False, True]
+        assert buffer.view().tolist() == [False, False, False, True, False, True]
+
+    def test_wrapped_array_is_copied_on_first_append(self, tmp_path):
+        """A read-only memmap is used as-is until rows are appended"""
+        np.save(tmp_path / "rows.npy", np.ones((2, 3), dtype=np.float32))
+        mapped = np.load(tmp_path / "rows.npy", mmap_mode="r")
+        buffer = RowBuffer(mapped)
+        assert isinstance(buffer.view(), np.memmap)
+
+        view = buffer.append(np.zeros((1, 3), dtype=np.float32))
+        assert view.shape == (3, 3) and view.flags.writeable
+        assert view[:2].sum() == 6
+
+    def test_kept_base_is_never_copied(self, tmp_path):
+        """With keep_base, appends go to a tail and the memmap stays the base"""
+        np.save(tmp_path / "rows.npy", np.ones((2, 3), dtype=np.float32))
+        mapped = np.load(tmp_path / "rows.npy", mmap_mode="r")
+        buffer = RowBuffer(mapped, keep_base=True)
+        assert buffer.view() is mapped
+
+        view = buffer.append(np.full((2, 3), 2, dtype=np.float32))
+        assert isinstance(view, TailedRows) and view.base is mapped
+        assert view.shape == (4, 3)
+        assert view[1].tolist() == [1, 1, 1] and view[-1].tolist() == [2, 2, 2]
+        assert view[[3, 0]].tolist() == [[2, 2, 2], [1, 1, 1]]
+        assert view[1:3].shape == (2, 3) and view[2:].tolist() == [[2, 2, 2]] * 2
+        assert np.asarray(view).sum() == 18
+        np.testing.assert_allclose(matmul_rows(np.ones((1, 3)), view, 1, 4), [[3, 6, 6]])
+
+        # Rows 0..2 written out: only row 3 stays in memory
+        np.save(tmp_path / "merged.npy", np.asarray(view[:3]))
+        merged = np.load(tmp_path / "merged.npy", mmap_mode="r")
+        view = buffer.rebase(merged)
+        assert view.base is merged and view.tail.tolist() == [[2, 2, 2]]
+        assert len(buffer) == 4
+
+    def test_rows_over_several_blocks(self):
+        """TailedRows indexes, slices and multiplies across any number of blocks"""
+        blocks = [np.full((n, 2), i, dtype=np.float32) for i, n in enumerate([2, 1, 3])]
+        view = TailedRows(TailedRows(blocks[0], blocks[1]), blocks[2])
+        assert len(view.blocks) == 3 and view.shape == (6, 2)
+        assert view.tail is blocks[2] and np.asarray(view.base).tolist() == [[0, 0]] * 2 + [[1, 1]]
+
+        assert [view[i][0] for i in range(6)] == [0, 0, 1, 2, 2, 2] and view[-1][0] == 2
+        assert view[[5, 2, 0]][:, 0].tolist() == [2, 1, 0]
+        assert np.asarray(view[1:4])[:, 0].tolist() == [0, 1, 2] and view[::2][:, 0].tolist() == [0, 1, 2]
+        assert view[2:3].tolist() == [[1, 1]]
+        with pytest.raises(IndexError):
+            view[6]
+        assert [(lo, len(block)) for lo, block in row_blocks(view, 1, 5)] == [(1, 1), (2, 1), (3, 2)]
+        np.testing.assert_allclose(matmul_rows(np.ones((1, 2)), view), [[0, 0, 2, 4, 4, 4]])
+
+    def test_store_appends_into_buffer(self, store):
+        """Adds write into the preallocated buffer; _embeddings is a view of the filled rows"""
+        words = ["alpha", "bravo", "charlie", "delta", "echo"]
+        for i in range(20):
+            store.add_document(make_document(f"doc{i}", [f"{words[i % 5]} {words[i // 5]} coach"]))
+
+        buffer = store._embedding_buffer
+        assert len(buffer) == 20 and buffer.capacity >= 20
+        # Compaction moved the older rows to a memmapped segment; later ones are the in-memory tail
+        embeddings = store._embeddings
+        assert isinstance(embeddings, TailedRows) and isinstance(embeddings.base, np.memmap)
+        assert embeddings.shape == (20, EMBEDDING_DIM)
+        assert np.shares_memory(embeddings.tail, buffer.view().tail)
+        assert embeddings.tail.flags["C_CONTIGUOUS"]
+        assert len(store._deleted) == 20
+        assert store.search("bravo bravo coach", top_k=1)[0].metadata["doc_id"] == "doc6"
+
+
+class TestSlottedRecords:
+    """Test the compact per-chunk records"""
+
+    def test_records_have_no_dict_or_embedding(self, store):
+        """Chunks and results are slotted and do not copy the vector"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        doc = store._documents[0]
+        result = store.search("coach", top_k=1)[0]
+
+        assert not hasattr(doc, "__dict__") and not hasattr(doc, "embedding")
+        assert not hasattr(result, "__dict__")
+        result.score = 0.5  # Still mutable, as neighbor expansion relies on
+
+    def test_pickle_round_trip(self):
+        """Slotted records still pickle"""
+        doc = StoredDocument(chunk_id="c1", text="coach rules", metadata={"page": 1})
+        assert pickle.loads(pickle.dumps(doc)) == doc
+
+
+class TestMetadataFilters:
+    """Test columnar metadata and filter pushdown"""
+
+    @pytest.fixture
+    def columns(self):
+        columns = MetadataColumns()
+        columns.rebuild([
+            {"doc_id": "doc1", "page": 1, "section_id": 1102, "subject_role": "coach", "topic_tags": ["eligibility"]},
+            {"doc_id": "doc1", "page": 2, "section_id": 4501, "subject_role": "rider", "topic_tags": ["equipment"]},
+            {"doc_id": "doc2", "page": 1, "section_id": None, "subject_role": "general", "topic_tags": []},
+            {"doc_id": "doc2", "page": 2, "section_id": 7201, "subject_role": "coach",
+             "topic_tags": ["points", "equipment"]},
+        ])
+        return columns
+
+    def test_masks(self, columns):
+        """Each expression evaluates to one boolean mask over the rows"""
+        assert Eq("doc_id", "doc1").mask(columns).tolist() == [True, True, False, False]
+        assert In("subject_role", ["coach", "general"]).mask(columns).tolist() == [True, False, True, True]
+        assert Range("section_id", 1000, 5000).mask(columns).tolist() == [True, True, False, False]
+        assert Range("section_id", low=7000).mask(columns).tolist() == [False, False, False, True]
+        assert HasTag("equipment").mask(columns).tolist() == [False, True, False, True]
+        assert Eq("doc_id", "missing").mask(columns).tolist() == [False] * 4
+
+        where = (Eq("doc_id", "doc2") & HasTag("points")) | Eq("page", 1)
+        assert where.mask(columns).tolist() == [True, False, True, True]
+
+    def test_unknown_field(self, columns):
+        """Filters on fields without a column are rejected"""
+        with pytest.raises(ValueError):
+            Eq("filename", "rulebook.pdf").mask(columns)
+        with pytest.raises(ValueError):
+            Range("subject_role", 1, 2).mask(columns)
+
+    def test_filter_from_dict(self, columns):
+        """search_by_metadata-style dicts convert to expressions"""
+        where = filter_from_dict({"doc_id": "doc1", "section_id": (1000, 2000)})
+        assert where.mask(columns).tolist() == [True, False, False, False]
+        assert filter_from_dict({"subject_role": ["rider", "general"]}).mask(columns).tolist() == [False, True, True, False]
+        assert filter_from_dict({}) is None
+
+    def test_tag_overflow(self):
+        """Tags past the 64-bit mask fall back to row lists"""
+        columns = MetadataColumns()
+        columns.rebuild([{"topic_tags": [f"tag{i}"]} for i in range(MAX_TAG_BITS + 2)])
+
+        assert HasTag("tag0").mask(columns).nonzero()[0].tolist() == [0]
+        assert HasTag(f"tag{MAX_TAG_BITS + 1}").mask(columns).nonzero()[0].tolist() == [MAX_TAG_BITS + 1]
+        assert In("topic_tags", ["tag1", f"tag{MAX_TAG_BITS}"]).mask(columns).sum() == 2
+
+    def test_masks_cut_to_size(self, columns):
+        """A reader passing its snapshot size never sees a half-finished append"""
+        columns.rebuild([{"doc_id": "doc1", "subject_role": "coach", "topic_tags": [f"tag{i}"]}
+                         for i in range(MAX_TAG_BITS + 1)])
+        size = len(columns)
+        # Mid-append: two columns and an overflow list have grown, the row count has not
+        columns._columns["doc_id"].append(np.zeros(1, dtype=np.int32))
+        columns._columns["topic_tags"].append(np.ones(1, dtype=np.uint64))
+        columns._overflow_tags[f"tag{MAX_TAG_BITS}"].append(size)
+
+        where = Eq("doc_id", "doc1") & In("subject_role", ["coach"])
+        assert where.mask(columns, size).sum() == size
+        assert HasTag("tag0").mask(columns, size).nonzero()[0].tolist() == [0]
+        assert HasTag(f"tag{MAX_TAG_BITS}").mask(columns, size).nonzero()[0].tolist() == [MAX_TAG_BITS]
+
+    def test_rows_must_be_appended_in_order(self, columns):
+        """Column rows stay aligned with store rows"""
+        with pytest.raises(ValueError):
+            columns.append(10, [{"doc_id": "doc3"}])
+
+    def test_store_search_with_where(self, store):
+        """Filters are applied to the score vector of a vector search"""
+        store.add_document(make_document("doc1", ["coach rules", "coach whip"], subject_role="coach"))
+        store.add_document(make_document("doc2", ["coach points", "rider points"], section_id=7201))
+
+        results = store.search("coach", top_k=10, where=Eq("subject_role", "coach"))
+        assert {r.metadata["doc_id"] for r in results} == {"doc1"}
+
+        results = store.search("coach", top_k=10, where=Range("section_id", 7200, 7299))
+        assert {r.metadata["doc_id"] for r in results} == {"doc2"}
+
+        # filter_doc_id combines with where
+        assert store.search("coach", filter_doc_id="doc1", where=Eq("page", 2))[0].text == "coach whip"
+        assert store.search("coach", filter_doc_id="doc1", where=Eq("section_id", 7201)) == []
+
+    def test_where_skips_deleted_rows(self, store):
+        """Tombstoned rows never pass a filter"""
+        store._compact_deleted_ratio = 1.0
+        store.add_document(make_document("doc1", ["coach rules"], subject_role="coach"))
+        store.add_document(make_document("doc2", ["coach whip"], subject_role="coach"))
+        store.delete_document("doc1")
+
+        results = store.search("coach", top_k=10, where=Eq("subject_role", "coach"))
+        assert [r.metadata["doc_id"] for r in results] == ["doc2"]
+
+    def test_columns_follow_compaction(self, store):
+        """Columns are renumbered with the rows when dead rows are purged"""
+        store.add_document(make_document("doc1", ["coach rules", "whip rules", "horse rules"]))
+        store.add_document(make_document("doc2", ["coach points"], section_id=7201))
+        store.delete_document("doc1")
+
+        assert len(store._metadata_columns) == 1
+        assert store.search("coach", where=Eq("section_id", 7201))[0].metadata["doc_id"] == "doc2"
+
+
+class TestSearchMany:
+    """Test batched multi-query search"""
+
+    @pytest.fixture
+    def filled_store(self, store):
+        store.add_document(make_document("doc1", ["coach rules", "whip rules", "horse points"], subject_role="coach"))
+        store.add_document(make_document("doc2", ["rider points", "coach whip", "jump height"]))
+        return store
+
+    def test_matches_single_searches(self, filled_store):
+        """Each per-query list equals what search() returns for that query"""
+        queries = ["coach", "points", "whip height"]
+        batch = filled_store.search_many(queries, top_k=3)
+
+        assert len(batch.results) == 3 and batch.fused is None
+        for query, results in zip(queries, batch.results):
+            expected = filled_store.search(query, top_k=3)
+            assert [r.text for r in results] == [r.text for r in expected]
+            assert [r.score for r in results] == pytest.approx([r.score for r in expected])
+
+    def test_embeds_in_one_batch(self, filled_store, monkeypatch):
+        """Uncached queries go to the embedding service in one call; repeats hit the cache"""
+        calls = []
+        def embed_texts(texts):
+            calls.append(list(texts))
+            return [fake_embedding(t) for t in texts]
+        monkeypatch.setattr(filled_store, "embed_texts", embed_texts)
+
+        filled_store.search_many(["coach", "points", "coach"])
+        filled_store.search_many(["coach", "jump"])
+
+        assert calls == [["coach", "points"], ["jump"]]
+
+    def test_filters_and_deletes(self, filled_store):
+        """where, filter_doc_id and tombstones apply to every query"""
+        filled_store._compact_deleted_ratio = 1.0
+        batch = filled_store.search_many(["coach", "points"], top_k=10, where=Eq("subject_role", "coach"))
+        assert all(r.metadata["doc_id"] == "doc1" for results in batch.results for r in results)
+
+        filled_store.delete_document("doc1")
+        batch = filled_store.search_many(["coach", "points"], top_k=10)
+        assert all(r.metadata["doc_id"] == "doc2" for results in batch.results for r in results)
+        assert filled_store.search_many(["coach"], filter_doc_id="doc1").results == [[]]
+
+    def test_fused_ranking(self, filled_store):
+        """Rows found by several queries rank first in the fused list"""
+        batch = filled_store.search_many(["coach", "whip", "rules"], top_k=2, fuse=True)
+
+        assert len(batch.fused) == 2
+        texts = [r.text for r in batch.fused]
+        assert len(set(texts)) == len(texts)
+        counts = {t: sum(t in [r.text for r in results] for results in batch.results) for t in texts}
+        assert counts[texts[0]] >= max(counts.values())
+
+    def test_reciprocal_rank_fusion(self):
+        """RRF sums 1 / (60 + rank) and keeps each row's best score"""
+        fused = reciprocal_rank_fusion([
+            (np.array([3, 1]), np.array([0.9, 0.5])),
+            (np.array([1, 2]), np.array([0.7, 0.6])),
+        ], k=3)
+        assert [row for row, _ in fused] == [1, 3, 2]
+        assert dict(fused)[1] == pytest.approx(0.7)
+
+    def test_ann_path(self, ivf_store):
+        """With an ANN index each query's candidates are rescored exactly"""
+        ivf_store.add_document(corpus_document("doc1", 40))
+        assert ivf_store._ann_index is not None
+        queries = ["coach whip", "regionals points"]
+        batch = ivf_store.search_many(queries, top_k=5)
+        for query, results in zip(queries, batch.results):
+            assert [r.text for r in results] == [r.text for r in ivf_store.search(query, top_k=5)]
+
+    async def test_async(self, filled_store):
+        """search_many_async returns the same lists"""
+        batch = await filled_store.search_many_async(["coach", "points"], top_k=3, fuse=True)
+        assert [[r.text for r in results] for results in batch.results] == [
+            [r.text for r in results] for results in filled_store.search_many(["coach", "points"], top_k=3).results
+        ]
+        assert batch.fused
+
+    def test_empty(self, store):
+        """No rows or no queries give empty lists"""
+        assert store.search_many(["coach"]).results == [[]]
+        assert store.search_many([], fuse=True).fused == []
+
+
+class TestShardedSearch:
+    """Test scatter-gather search over row-range shards"""
+
+    @pytest.fixture
+    def sharded_store(self, store_settings, store, monkeypatch):
+        store_settings.vector_shards = 4
+        store_settings.vector_shard_min_rows = 8
+        sharded = reopen(monkeypatch)
+        sharded.add_document(corpus_document("doc1", 30))
+        sharded.add_document(corpus_document("doc2", 30))
+        return sharded
+
+    def test_shard_bounds(self, sharded_store):
+        """Rows are split into at most vector_shards contiguous ranges of min_rows or more"""
+        assert sharded_store._shard_bounds(60) == [(0, 15), (15, 30), (30, 45), (45, 60)]
+        assert sharded_store._shard_bounds(20) == [(0, 10), (10, 20)]
+        assert sharded_store._shard_bounds(10) == [(0, 10)]
+        assert sharded_store.get_stats()["shards"] == 4
+
+    def test_matches_unsharded_search(self, sharded_store):
+        """The heap merge of shard top-k lists equals one scan over every row"""
+        snapshot, excluded, _ = sharded_store._search_state(None, None)
+        embeddings, n = snapshot.embeddings, snapshot.size
+        for query in ["coach whip", "regionals points horse", "rule 7 jump"]:
+            vector = sharded_store.embed_query(query).reshape(1, -1)
+            rows, scores = sharded_store._scan(vector, embeddings, n, excluded, 7, None)[0]
+            exact = embeddings[:n] @ vector[0]
+            # Ties go to the lower row within and across shards
+            assert rows.tolist() == top_k_indices(exact, 7).tolist()
+            assert scores == pytest.approx(exact[rows])
+
+    def test_filters_deletes_and_many(self, sharded_store):
+        """Masks and batched queries work across shard boundaries"""
+        sharded_store._compact_deleted_ratio = 1.0
+        sharded_store.delete_document("doc1")
+
+        assert {r.metadata["doc_id"] for r in sharded_store.search("coach", top_k=20)} == {"doc2"}
+        assert sharded_store.search("coach", filter_doc_id="doc1") == []
+        batch = sharded_store.search_many(["coach", "jump"], top_k=5, where=Range("page", 20, 25))
+        assert all(20 <= r.metadata["page"] <= 25 for results in batch.results for r in results)
+        assert all(len(results) == 5 for results in batch.results)
+
+    def test_small_store_scans_inline(self, store_settings, store, monkeypatch):
+        """Below two shards' worth of rows no pool work is scheduled"""
+        store_settings.vector_shards = 4
+        store_settings.vector_shard_min_rows = 1000
+        sharded = reopen(monkeypatch)
+        sharded.add_document(corpus_document("doc1", 10))
+        monkeypatch.setattr(sharded, "_shard_executor", None)
+        assert len(sharded.search("coach", top_k=3)) == 3
+
+
+class TestSnapshots:
+    """Test copy-on-write read snapshots"""
+
+    def test_snapshot_is_unchanged_by_adds(self, store):
+        """Rows appended later are outside an older snapshot"""
+        store.add_document(make_document("doc1", ["coach rules", "whip rules"]))
+        before = store.snapshot()
+        store.add_document(make_document("doc2", ["horse points"]))
+        after = store.snapshot()
+
+        assert before.size == 2 and before.embeddings.shape[0] == 2
+        assert after.size == 3 and after.generation > before.generation
+        assert after.columns is before.columns  # Appends grow the same columns
+
+    def test_snapshot_is_unchanged_by_deletes(self, store):
+        """Deletes publish a new tombstone mask instead of writing the old one"""
+        store._compact_deleted_ratio = 1.0
+        store.add_document(make_document("doc1", ["coach rules"]))
+        store.add_document(make_document("doc2", ["coach whip"]))
+        before = store.snapshot()
+        store.delete_document("doc1")
+
+        assert before.deleted.tolist() == [False, False] and before.deleted_count == 0
+        assert store.snapshot().deleted.tolist() == [True, False]
+
+    def test_snapshot_survives_compaction(self, store):
+        """Purging rows builds new documents, matrix and indexes"""
+        store._compact_deleted_ratio = 1.0
+        store.add_document(make_document("doc1", ["coach rules", "whip rules"]))
+        store.add_document(make_document("doc2", ["horse points"]))
+        store.delete_document("doc1")
+        before = store.snapshot()
+        assert store.compact()
+
+        assert before.size == 3 and [d.chunk_id for d in before.documents] == [
+            "doc1_p1_c0", "doc1_p2_c0", "doc2_p1_c0"
+        ]
+        assert before.metadata_index.candidates({"doc_id": "doc2"}) == [2]
+        assert store.snapshot().metadata_index.candidates({"doc_id": "doc2"}) == [0]
+
+    def test_reads_stop_at_snapshot_size(self, store):
+        """Rows a writer has started appending are invisible until published"""
+        store.add_document(make_document("doc1", ["coach rules"]))
+        snapshot = store.snapshot()
+        store._documents.append(StoredDocument(chunk_id="x", text="coach coach", metadata={"doc_id": "x"}))
+        store._keyword_index.add(1, "coach coach")
+        store._metadata_index.add(1, {"doc_id": "x"})
+
+        assert store.snapshot() is snapshot
+        assert [r.text for r in store.keyword_scan(["coach"])] == ["coach rules"]
+        assert store.search_by_metadata({"doc_id": "x"}) == []
+        assert [d["doc_id"] for d in store.list_documents()] == ["doc1"]
+
+    @pytest.mark.parametrize("index", ["flat", "hnsw"])
+    def test_concurrent_search_and_ingest(self, store_settings, store, monkeypatch, index):
+        """Searches running during ingestion never see torn state"""
+        store_settings.vector_index = index
+        store_settings.ann_min_rows = 16
+        store_settings.ann_background_build = False
+        store_settings.hnsw_m = 4
+        store = reopen(monkeypatch)
+        errors = []
+        done = threading.Event()
+
+        def ingest():
+            try:
+                for i in range(40):
+                    store.add_document(corpus_document(f"doc{i}", 5))
+                    if i % 10 == 9:
+                        store.delete_document(f"doc{i - 5}")
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        writer = threading.Thread(target=ingest)
+        writer.start()
+        while not done.is_set():
+            try:
+                snapshot = store.snapshot()
+                assert len(snapshot.documents) >= snapshot.size
+                assert snapshot.size == 0 or snapshot.embeddings.shape[0] >= snapshot.size
+                for r in store.search("coach whip", top_k=5) + store.keyword_scan(["horse"], limit=5):
+                    assert r.text.startswith("rule ")
+                store.search_many(["points", "jump"], top_k=3)
+                where = In("subject_role", ["coach", "general"]) | HasTag("equipment")
+                for r in store.search("coach whip", top_k=5, filter_doc_id="doc3", where=where):
+                    assert r.metadata["doc_id"] == "doc3"
+            except Exception as e:
+                errors.append(e)
+                break
+        writer.join()
+
+        assert errors == []
+        assert store.get_stats()["total_chunks"] == 40 * 5 - 4 * 5
+
+
+class TestSharedMode:
+    """Test one writer process and read-only workers sharing the segment files"""
+
+    @pytest.fixture
+    def writer(self, store_settings, store, monkeypatch):
+        store_settings.vector_shared_mode = "writer"
+        writer = reopen(monkeypatch)
+        writer.add_document(make_document("doc1", ["coach rules", "whip rules"]))
+        writer.add_document(make_document("doc2", ["horse points"]))
+        return writer
+
+    def open_reader(self, store_settings, monkeypatch, background: bool = False):
+        """A second VectorStore, as another worker process would create"""
+        store_settings.vector_shared_mode = "reader"
+        store_settings.vector_refresh_interval = 0.0
+        store_settings.vector_background_refresh = background
+        reader = reopen(monkeypatch)
+        store_settings.vector_shared_mode = "writer"
+        return reader
+
+    def test_writer_appends_segments(self, writer, store_settings):
+        """Commits append segments; the writer does not rewrite the matrix every time"""
+        assert len(read_manifest(store_settings)["segments"]) == 2
+        writer.add_document(make_document("doc3", ["jump height"]))
+        assert len(read_manifest(store_settings)["segments"]) == 3
+        assert len(list((writer._persist_dir / "segments").iterdir())) == 3
+
+    def test_reader_memory_maps_matrix(self, writer, store_settings, monkeypatch):
+        """Readers attach every one of the writer's segments without copying them"""
+        reader = self.open_reader(store_settings, monkeypatch)
+        snapshot = reader.snapshot()
+
+        assert reader is not writer
+        assert isinstance(snapshot.embeddings, TailedRows)
+        assert all(isinstance(block, np.memmap) and not block.flags.writeable for block in snapshot.embeddings.blocks)
+        assert snapshot.size == 3
+        assert reader.search("horse points", top_k=1)[0].metadata["doc_id"] == "doc2"
+
+    def test_reader_rejects_writes(self, writer, store_settings, monkeypatch):
+        """Read-only workers neither change the store nor touch its files"""
+        reader = self.open_reader(store_settings, monkeypatch)
+        before = sorted(p.name for p in writer._persist_dir.rglob("*"))
+
+        assert reader.add_document(make_document("doc3", ["jump height"]))["status"] == "error"
+        assert reader.delete_document("doc1")["status"] == "error"
+        assert not reader.compact()
+        reader.clear()
+
+        assert reader.snapshot().size == 3
+        assert sorted(p.name for p in writer._persist_dir.rglob("*")) == before
+        with pytest.raises(RuntimeError):
+            reader._log.append([("c", "t", {})], np.zeros((1, EMBEDDING_DIM), dtype=np.float32))
+
+    def test_reader_reattaches_after_ingestion(self, writer, store_settings, monkeypatch):
+        """A new manifest generation is picked up on the next read"""
+        reader = self.open_reader(store_settings, monkeypatch)
+        before = reader.snapshot()
+
+        writer.add_document(make_document("doc3", ["jump height"]))
+        writer.delete_document("doc1")
+        after = reader.snapshot()
+
+        assert after.generation > before.generation and before.size == 3
+        assert {d["doc_id"] for d in reader.list_documents()} == {"doc2", "doc3"}
+        assert reader.search("jump height", top_k=1)[0].metadata["doc_id"] == "doc3"
+        assert not reader.refresh()  # Already at the latest generation
+
+    def test_reader_refreshes_in_background(self, writer, store_settings, monkeypatch):
+        """A read only notices the new generation; the reload happens off the request path"""
+        reader = self.open_reader(store_settings, monkeypatch, background=True)
+        before = reader.snapshot()
+        reloads = []
+        release = threading.Event()
+        load = reader._log.load
+
+        def slow_load():
+            reloads.append(threading.current_thread())
+            release.wait(timeout=10)
+            return load()
+        monkeypatch.setattr(reader._log, "load", slow_load)
+
+        writer.add_document(make_document("doc3", ["jump height"]))
+        # The reload is still blocked, yet the read returns the previous snapshot
+        assert reader.snapshot() is before
+        release.set()
+        reader._refresh_thread.join(timeout=10)
+
+        assert reloads and all(t is not threading.current_thread() for t in reloads)
+        after = reader.snapshot()
+        assert after.generation > before.generation and after.size == 4
+
+    def test_reader_keeps_unlisted_segments(self, writer, store_settings, monkeypatch):
+        """Only the writer may remove segments missing from the manifest"""
+        in_progress = writer._persist_dir / "segments" / "seg-99999999"
+        in_progress.mkdir()
+
+        self.open_reader(store_settings, monkeypatch)
+        assert in_progress.exists()
+
+        reopen(monkeypatch)
+        assert not in_progress.exists()
+
+
+class TestNeighborIndex:
+    """Test the ingest-time adjacency used by neighbor expansion"""
+
+    @pytest.fixture
+    def neighbors(self):
+        index = NeighborIndex()
+        index.rebuild([
+            {"doc_id": "doc1", "page": 1, "section_id": 7201, "topic_tags": ["points"]},
+            {"doc_id": "doc1", "page": 2, "section_id": 7207, "topic_tags": []},
+            {"doc_id": "doc1", "page": 2, "section_id": 7210, "topic_tags": ["points"]},
+            {"doc_id": "doc1", "page": 3, "section_id": None},
+            {"doc_id": "doc2", "page": 2, "section_id": 7203},
+        ])
+        return index
+
+    def test_adjacency(self, neighbors):
+        """Pages ±1 and section decades stay within a document"""
+        assert neighbors.adjacent_pages(1) == [[1, 2], [0], [3]]
+        assert neighbors.adjacent_pages(4) == [[4]]
+        assert neighbors.section_siblings(0) == [0, 1]
+        assert neighbors.section_siblings(2) == [2]
+        assert neighbors.section_siblings(3) == []
+        assert neighbors.tagged("points") == [0, 2]
+
+    def test_append_in_order(self, neighbors):
+        """Appended rows join existing groups"""
+        neighbors.append(5, [{"doc_id": "doc1", "page": 4, "section_id": 7209}])
+        assert neighbors.adjacent_pages(3) == [[3], [1, 2], [5]]
+        assert neighbors.section_siblings(5) == [0, 1, 5]
+        with pytest.raises(ValueError):
+            neighbors.append(9, [{}])
+
+    def test_live_rows(self):
+        """Fan-out skips dead rows and rows past the snapshot"""
+        deleted = np.array([False, True, False, False, False])
+        assert list(live_rows([0, 1, 2, 3, 4], 2, 5, deleted)) == [0, 2]
+        assert list(live_rows([0, 1, 2, 3, 4], 9, 3, deleted)) == [0, 2]
+
+    def test_expand_neighbors(self, store):
+        """Neighbors come from adjacent pages, the section decade and shared tags"""
+        store.add_document(make_document(
+            "doc1", ["coach rules", "whip rules", "horse rules", "jump rules"], section_id=None
+        ))
+        store.add_document(make_document("doc2", ["points one"], section_id=7201, topic_tags=["points"]))
+        store.add_document(make_document("doc3", ["points two", "points three"], section_id=7205, topic_tags=["points"]))
+
+        hit = store.search("whip rules", top_k=1)
+        assert hit[0].row == 1
+        expanded = store.expand_neighbors(hit)
+        assert [r.text for r in expanded] == ["whip rules", "coach rules", "horse rules"]
+        assert [r.score for r in expanded[1:]] == [0.8, 0.8]
+
+        expanded = store.expand_neighbors(store.search("points one", top_k=1))
+        assert {r.text: r.score for r in expanded[1:]} == {"points two": 0.75, "points three": 0.75}
+
+    def test_same_page_chunks_are_not_collapsed(self, store):
+        """Rows are deduplicated by ordinal, not by doc/page/chunk_index strings"""
+        store.add_document(make_document("doc1", [f"rule {w}" for w in ["coach", "whip", "horse", "jump", "points", "height", "age"]], page=1))
+
+        expanded = store.expand_neighbors(store.search("rule coach", top_k=1))
+        # Bounded fan-out: the page's first 5 rows, the hit among them
+        assert [r.row for r in expanded] == [0, 1, 2, 3, 4]
+
+    def test_skips_deleted_and_stale_rows(self, store):
+        """Dead rows are never expanded to; results from before compaction still resolve"""
+        store._compact_deleted_ratio = 1.0
+        store.add_document(make_document("doc0", ["coach rules"]))
+        store.add_document(make_document("doc1", ["whip rules", "horse rules", "jump rules"]))
+        hit = store.search("horse rules", top_k=1)
+        store.delete_document("doc0")
+        assert store.compact()
+
+        expanded = store.expand_neighbors(hit)
+        assert [r.text for r in expanded] == ["horse rules", "whip rules", "jump rules"]
+        assert [r.row for r in expanded[1:]] == [0, 2]
+
+
+class TestRuleLookup:
+    """Test the exact rule-number index"""
+
+    def test_normalization(self):
+        """Every spelling of a rule reference maps to the same key"""
+        assert normalize_rule_ref(1102, "a") == "1102A"
+        assert normalize_rule_ref("1102", ".A") == "1102A"
+        assert extract_rule_refs("Does Rule 1102.a or 1102A apply, and 4501?") == ["1102", "1102A", "4501"]
+        assert extract_rule_refs("how many points") == []
+        assert extract_rule_refs("Rule 1102.12 and 7207b") == ["1102", "110212", "7207", "7207B"]
+
+    def test_numbers_that_are_not_rules(self):
+        """Longer numbers, dashed numbers and digit suffixes are not rule references"""
+        assert extract_rule_refs("11025 entries") == []
+        assert extract_rule_refs("call 555-1234") == []
+        assert extract_rule_refs("rule 11029") == []
+        # A bare year is a candidate reference but never an explicit one
+        question = "Can a rider compete in the 2025 season under Rule 4501?"
+        assert extract_rule_refs(question) == ["2025", "4501"]
+        assert extract_rule_refs(question, explicit=True) == ["4501"]
+        assert extract_rule_refs("Section 7207.B and § 1102A", explicit=True) == ["7207", "7207B", "1102", "1102A"]
+        assert rule_keys({"section_id": 7207, "subrule": "B"}) == ["7207", "7207B"]
+        assert rule_keys({"section_id": None}) == []
+
+    @pytest.fixture
+    def rule_store(self, store):
+        store._compact_deleted_ratio = 1.0
+        store.add_document(make_document("doc1", ["coach age rule"], section_id=1102, subrule="A", rule_keys=["1102", "1102A"]))
+        store.add_document(make_document("doc2", ["coach card rule"], section_id=1102, subrule="B", rule_keys=["1102", "1102B"]))
+        # Stored before rule_keys existed: derived from section_id/subrule
+        store.add_document(make_document("doc3", ["alternate rule"], section_id=4501))
+        return store
+
+    def test_lookup_without_embedding(self, rule_store, monkeypatch):
+        """Explicit references resolve by dictionary lookup alone"""
+        def no_embedding(*args):
+            raise AssertionError("lookup_rules must not embed")
+        monkeypatch.setattr(rule_store, "embed_text", no_embedding)
+
+        assert [r.text for r in rule_store.lookup_rules(["1102B"])] == ["coach card rule"]
+        assert [r.text for r in rule_store.lookup_rules(["1102", "1102B"])] == ["coach card rule", "coach age rule"]
+        assert [r.text for r in rule_store.lookup_rules(["4501"])] == ["alternate rule"]
+        assert rule_store.lookup_rules(["9999"]) == []
+        assert len(rule_store.lookup_rules(["1102"], limit=1)) == 1
+
+    def test_lookup_filters(self, rule_store):
+        """filter_doc_id and deletes apply to rule lookups"""
+        assert [r.text for r in rule_store.lookup_rules(["1102"], filter_doc_id="doc2")] == ["coach card rule"]
+        rule_store.delete_document("doc1")
+        assert [r.metadata["doc_id"] for r in rule_store.lookup_rules(["1102A", "1102"])] == ["doc2"]
+
+
+class TestIdempotentUpload:
+    """Test re-uploads of an already indexed doc_id"""
+
+    @pytest.fixture
+    def counted_store(self, store, monkeypatch):
+        """Store that records every text sent for embedding"""
+        store._compact_deleted_ratio = 1.0
+        store.embedded = []
+
+        def embed_texts(texts):
+            store.embedded.extend(texts)
+            return [fake_embedding(t) for t in texts]
+        monkeypatch.setattr(store, "embed_texts", embed_texts)
+        store.add_document(make_document("doc1", ["coach rules", "whip rules"]))
+        return store
+
+    def test_same_content_is_noop(self, counted_store):
+        """Uploading the same document again neither embeds nor appends"""
+        counted_store.embedded.clear()
+        result = counted_store.add_document(make_document("doc1", ["coach rules", "whip rules"]))
+
+        assert result["unchanged"] and result["chunks_indexed"] == 0
+        assert result["total_documents"] == 2
+        assert counted_store.embedded == []
+        assert len(counted_store._documents) == 2
+        assert [r.text for r in counted_store.search("coach", top_k=10)].count("coach rules") == 1
+
+    def test_async_same_content_is_noop(self, counted_store):
+        """The async path skips unchanged documents too"""
+        result = asyncio.run(counted_store.add_document_async(make_document("doc1", ["coach rules", "whip rules"])))
+
+        assert result["unchanged"]
+        assert len(counted_store._documents) == 2
+
+    def test_changed_content_replaces_rows(self, counted_store):
+        """Changed chunks replace the old rows and only they are embedded"""
+        counted_store.embedded.clear()
+        result = counted_store.add_document(make_document("doc1", ["coach rules", "horse rules", "points"]))
+
+        assert result["chunks_indexed"] == 3 and result["chunks_replaced"] == 2
+        assert result["total_documents"] == 3
+        assert counted_store.embedded == ["horse rules", "points"]
+        assert counted_store._deleted.tolist() == [True, True, False, False, False]
+        assert np.allclose(counted_store._embeddings[2], counted_store._embeddings[0])
+        assert sorted(r.text for r in counted_store.search("rules", top_k=10)) == ["coach rules", "horse rules", "points"]
+        assert counted_store._chunk_rows == {"doc1_p1_c0": 2, "doc1_p2_c0": 3, "doc1_p3_c0": 4}
+        assert counted_store.get_stats()["total_chunks"] == 3
+
+    def test_replacement_is_one_commit(self, counted_store, monkeypatch):
+        """Readers never see both versions or neither: one publish per replacement"""
+        generation = counted_store.snapshot().generation
+        counted_store.add_document(make_document("doc1", ["coach points"]))
+
+        assert counted_store.snapshot().generation == generation + 1
+        assert [r.text for r in reopen(monkeypatch).search("coach", top_k=10)] == ["coach points"]
+
+    def test_chunk_map_follows_compaction(self, counted_store, monkeypatch):
+        """Compaction renumbers the chunk map and reloads rebuild it"""
+        counted_store.add_document(make_document("doc2", ["points"]))
+        counted_store.delete_document("doc1")
+        assert counted_store.compact()
+
+        assert counted_store._chunk_rows == {"doc2_p1_c0": 0}
+        reopened = reopen(monkeypatch)
+        assert reopened._chunk_rows == {"doc2_p1_c0": 0}
+        assert reopened.add_document(make_document("doc2", ["points"]))["unchanged"]